@@ -22,13 +22,17 @@
 #
 # *****************************************************************************
 
+import fnmatch
 import threading
+import time
 import xmlrpc.client
 from collections import OrderedDict
 from functools import partial
 
 import requests
 
+from marche.protocol import Errors
+
 
 class ClientError(Exception):
     def __init__(self, code, string):
@@ -37,9 +41,11 @@ class ClientError(Exception):
 
 
 class HttpTransport(xmlrpc.client.Transport):
+    timeout = 2.0
+
     def make_connection(self, host):
         retval = xmlrpc.client.Transport.make_connection(self, host)
-        self._connection[1].timeout = 2.0
+        self._connection[1].timeout = self.timeout
         return retval
 
 
@@ -47,8 +53,13 @@ class ServerProxy(xmlrpc.client.ServerProxy):
     def __del__(self):
         self('close')()
 
+    def close(self):
+        self('close')()
+
 
 class JsonProxy:
+    timeout = 3.0
+
     def __init__(self, url):
         self.url = url
         self.ses = requests.Session()
@@ -62,7 +73,7 @@ class JsonProxy:
             raise RuntimeError('not a jsonrpc server')
 
     def _request(self, method, *args):
-        result = self.ses.post(self.url, timeout=3.0, json={
+        result = self.ses.post(self.url, timeout=self.timeout, json={
             'jsonrpc': '2.0',
             'method': method,
             'id': 1,
@@ -77,11 +88,18 @@ class JsonProxy:
                               result['error']['message'])
         return result['result']
 
+    def close(self):
+        self.ses.close()
+
     def __getattr__(self, method):
         return partial(self._request, method)
 
 
 class Client:
+    # maximum time for bulk commands, which start services one after another
+    # if they depend on each other
+    BULK_TIMEOUT = 600.0
+
     def __init__(self, host, port, user=None, passwd=None):
         self.host = host
         self.port = port
@@ -89,19 +107,29 @@ class Client:
         self.passwd = passwd
 
         if user is not None and passwd is not None:
-            url = f'http://{user}:{passwd}@{host}:{port}/xmlrpc'
+            self._url = f'http://{user}:{passwd}@{host}:{port}/xmlrpc'
         else:
-            url = f'http://{host}:{port}/xmlrpc'
-
-        try:
-            self._proxy = JsonProxy(url)
-        except Exception:
-            self._proxy = ServerProxy(url, transport=HttpTransport())
+            self._url = f'http://{host}:{port}/xmlrpc'
+        self._proxy = self._makeProxy()
 
         self._lock = threading.Lock()
         self._pollThread = None
+        # separate proxy for long-running waits, see waitEvents
+        self._waitProxy = None
         self.version = self.getVersion()
 
+    def _makeProxy(self, timeout=None):
+        try:
+            proxy = JsonProxy(self._url)
+            if timeout is not None:
+                proxy.timeout = timeout
+        except Exception:
+            transport = HttpTransport()
+            if timeout is not None:
+                transport.timeout = timeout
+            proxy = ServerProxy(self._url, transport=transport)
+        return proxy
+
     def withCredentials(self, user, passwd):
         return self.__class__(self.host, self.port, user, passwd)
 
@@ -139,6 +167,39 @@ class Client:
 
         return result
 
+    def getServiceList(self):
+        """Return the services like `getServices`, their descriptions like
+        `getServiceDescriptions` and the full service info (None for daemons
+        before protocol version 3), using a single request if possible.
+        """
+        if self.version < 3:
+            services = self.getServices()
+            try:
+                descrs = self.getServiceDescriptions(services)
+            except Exception:
+                descrs = {}
+            return services, descrs, None
+        info = self.getAllServiceInfo()
+        result = OrderedDict()
+        singleJobs = []
+        descrs = {}
+        for service, svcinfo in info.items():
+            instances = sorted(svcinfo['instances'])
+            if not instances:
+                continue
+            for instance, instinfo in svcinfo['instances'].items():
+                descrs[service, instance] = instinfo['desc']
+            if instances[0] == '':
+                # sort single jobs to the end, like getServices
+                instances.append(instances.pop(0))
+                if len(instances) == 1:
+                    singleJobs.append(service)
+                    continue
+            result[service] = instances
+        for service in singleJobs:
+            result[service] = ['']
+        return result, descrs, info
+
     def getServiceDescriptions(self, services):
         result = {}
         if self.version >= 3:
@@ -160,6 +221,43 @@ class Client:
         with self._lock:
             return self._proxy.GetAllServiceInfo()
 
+    def getServiceInfoUpdate(self, generation=''):
+        """Return a tuple of the service list generation and the service
+        info, which is None if unchanged since the given generation.
+        """
+        if self.version < 5:
+            # the generation is new in version 5
+            return None, self.getAllServiceInfo()
+        with self._lock:
+            result = self._proxy.GetAllServiceInfo(generation or '')
+        return result['generation'], result.get('services')
+
+    def waitEvents(self, since, timeout=5.0):
+        """Wait at most *timeout* seconds for status events after the event
+        sequence number *since* (a negative number just returns the current
+        sequence number).
+
+        Returns a tuple of the new sequence number, the list of events (dicts
+        with service, instance, state and ext_status) and a flag indicating
+        if events have been missed, in which case the full status should be
+        queried again.
+
+        If the daemon has no capacity for waiting clients, this waits for
+        the time it asks for without being notified of events.
+        """
+        # New in protocol version 5.
+        if self._waitProxy is None or self._waitProxy[0] < timeout + 3.0:
+            self._waitProxy = (timeout + 3.0, self._makeProxy(timeout + 3.0))
+        try:
+            result = self._waitProxy[1].WaitEvents(since, timeout)
+        except OSError as e:
+            raise ClientError(99, f'marched: {e}') from None
+        except xmlrpc.client.Fault as f:
+            raise ClientError(f.faultCode, f.faultString) from None
+        if 'retry_after' in result:
+            time.sleep(min(result['retry_after'], timeout))
+        return result['seq'], result['events'], result['lost']
+
     def getServicePath(self, service, instance):
         return f'{service}.{instance}' if instance else service
 
@@ -199,6 +297,61 @@ class Client:
         if self._pollThread:
             self._pollThread.poll(service, instance)
 
+    def controlServices(self, action, patterns):
+        """Start, stop or restart (*action*) all services matching the
+        *patterns* (service names or shell-style patterns of them).
+
+        Returns a list of dicts with the service name, an error code (0 on
+        success) and message for each service.
+        """
+        if self.version < 6:
+            # bulk commands are new in version 6: match the services here
+            # and control them one by one
+            return self._controlServicesSingle(action, patterns)
+        # the call can wait for services to start, so it gets a connection
+        # of its own instead of blocking the other calls
+        try:
+            proxy = self._makeProxy(self.BULK_TIMEOUT)
+            try:
+                result = proxy.BulkControl(action, list(patterns))
+            finally:
+                proxy.close()
+        except OSError as e:
+            raise ClientError(99, f'marched: {e}') from None
+        except xmlrpc.client.Fault as f:
+            raise ClientError(f.faultCode, f.faultString) from None
+        if self._pollThread:
+            self._pollThread.poll(None, None)
+        return result
+
+    def _controlServicesSingle(self, action, patterns):
+        method = {'start': self.startService, 'stop': self.stopService,
+                  'restart': self.restartService}[action]
+        result = []
+        unmatched = set(patterns)
+        for service, instances in self.getServices().items():
+            for instance in instances:
+                name = self.getServicePath(service, instance)
+                matched = {pattern for pattern in patterns
+                           if fnmatch.fnmatchcase(name, pattern) or
+                           ('.' not in pattern and
+                            fnmatch.fnmatchcase(service, pattern))}
+                if not matched:
+                    continue
+                unmatched -= matched
+                try:
+                    method(service, instance)
+                except ClientError as err:
+                    result.append({'service': name, 'error': err.code,
+                                   'message': str(err)})
+                else:
+                    result.append({'service': name, 'error': 0,
+                                   'message': ''})
+        result.extend({'service': pattern, 'error': Errors.FAULT,
+                       'message': f'no such service: {pattern}'}
+                      for pattern in patterns if pattern in unmatched)
+        return result
+
     def getServiceStatus(self, service, instance=''):
         servicePath = self.getServicePath(service, instance)
         try:
@@ -229,6 +382,42 @@ class Client:
         except xmlrpc.client.Fault as f:
             raise ClientError(f.faultCode, f.faultString) from None
 
+    def getServiceLogFiles(self, service, instance=''):
+        """Return the logs of the service as a dict of contents per file."""
+        if self.version < 6:
+            # older daemons return lines prefixed with the file name, which
+            # can't be split correctly if the file name contains a colon
+            files = {}
+            for line in self.getServiceLogs(service, instance):
+                fname, _, line = line.partition(':')
+                files[fname] = files.get(fname, '') + line
+            return files
+        servicePath = self.getServicePath(service, instance)
+        try:
+            with self._lock:
+                return self._proxy.GetLogFiles(servicePath)
+        except OSError as e:
+            raise ClientError(99, f'marched: {e}') from None
+        except xmlrpc.client.Fault as f:
+            raise ClientError(f.faultCode, f.faultString) from None
+
+    def followServiceLogs(self, service, instance='', cursors=None):
+        """Return the log contents added since the last call, as a tuple of
+        (dict of new contents per file, dict of cursors for the next call).
+        """
+        if self.version < 5:
+            # incremental logs are new in version 5: return the full logs
+            return self.getServiceLogFiles(service, instance), {}
+        servicePath = self.getServicePath(service, instance)
+        try:
+            with self._lock:
+                result = self._proxy.FollowLogs(servicePath, cursors or {})
+        except OSError as e:
+            raise ClientError(99, f'marched: {e}') from None
+        except xmlrpc.client.Fault as f:
+            raise ClientError(f.faultCode, f.faultString) from None
+        return result['files'], result['cursors']
+
     def getVersion(self):
         with self._lock:
             return int(self._proxy.GetVersion().strip('v')[:1])
@@ -37,6 +37,7 @@ from marche.permission import DISPLAY, STRING_LEVELS
 class Config:
     """An object that represents all merged Marche configuration files."""
 
+    general_config = {}
     job_config = {}
     auth_config = {}
     iface_config = {}
@@ -47,9 +48,22 @@ class Config:
         self.reload()
 
     def reload(self):
+        """Read the configuration again.  If that fails, the previous
+        configuration is kept.
+        """
+        previous = dict(self.__dict__)
+        try:
+            self._reload()
+        except Exception:
+            self.__dict__.clear()
+            self.__dict__.update(previous)
+            raise
+
+    def _reload(self):
         confdir = self.confdir
         self.__dict__.clear()
         self.confdir = confdir
+        self.general_config = {}
         self.job_config = OrderedDict()
         self.auth_config = {}
         self.iface_config = {}
@@ -68,6 +82,7 @@ class Config:
 
         for section, content in conf.items():
             if section == 'general':
+                self.general_config.update(content)
                 if 'unauth_level' in content:
                     perm = content['unauth_level']
                     self.unauth_level = STRING_LEVELS.get(perm.lower(),
@@ -0,0 +1,177 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Watching the configuration directory for changes."""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import threading
+
+from marche.config import tomllib
+
+# inotify(7) constants
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+
+def inotify_open(path):
+    """Return an inotify file descriptor watching *path*, or None if inotify
+    is not available.
+    """
+    libname = ctypes.util.find_library('c')
+    if not libname:
+        return None
+    try:
+        libc = ctypes.CDLL(libname, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class ConfigWatcher:
+    """Calls *callback* when the ``*.conf`` files in *confdir* change.
+
+    Changes are detected with inotify if possible, otherwise by checking the
+    files periodically.  The callback is only called once the files have not
+    been changed for `DEBOUNCE` seconds, and if all of them can be parsed, so
+    that files being written or copied one after another cause one reload.
+    """
+
+    DEBOUNCE = 1.0
+    POLL_INTERVAL = 5.0
+
+    def __init__(self, confdir, callback, log):
+        self.confdir = confdir
+        self.callback = callback
+        self.log = log
+        self._stopflag = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopflag.clear()
+        self._thread = threading.Thread(target=self._entry, daemon=True,
+                                        name='confwatch')
+        self._thread.start()
+
+    def stop(self):
+        self._stopflag.set()
+        if self._thread:
+            self._thread.join()
+
+    def _state(self):
+        """Return the names, modification times and sizes of the files."""
+        state = {}
+        for fn in self.confdir.glob('*.conf'):
+            try:
+                st = fn.stat()
+            except OSError:
+                continue
+            state[fn.name] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def _valid(self):
+        fn = None
+        try:
+            for fn in sorted(self.confdir.glob('*.conf')):
+                tomllib.loads(fn.read_text())
+        except (OSError, ValueError) as err:
+            self.log.warning('not reloading, cannot read %s: %s', fn, err)
+            return False
+        return True
+
+    def _entry(self):
+        fd = inotify_open(self.confdir)
+        if fd is None:
+            self.log.info('watching %s for changes every %s s',
+                          self.confdir, self.POLL_INTERVAL)
+        else:
+            self.log.info('watching %s for changes', self.confdir)
+        try:
+            self._run(fd)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _wait(self, fd):
+        """Wait until there might be changes."""
+        if fd is None:
+            self._stopflag.wait(self.POLL_INTERVAL)
+            return
+        # check the stop flag at least every second
+        while not self._stopflag.is_set():
+            if select.select([fd], [], [], 1.0)[0]:
+                self._drain(fd)
+                return
+
+    def _drain(self, fd):
+        if fd is None:
+            return
+        try:
+            while os.read(fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _run(self, fd):
+        state = self._state()
+        while not self._stopflag.is_set():
+            self._wait(fd)
+            new_state = self._state()
+            if new_state == state:
+                continue
+            # wait until the files have not changed for a while
+            while not self._stopflag.wait(self.DEBOUNCE):
+                settled_state = self._state()
+                if settled_state == new_state:
+                    break
+                new_state = settled_state
+            else:
+                return
+            # events during the wait are covered by the new state
+            self._drain(fd)
+            if new_state == state or not self._valid():
+                continue
+            state = new_state
+            self.log.info('configuration changed, reloading')
+            try:
+                self.callback()
+            except Exception:
+                self.log.exception('reloading the configuration failed')
@@ -226,6 +226,9 @@ def single_status(cl, service, sts=None):
 
 
 def wait_status(cl, service):
+    if cl.version >= 5:
+        wait_status_events(cl, service)
+        return
     for _i in range(10):
         sts = single_status(cl, service)
         if sts not in (STARTING, INITIALIZING, STOPPING):
@@ -233,6 +236,20 @@ def wait_status(cl, service):
         time.sleep(0.5)
 
 
+def wait_status_events(cl, service, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    seq = cl.waitEvents(-1, 0)[0]
+    sts = single_status(cl, service)
+    while sts in (STARTING, INITIALIZING, STOPPING):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        seq, events, lost = cl.waitEvents(seq, remaining)
+        if lost or any(cl.getServicePath(ev['service'], ev['instance']) ==
+                       service for ev in events):
+            sts = single_status(cl, service)
+
+
 def run():
     try:
         marchec()
@@ -34,6 +34,7 @@ import mlzlog
 from marche import __version__
 from marche.auth import AuthHandler
 from marche.config import Config
+from marche.confwatch import ConfigWatcher
 from marche.handler import JobHandler
 from marche.loghandlers import JournalHandler
 from marche.utils import get_default_cfgdir
@@ -148,6 +149,12 @@ class Daemon:
             signal.signal(signal.SIGUSR1,
                           lambda *_a: jobhandler.trigger_reload())
 
+        watcher = None
+        if self.config.general_config.get('watch_config', False):
+            watcher = ConfigWatcher(self.config.confdir,
+                                    jobhandler.trigger_reload, self.log)
+            watcher.start()
+
         self.log.info('startup successful')
         # notify systemd about startup
         if self.args.systemd:
@@ -155,6 +162,8 @@ class Daemon:
 
         self.wait()
 
+        if watcher:
+            watcher.stop()
         jobhandler.shutdown()
         return 0
 
@@ -76,6 +76,12 @@ class JobButtons(JobButtonsUI, QWidget):
         menu.addAction(self.actionConfigure)
         self.moreBtn.setMenu(menu)
 
+    def servicePath(self):
+        return self._client.getServicePath(self._service, self._instance)
+
+    def showError(self, text):
+        self._item.setText(3, text)
+
     @pyqtSlot()
     def on_startBtn_clicked(self):
         self._item.setText(3, '')
@@ -240,20 +246,16 @@ class JobButtons(JobButtonsUI, QWidget):
     def on_actionShow_logfiles_triggered(self):
         self._item.setText(3, '')
         try:
-            loglines = self._client.getServiceLogs(self._service,
-                                                   self._instance)
+            logfiles = self._client.getServiceLogFiles(self._service,
+                                                       self._instance)
         except ClientError as err:
             self._item.setText(3, str(err))
             return
-        if not loglines:
+        if not logfiles:
             self._item.setText(3, 'Service does not return logs')
             return
-        logs = []
-        for logline in loglines:
-            filename, content = logline.split(':', 1)
-            if not logs or filename != logs[-1][0]:
-                logs.append((filename, []))
-            logs[-1][1].append(content)
+        logs = [(filename, [content])
+                for (filename, content) in logfiles.items()]
         self.showDetails('Log files', logs)
 
     @pyqtSlot()
@@ -296,25 +298,38 @@ class JobButtons(JobButtonsUI, QWidget):
 
 
 class MultiJobButtons(JobButtonsUI, QWidget):
-    def __init__(self, buttons, parent=None):
+    def __init__(self, client, buttons, parent=None):
         QWidget.__init__(self, parent)
         self.setupUi(self)
 
         self.stacker.setCurrentIndex(1)
+        self._client = client
         self._buttons = buttons
         self.setMinimumSize(QSize(30, 40))
 
+    def _control(self, action):
+        # all instances with one call, if the daemon supports it
+        buttons = {button.servicePath(): button for button in self._buttons}
+        for button in self._buttons:
+            button.showError('')
+        try:
+            results = self._client.controlServices(action, list(buttons))
+        except ClientError as err:
+            for button in self._buttons:
+                button.showError(str(err))
+            return
+        for result in results:
+            if result['error'] and result['service'] in buttons:
+                buttons[result['service']].showError(result['message'])
+
     @pyqtSlot()
     def on_startBtn_clicked(self):
-        for button in self._buttons:
-            button.on_startBtn_clicked()
+        self._control('start')
 
     @pyqtSlot()
     def on_stopBtn_clicked(self):
-        for button in self._buttons:
-            button.on_stopBtn_clicked()
+        self._control('stop')
 
     @pyqtSlot()
     def on_restartBtn_clicked(self):
-        for button in self._buttons:
-            button.on_restartBtn_clicked()
+        self._control('restart')
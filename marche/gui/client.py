@@ -29,7 +29,8 @@ from collections import OrderedDict
 
 from marche.client import Client as BaseClient
 from marche.client import ClientError
-from marche.gui.qt import QThread, pyqtSignal
+from marche.gui.poller import Poller
+from marche.gui.qt import QObject, QThread, pyqtSignal
 from marche.gui.util import loadSetting
 from marche.jobs import NOT_AVAILABLE
 
@@ -37,9 +38,12 @@ __all__ = ['Client', 'ClientError']
 
 
 class PollThread(QThread):
+    """Polls the status of each service of a daemon that does not support
+    bulk queries (protocol version 2 and older).
+    """
+
     # service, instance, status, error info
     newData = pyqtSignal(object, object, int, object)
-    newBulkData = pyqtSignal(object)
 
     def __init__(self, host, port, user=None, passwd=None, loopDelay=3.0,
                  parent=None):
@@ -57,24 +61,15 @@ class PollThread(QThread):
             if self._client is None:
                 break  # thread has been deleted
 
-            if self._client.version >= 3:
-                try:
-                    services = self._client.getAllServiceInfo()
-                except Exception:
-                    self.newBulkData.emit(None)
-                else:
-                    self.newBulkData.emit(services)
-
-            else:
-                try:
-                    services = self._client.getServices()
-                except Exception:
-                    services = OrderedDict()
-                    self.newData.emit(None, None, NOT_AVAILABLE, '')
-
-                for service, instances in services.items():
-                    for instance in instances:
-                        self.poll(service, instance)
+            try:
+                services = self._client.getServices()
+            except Exception:
+                services = OrderedDict()
+                self.newData.emit(None, None, NOT_AVAILABLE, '')
+
+            for service, instances in services.items():
+                for instance in instances:
+                    self.poll(service, instance)
 
             self._event.wait(self._loopDelay)
 
@@ -87,6 +82,40 @@ class PollThread(QThread):
         self.newData.emit(service, instance, status, info)
 
 
+class SharedPoll(QObject):
+    """Polls the service info of a client with the poller shared by all
+    clients, and stands in for its PollThread.
+    """
+
+    newBulkData = pyqtSignal(object)
+
+    _poller = None
+
+    def __init__(self, client, slot, parent=None):
+        QObject.__init__(self, parent)
+        self.newBulkData.connect(slot)
+        interval = loadSetting('pollInterval', 3, valtype=float)
+        if SharedPoll._poller is None:
+            SharedPoll._poller = Poller(interval)
+            SharedPoll._poller.start()
+        # the setting might have changed since the poller was started
+        self._poller.interval = interval
+        self._poller.add(self, client.host, client.port, client.user,
+                         client.passwd, callback=self._newData)
+        # the user is waiting for this host, don't stagger the first poll
+        self._poller.refresh(self)
+
+    def _newData(self, _key, services):
+        # called in the poller thread, the signal is queued to the GUI thread
+        self.newBulkData.emit(services)
+
+    def poll(self, _service, _instance):
+        self._poller.refresh(self)
+
+    def stop(self):
+        self._poller.remove(self)
+
+
 class Client(BaseClient):
 
     def reloadJobs(self):
@@ -94,7 +123,10 @@ class Client(BaseClient):
         BaseClient.reloadJobs(self)
 
     def stopPoller(self, *, join=False):
-        if self._pollThread:
+        if isinstance(self._pollThread, SharedPoll):
+            self._pollThread.stop()
+            self._pollThread = None
+        elif self._pollThread:
             self._pollThread.running = False
             # ruff: noqa: SLF001
             self._pollThread._client = None
@@ -103,6 +135,10 @@ class Client(BaseClient):
                 self._pollThread.wait()
 
     def startPoller(self, slot, slot2):
+        if self.version >= 3:
+            # daemons that support bulk queries are all polled by one thread
+            self._pollThread = SharedPoll(self, slot2)
+            return
         self._pollThread = PollThread(self.host,
                                       self.port,
                                       self.user,
@@ -110,5 +146,4 @@ class Client(BaseClient):
                                       loadSetting('pollInterval', 3,
                                                   valtype=float))
         self._pollThread.newData.connect(slot)
-        self._pollThread.newBulkData.connect(slot2)
         self._pollThread.start()
@@ -83,6 +83,7 @@ class HostTree(QTreeWidget):
         self.headerItem().setText(3, 'Last error')
         self._items = {}
         self._virt_items = {}
+        self._svc_items = {}
         try:
             self.fill()
         except Exception as err:
@@ -98,67 +99,119 @@ class HostTree(QTreeWidget):
         self.itemClicked.connect(self.on_itemClicked)
 
     def refresh(self):
-        self.clear()
         self.fill()
 
     def clear(self):
         self._client.stopPoller()
         self._items.clear()
+        self._virt_items.clear()
+        self._svc_items.clear()
         QTreeWidget.clear(self)
 
     def fill(self):
-        self.clear()
-        services = self._client.getServices()
+        """Update the tree from the current service list of the daemon.
+
+        Only the rows of added or removed services and instances are changed,
+        the others (and their buttons) are kept.
+        """
+        self._client.stopPoller()
+        services, descrs, info = self._client.getServiceList()
+
+        self.setUpdatesEnabled(False)
         try:
-            descrs = self._client.getServiceDescriptions(services)
-        except Exception:
-            descrs = {}
-
-        for service, instances in services.items():
-            serviceItem = QTreeWidgetItem([service])
-            serviceItem.setForeground(1, self._brushes['white'])
-            serviceItem.setTextAlignment(1, Qt.AlignmentFlag.AlignCenter)
-            serviceItem.setFlags(Qt.ItemFlag.ItemIsEnabled)
-            serviceItem.setForeground(3, self._brushes['red'])
-            self.addTopLevelItem(serviceItem)
-
-            btns = []
-            has_empty_instance = None
-            for instance in instances:
-                if not instance:
-                    has_empty_instance = True
-                    continue
-                instanceItem = QTreeWidgetItem([instance])
-                instanceItem.setForeground(1, self._brushes['white'])
-                instanceItem.setTextAlignment(1, Qt.AlignmentFlag.AlignCenter)
-                instanceItem.setFlags(Qt.ItemFlag.ItemIsEnabled)
-                instanceItem.setForeground(3, self._brushes['red'])
-                if descrs.get((service, instance)):
-                    instanceItem.setText(0, descrs[service, instance])
-                serviceItem.addChild(instanceItem)
-
-                btn = JobButtons(self._client, service, instance,
-                                 instanceItem)
-                btns.append(btn)
-                self.setItemWidget(instanceItem, 2, btn)
+            self._updateItems(services, descrs)
+        finally:
+            self.setUpdatesEnabled(True)
+        if info is not None:
+            # show the states right away, not only after the first poll
+            self.updateBulkStatus(info)
+
+        self._client.startPoller(self.updateStatus, self.updateBulkStatus)
+        self.expandAll()
+
+    def _newItem(self, text):
+        item = QTreeWidgetItem([text])
+        item.setForeground(1, self._brushes['white'])
+        item.setTextAlignment(1, Qt.AlignmentFlag.AlignCenter)
+        item.setFlags(Qt.ItemFlag.ItemIsEnabled)
+        item.setForeground(3, self._brushes['red'])
+        return item
+
+    def _updateItems(self, services, descrs):
+        # remove services that are gone, or changed between having a job for
+        # the service itself and only jobs for instances
+        for service in list(self._svc_items):
+            instances = services.get(service)
+            if instances is None or \
+               ('' in instances) != ((service, '') in self._items):
+                self._removeService(service)
+        # items can't be moved without losing their buttons, so rebuild the
+        # tree if the order has changed
+        current = [self.topLevelItem(i).data(0, Qt.ItemDataRole.UserRole)
+                   for i in range(self.topLevelItemCount())]
+        if [svc for svc in services if svc in self._svc_items] != current:
+            self.clear()
+
+        for index, (service, instances) in enumerate(services.items()):
+            serviceItem = self._svc_items.get(service)
+            if serviceItem is None:
+                serviceItem = self._newItem(service)
+                serviceItem.setData(0, Qt.ItemDataRole.UserRole, service)
+                self.insertTopLevelItem(index, serviceItem)
+                self._svc_items[service] = serviceItem
+            self._updateService(serviceItem, service, instances, descrs)
+
+    def _removeService(self, service):
+        item = self._svc_items.pop(service)
+        self.takeTopLevelItem(self.indexOfTopLevelItem(item))
+        self._virt_items.pop(service, None)
+        for key in [key for key in self._items if key[0] == service]:
+            del self._items[key]
+
+    def _updateService(self, serviceItem, service, instances, descrs):
+        children = [instance for instance in instances if instance]
+        current = [serviceItem.child(i).data(0, Qt.ItemDataRole.UserRole)
+                   for i in range(serviceItem.childCount())]
+        if [inst for inst in children if inst in current] != \
+           [inst for inst in current if inst in children]:
+            # changed order: recreate all instances
+            serviceItem.takeChildren()
+            for instance in current:
+                del self._items[service, instance]
+            current = []
+        changed = False
+        for instance in current:
+            if instance not in children:
+                serviceItem.removeChild(self._items.pop((service, instance)))
+                changed = True
+
+        for index, instance in enumerate(children):
+            instanceItem = self._items.get((service, instance))
+            if instanceItem is None:
+                instanceItem = self._newItem(instance)
+                instanceItem.setData(0, Qt.ItemDataRole.UserRole, instance)
+                serviceItem.insertChild(index, instanceItem)
+                self.setItemWidget(instanceItem, 2, JobButtons(
+                    self._client, service, instance, instanceItem))
                 self._items[service, instance] = instanceItem
-            if has_empty_instance:
-                btn = JobButtons(self._client, service, '',
-                                 serviceItem)
+                changed = True
+            instanceItem.setText(0, descrs.get((service, instance)) or
+                                 instance)
+
+        if '' in instances:
+            if (service, '') not in self._items:
+                btn = JobButtons(self._client, service, '', serviceItem)
                 btn.setMinimumSize(QSize(30, 40))
                 self.setItemWidget(serviceItem, 2, btn)
-                if descrs.get((service, '')):
-                    serviceItem.setText(0, descrs[service, ''])
                 self._items[service, ''] = serviceItem
-            else:
-                # create "virtual" job with buttons that start/stop all
-                # instances of the service
-                self._virt_items[service] = serviceItem
-                multibtn = MultiJobButtons(btns)
-                self.setItemWidget(serviceItem, 2, multibtn)
-
-        self._client.startPoller(self.updateStatus, self.updateBulkStatus)
-        self.expandAll()
+            serviceItem.setText(0, descrs.get((service, '')) or service)
+        elif changed:
+            # create "virtual" job with buttons that start/stop all
+            # instances of the service
+            self._virt_items[service] = serviceItem
+            btns = [self.itemWidget(serviceItem.child(i), 2)
+                    for i in range(serviceItem.childCount())]
+            self.setItemWidget(serviceItem, 2, MultiJobButtons(self._client, btns))
 
     def updateBulkStatus(self, data):
         model = self.model()
@@ -196,7 +249,7 @@ class HostTree(QTreeWidget):
         item.setForeground(1, self._brushes[colors[0]])
         item.setBackground(1, self._brushes[colors[1]])
         item.setText(1, STATE_STR[status])
-        item.setData(1, 32, status)
+        item.setData(1, Qt.ItemDataRole.UserRole, status)
         if info is not None:
             item.setText(3, info)
 
@@ -212,7 +265,7 @@ class HostTree(QTreeWidget):
         statuses = {}
         total = item.childCount()
         for i in range(total):
-            chst = item.child(i).data(1, 32)
+            chst = item.child(i).data(1, Qt.ItemDataRole.UserRole)
             count = statuses.setdefault(chst, 0)
             statuses[chst] = count + 1
         if not statuses:
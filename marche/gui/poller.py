@@ -0,0 +1,247 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Polling the service status of many daemons from a single thread.
+
+This module does not depend on Qt; the GUI connects the callbacks to signals.
+"""
+
+import asyncio
+import threading
+import xmlrpc.client
+
+import aiohttp
+
+from marche.client import ClientError
+
+# fraction of the poll interval between the first polls of consecutive hosts,
+# which spreads them evenly over the interval however many hosts there are
+STAGGER = 0.6180339887
+
+
+class PolledHost:
+    """The polling state of one daemon."""
+
+    def __init__(self, key, host, port, user, passwd, callback, offset):
+        self.key = key
+        self.url = f'http://{host}:{port}/xmlrpc'
+        self.auth = aiohttp.BasicAuth(user, passwd) \
+            if user is not None and passwd is not None else None
+        self.callback = callback
+        self.offset = offset
+        self.json = True
+        self.version = None
+        self.task = None
+        self.wakeup = asyncio.Event()
+
+
+class Poller:
+    """Polls the service info of any number of daemons.
+
+    All daemons are polled by coroutines in one thread, using one pool of
+    keep-alive connections.  Daemons with protocol version 5 are asked to
+    report status changes as soon as they happen; older ones (of at least
+    version 3) are polled every *interval* seconds.  The first polls of the
+    hosts are staggered over the interval, unless requested by `refresh`.
+
+    For each host, *callback* is called (in the poller thread) with the key
+    given to `add` and the service info, or None if the daemon cannot be
+    reached.
+    """
+
+    # maximum time to wait for events from daemons that support it
+    WAIT_TIMEOUT = 5.0
+
+    def __init__(self, interval=3.0, timeout=3.0):
+        self.interval = interval
+        self.timeout = timeout
+        self._hosts = {}
+        self._added = 0
+        self._loop = None
+        self._session = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._entry, daemon=True,
+                                        name='poller')
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if self._thread:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def add(self, key, host, port, user=None, passwd=None, *, callback):
+        """Start polling a daemon; a host already polled under *key* is
+        replaced.
+        """
+        self._loop.call_soon_threadsafe(self._add, key, host, port, user,
+                                        passwd, callback)
+
+    def remove(self, key):
+        self._loop.call_soon_threadsafe(self._remove, key)
+
+    def refresh(self, key):
+        """Poll the daemon under *key* now, e.g. after a service was
+        started.
+        """
+        self._loop.call_soon_threadsafe(self._refresh, key)
+
+    def _entry(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._open())
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            for key in list(self._hosts):
+                self._remove(key)
+            tasks = asyncio.all_tasks(self._loop)
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.run_until_complete(self._session.close())
+            self._loop.close()
+
+    async def _open(self):
+        # one connection for waiting for events, one for other calls
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=2))
+
+    def _add(self, key, host, port, user, passwd, callback):
+        self._remove(key)
+        offset = (self._added * STAGGER) % 1.0 * self.interval
+        self._added += 1
+        entry = self._hosts[key] = PolledHost(key, host, port, user, passwd,
+                                              callback, offset)
+        entry.task = self._loop.create_task(self._poll(entry))
+
+    def _remove(self, key):
+        entry = self._hosts.pop(key, None)
+        if entry:
+            entry.task.cancel()
+
+    def _refresh(self, key):
+        entry = self._hosts.get(key)
+        if entry:
+            entry.wakeup.set()
+
+    async def _call(self, entry, method, *args, timeout=None):
+        timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        if entry.json:
+            data = {'jsonrpc': '2.0', 'method': method, 'id': 1,
+                    'params': args or None}
+            async with self._session.post(entry.url, json=data,
+                                          auth=entry.auth,
+                                          timeout=timeout) as resp:
+                if resp.status != 200 or \
+                   resp.content_type != 'application/json':
+                    raise ClientError(resp.status, resp.reason)
+                result = await resp.json()
+            if result.get('error'):
+                raise ClientError(result['error']['code'],
+                                  result['error']['message'])
+            return result['result']
+        data = xmlrpc.client.dumps(args, method, allow_none=True)
+        async with self._session.post(
+                entry.url, data=data.encode(), auth=entry.auth,
+                headers={'Content-Type': 'text/xml'},
+                timeout=timeout) as resp:
+            if resp.status != 200:
+                raise ClientError(resp.status, resp.reason)
+            body = await resp.read()
+        try:
+            return xmlrpc.client.loads(body)[0][0]
+        except xmlrpc.client.Fault as f:
+            raise ClientError(f.faultCode, f.faultString) from None
+
+    async def _connect(self, entry):
+        entry.json = True
+        try:
+            version = await self._call(entry, 'GetVersion')
+        except ClientError:
+            # older daemons only understand XML-RPC
+            entry.json = False
+            version = await self._call(entry, 'GetVersion')
+        entry.version = int(version.strip('v')[:1])
+        if entry.version < 3:
+            raise ClientError(99, 'daemon too old for bulk status queries')
+
+    async def _sleep(self, entry, delay):
+        """Sleep for *delay* seconds, or until a refresh is requested."""
+        try:
+            await asyncio.wait_for(entry.wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        entry.wakeup.clear()
+
+    async def _poll(self, entry):
+        await self._sleep(entry, entry.offset)
+        generation = ''
+        seq = -1
+        while True:
+            try:
+                if entry.version is None:
+                    await self._connect(entry)
+                if entry.version < 5:
+                    services = await self._call(entry, 'GetAllServiceInfo')
+                    entry.callback(entry.key, services)
+                    await self._sleep(entry, self.interval)
+                    continue
+                if seq < 0:
+                    # get the current sequence number before the status,
+                    # so that no events are missed
+                    seq = (await self._call(entry, 'WaitEvents', -1, 0))['seq']
+                result = await self._call(entry, 'GetAllServiceInfo',
+                                          generation)
+                generation = result['generation']
+                if result.get('services') is not None:
+                    entry.callback(entry.key, result['services'])
+                # block until something changes, or a refresh is requested
+                waiter = asyncio.ensure_future(self._call(
+                    entry, 'WaitEvents', seq, self.WAIT_TIMEOUT,
+                    timeout=self.WAIT_TIMEOUT + self.timeout))
+                wakeup = asyncio.ensure_future(entry.wakeup.wait())
+                try:
+                    await asyncio.wait([waiter, wakeup],
+                                       return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    wakeup.cancel()
+                    waiter.cancel()
+                entry.wakeup.clear()
+                if waiter.done() and not waiter.cancelled():
+                    result = waiter.result()
+                    seq = result['seq']
+                    if 'retry_after' in result:
+                        # the daemon is busy with other waiting clients
+                        await self._sleep(entry, result['retry_after'])
+            except (OSError, asyncio.TimeoutError, aiohttp.ClientError,
+                    ClientError, KeyError, ValueError):
+                entry.version = None
+                generation = ''
+                seq = -1
+                entry.callback(entry.key, None)
+                await self._sleep(entry, self.interval)
@@ -20,11 +20,11 @@
 #
 # *****************************************************************************
 
-import socket
+from time import monotonic
 
 from marche.gui.qt import QDialog, QSettings, QThread, pyqtSignal, pyqtSlot
-from marche.gui.util import determineSubnet, getSubnetHostsAddrs, loadUi
-from marche.scan import scan
+from marche.gui.util import determineSubnet, getSubnetHostsAddrs, loadSetting, loadUi
+from marche.scan import probe_hosts, scan
 
 
 class SubnetInputDialog(QDialog):
@@ -89,6 +89,9 @@ class ActiveScanner(QThread):
     scanNotify = pyqtSignal(str)
     finished = pyqtSignal()
 
+    # minimum time between progress notifications
+    NOTIFY_INTERVAL = 0.2
+
     def __init__(self, parent=None):
         QThread.__init__(self, parent)
 
@@ -98,19 +101,24 @@ class ActiveScanner(QThread):
         self._hosts = getSubnetHostsAddrs(subnetid)
 
     def run(self):
-        for ip in self._hosts:
-            notification = f'Scanning {ip}'
-            notification += ' ...'
-
-            self.scanNotify.emit(notification)
-
-            try:
-                s = socket.create_connection((ip, '8124'), timeout=0.1)
-                s.close()
-
-                self.hostFound.emit(ip)
-            except Exception:
-                pass
+        total = len(self._hosts)
+        found = 0
+        last_notify = 0
+
+        def progress(done):
+            nonlocal last_notify
+            if monotonic() - last_notify >= self.NOTIFY_INTERVAL:
+                last_notify = monotonic()
+                self.scanNotify.emit(f'Scanning: {done} of {total} hosts, '
+                                     f'{found} found ...')
+
+        for ip in probe_hosts(
+                self._hosts, 8124,
+                timeout=loadSetting('scanTimeout', 0.2, valtype=float),
+                max_pending=loadSetting('scanConnections', 512, valtype=int),
+                progress=progress):
+            found += 1
+            self.hostFound.emit(ip)
         self.finished.emit()
 
 
@@ -24,20 +24,46 @@
 
 """Job control dispatcher."""
 
+import fnmatch
+import threading
 import uuid
 from collections import OrderedDict
-
-from marche.jobs import Busy, Denied, Fault
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from marche.jobs import (
+    DEAD,
+    NOT_AVAILABLE,
+    NOT_RUNNING,
+    RUNNING,
+    WARNING,
+    Busy,
+    Denied,
+    Fault,
+)
+from marche.journal import stop_readers
+from marche.metrics import (
+    COMMAND_CALLS,
+    COMMAND_ERRORS,
+    COMMAND_SECONDS,
+    EVENT_DELIVERIES,
+    EVENTS,
+)
 from marche.permission import ADMIN, CONTROL, DISPLAY
+from marche.polling import systemd_collector
 from marche.protocol import (
+    BulkControlResponse,
     ConffileResponse,
     ControlOutputResponse,
+    Errors,
     FoundHostResponse,
     LogfileResponse,
+    LogUpdateResponse,
     ServiceListResponse,
     StatusResponse,
 )
 from marche.scan import scan_async
+from marche.utils import determine_init_system, set_init_system
 
 
 def command(*, silent=False):
@@ -47,24 +73,33 @@ def command(*, silent=False):
                 self.log.debug('running %s%s', f.__name__, args)
             else:
                 self.log.info('running %s%s', f.__name__, args)
+            COMMAND_CALLS.inc(command=f.__name__)
+            started = monotonic()
             try:
                 return f(self, *args)
             except Busy as err:
+                COMMAND_ERRORS.inc(command=f.__name__, error='busy')
                 self.log.error('%s%s failed: busy (%s)',
                                f.__name__, args, err)
                 raise
             except Denied as err:
+                COMMAND_ERRORS.inc(command=f.__name__, error='denied')
                 self.log.error('%s%s failed: denied (%s)',
                                f.__name__, args, err)
                 raise
             except Fault as err:
+                COMMAND_ERRORS.inc(command=f.__name__, error='fault')
                 self.log.error('%s%s failed: fault (%s)',
                                f.__name__, args, err)
                 raise
             except Exception:
+                COMMAND_ERRORS.inc(command=f.__name__, error='exception')
                 self.log.exception('%s%s failed: unexpected exception',
                                    f.__name__, args)
                 raise
+            finally:
+                COMMAND_SECONDS.observe(monotonic() - started,
+                                        command=f.__name__)
         new_f.__name__ = f.__name__
         new_f.__doc__ = f.__doc__
         new_f.is_command = True
@@ -74,6 +109,18 @@ def command(*, silent=False):
 
 class JobHandler:
 
+    # maximum age of the service list snapshot; it is updated by the pollers'
+    # status events (states that are not polled are queried on each request),
+    # this catches changes to service lists and descriptions
+    SNAPSHOT_MAX_AGE = 30.0
+
+    # maximum number of jobs controlled concurrently by bulk commands
+    BULK_WORKERS = 8
+
+    # states in which a started service is ready for the services after it
+    STARTED_STATES = (RUNNING, WARNING, NOT_RUNNING)
+    FAILED_STATES = (DEAD, NOT_AVAILABLE)
+
     def __init__(self, config, log):
         self.config = config
         self.log = log
@@ -82,6 +129,16 @@ class JobHandler:
         self.service2job = {}
         self.interfaces = []
         self.unauth_level = config.unauth_level
+        self._snapshot_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        # notified on status events, for waiting on started services
+        self._status_changed = threading.Condition()
+        self._status_changes = 0
+        self._snapshot = None
+        self._snapshot_time = 0
+        self._generation = 0
+        if config.general_config.get('systemd_dbus', False):
+            systemd_collector.enable_dbus(log)
         self._add_jobs()
 
     def shutdown(self):
@@ -89,41 +146,107 @@ class JobHandler:
             job.shutdown()
         self.jobs = OrderedDict()
         self.service2job = {}
+        stop_readers()
+        systemd_collector.stop()
 
     def add_interface(self, iface):
         self.interfaces.append(iface)
 
-    def _add_jobs(self):
+    def _add_jobs(self, keep=None):
+        """Create the configured jobs and register their services.
+
+        Jobs in the *keep* dictionary are reused instead of created again.
+        """
         self.log.info('adding jobs...')
-        for (name, config) in self.config.job_config.items():
-            if 'type' not in config:
-                self.log.warning('job %r has no type assigned, ignoring', name)
-                continue
-            jobtype = config['type']
-            try:
-                mod = __import__(f'marche.jobs.{jobtype}', {}, {}, 'Job')
-            except Exception as err:
-                self.log.exception('could not import module %r for job %s: %s',
-                                   jobtype, name, err)
-                continue
-            try:
-                job = mod.Job(jobtype, name, config, self.log, self.emit_event)
-                if not job.check():
-                    job.log.error('feasibility check failed')
+        started = monotonic()
+        keep = keep or {}
+        set_init_system(self.config.general_config.get('init_system'))
+        self.log.info('init system: %s', determine_init_system())
+        workers = int(self.config.general_config.get('init_workers', 8))
+        # constructing and checking jobs runs external commands, so that is
+        # done concurrently; services are registered in configuration order
+        with ThreadPoolExecutor(max(1, workers),
+                                thread_name_prefix='jobinit') as pool:
+            futures = [(name, pool.submit(self._init_job, name, config))
+                       for (name, config) in self.config.job_config.items()
+                       if name not in keep]
+            results = {name: future.result() for (name, future) in futures}
+        jobs = OrderedDict()
+        service2job = {}
+        timings = []
+        for name in self.config.job_config:
+            if name in keep:
+                job = keep[name]
+                try:
+                    services = list(job.get_services())
+                except Exception as err:
+                    self.log.exception('could not get services of job %s: %s',
+                                       name, err)
+                    job.shutdown()
                     continue
-                job.init()
-                job.log.info('job initialized')
-                for service, instance in job.get_services():
-                    other = self.service2job.get(service)
+            else:
+                job, services, duration = results[name]
+                if job is None:
+                    continue
+                timings.append((duration, name))
+            try:
+                for service, _ in services:
+                    other = service2job.get(service)
                     if other and other is not job:
                         raise RuntimeError(f'duplicate service {service}, '
                                            f'provided by jobs {name} and {other.name}')
-                    self.service2job[service] = job
-                    self.log.info('found service: %s.%s', service, instance)
-                self.jobs[name] = job
-            except Exception as err:
-                self.log.exception('could not initialize job %s: %s',
-                                   name, err)
+            except RuntimeError as err:
+                self.log.error('could not initialize job %s: %s', name, err)
+                job.shutdown()
+                continue
+            for service, instance in services:
+                service2job[service] = job
+                self.log.info('found service: %s.%s', service, instance)
+            jobs[name] = job
+        for job in jobs.values():
+            unknown = [name for name in job.after if name not in jobs]
+            if unknown:
+                job.log.warning('unknown jobs in "after": %s',
+                                ', '.join(unknown))
+        self.jobs = jobs
+        self.service2job = service2job
+        timings.sort(reverse=True)
+        self.log.info('initialized %d jobs (%d unchanged) in %.2f s, '
+                      'slowest: %s', len(timings), len(keep),
+                      monotonic() - started,
+                      ', '.join(f'{name} ({duration:.2f} s)'
+                                for (duration, name) in timings[:5]) or 'none')
+
+    def _init_job(self, name, config):
+        """Create, check and initialize a single job.
+
+        Returns the job (None if that failed), its services and the time it
+        took to initialize.
+        """
+        started = monotonic()
+        if 'type' not in config:
+            self.log.warning('job %r has no type assigned, ignoring', name)
+            return None, [], 0
+        jobtype = config['type']
+        try:
+            mod = __import__(f'marche.jobs.{jobtype}', {}, {}, 'Job')
+        except Exception as err:
+            self.log.exception('could not import module %r for job %s: %s',
+                               jobtype, name, err)
+            return None, [], 0
+        try:
+            job = mod.Job(jobtype, name, config, self.log, self.emit_event)
+            if not job.check():
+                job.log.error('feasibility check failed')
+                return None, [], 0
+            job.init()
+            services = list(job.get_services())
+            job.log.info('job initialized')
+        except Exception as err:
+            self.log.exception('could not initialize job %s: %s',
+                               name, err)
+            return None, [], 0
+        return job, services, monotonic() - started
 
     def _get_job(self, service):
         """Return the job the service belongs to."""
@@ -134,18 +257,44 @@ class JobHandler:
 
     def emit_event(self, event):
         """Emit an event to all connected clients."""
+        if isinstance(event, StatusResponse):
+            self._update_snapshot(event)
+            self._notify_status_changed()
+        EVENTS.inc(type=event.__class__.__name__)
         for iface in self.interfaces:
             iface.emit_event(event)
+            EVENT_DELIVERIES.inc(interface=iface.iface_name)
 
     @command()
     def trigger_reload(self):
-        """Trigger a reload of the jobs and list of their services."""
-        for job in list(self.jobs.values()):
-            job.shutdown()
-        self.config.reload()
-        self.jobs = OrderedDict()
-        self.service2job = {}
-        self._add_jobs()
+        """Trigger a reload of the jobs and list of their services.
+
+        Only jobs whose configuration has changed are created again, the
+        others keep running with their current state, unless they report
+        that they need to be created again.
+        """
+        # reloads can be triggered by clients, signals and the watcher
+        with self._reload_lock:
+            old_config = self.config.job_config
+            self.config.reload()
+            keep = {}
+            for name, job in self.jobs.items():
+                try:
+                    changed = self.config.job_config.get(name) != \
+                        old_config.get(name) or job.needs_reinit()
+                except Exception:
+                    job.log.exception('could not check for changes')
+                    changed = True
+                if changed:
+                    job.log.info('configuration changed, shutting down')
+                    job.shutdown()
+                else:
+                    keep[name] = job
+            self._add_jobs(keep)
+            with self._snapshot_lock:
+                self._snapshot = None
+            # the units to follow are requested again by the new jobs
+            stop_readers()
         # This will contain all services.  It's up to the interface to filter
         # the list when distributing to individual connected clients.
         # TODO: activate once we have an interface that uses events
@@ -159,29 +308,103 @@ class JobHandler:
         scan_async(callback, self.uid)
 
     @command(silent=True)
-    def request_service_list(self, client):
+    def request_service_list(self, client, known_generation=None):
         """Request a list of all services provided by jobs.
 
-        The service list is sent back as a single ServiceListResponse.
+        The service list is sent back as a single ServiceListResponse.  If
+        *known_generation* is given and the list has not changed since that
+        generation, the response contains no services.
         """
+        generation, services, owners = self._get_snapshot()
+        if known_generation == generation:
+            return ServiceListResponse(services=None, generation=generation)
         svcs = OrderedDict()
-        for job in self.jobs.values():
+        for service, info in services.items():
+            job = owners[service]
+            if not job.has_permission(DISPLAY, client):
+                continue
+            svcs[service] = dict(info,
+                                 permissions=job.determine_permissions(client))
+        return ServiceListResponse(services=svcs, generation=generation)
+
+    def _get_snapshot(self):
+        """Return the current generation and snapshot of the service list,
+        and the jobs owning the services.
+
+        The snapshot must not be modified; it is replaced by a new one
+        (with a new generation) whenever something changes.
+        """
+        with self._snapshot_lock:
+            snapshot = self._snapshot
+            if snapshot is not None and \
+               monotonic() >= self._snapshot_time + self.SNAPSHOT_MAX_AGE:
+                snapshot = None
+        if snapshot is not None:
+            self._refresh_unpolled(snapshot)
+            with self._snapshot_lock:
+                if self._snapshot is not None:
+                    return self._snapshot
+        services = OrderedDict()
+        owners = {}
+        for job in list(self.jobs.values()):
             for service, instance in job.get_services():
-                if not job.has_permission(DISPLAY, client):
-                    continue
-                if service not in svcs:
-                    svcs[service] = {
-                        'instances': {},
-                        'permissions': job.determine_permissions(client),
-                        'jobtype': job.jobtype,
-                    }
+                if service not in services:
+                    owners[service] = job
+                    services[service] = {'instances': {},
+                                         'jobtype': job.jobtype}
                 state, ext = job.polled_service_status(service, instance)
-                svcs[service]['instances'][instance] = {
+                services[service]['instances'][instance] = {
                     'desc': job.service_description(service, instance),
                     'state': state,
                     'ext_status': ext,
                 }
-        return ServiceListResponse(services=svcs)
+        with self._snapshot_lock:
+            if self._snapshot is None or self._snapshot[1] != services:
+                self._generation += 1
+                self._snapshot = (f'{self.uid}-{self._generation}', services,
+                                  owners)
+            self._snapshot_time = monotonic()
+            return self._snapshot
+
+    def _refresh_unpolled(self, snapshot):
+        """Update the states in the snapshot that no poller keeps up to date.
+
+        This concerns jobs with polling disabled, or whose poller fails.
+        """
+        _, services, owners = snapshot
+        for service, info in services.items():
+            job = owners[service]
+            for instance in info['instances']:
+                if job.poller.get(service, instance) is None:
+                    state, ext = job.polled_service_status(service, instance)
+                    self._update_snapshot(
+                        StatusResponse(service, instance, state, ext))
+
+    def _update_snapshot(self, event):
+        """Update the snapshot with a changed service status."""
+        with self._snapshot_lock:
+            if self._snapshot is None:
+                return
+            services = self._snapshot[1]
+            info = services.get(event.service, {}).get(
+                'instances', {}).get(event.instance)
+            if info is None:
+                # unknown instance, rebuild the snapshot on next request
+                self._snapshot = None
+                return
+            if (info['state'], info['ext_status']) == \
+               (event.state, event.ext_status):
+                return
+            # copy only the changed parts
+            services = OrderedDict(services)
+            svcinfo = services[event.service] = \
+                dict(services[event.service])
+            svcinfo['instances'] = dict(svcinfo['instances'])
+            svcinfo['instances'][event.instance] = dict(
+                info, state=event.state, ext_status=event.ext_status)
+            self._generation += 1
+            self._snapshot = (f'{self.uid}-{self._generation}', services,
+                              self._snapshot[2])
 
     def filter_services(self, client, event):
         """Filter a service list event to only jobs that the client can see."""
@@ -191,11 +414,17 @@ class JobHandler:
         for service in event.services:
             if self._get_job(service).has_permission(DISPLAY, client):
                 new_svcs[service] = event.services[service]
-        return ServiceListResponse(services=new_svcs)
+        return ServiceListResponse(services=new_svcs,
+                                   generation=event.generation)
 
     def can_see_status(self, client, event):
-        """Check if the client can see this status event."""
-        return self._get_job(event.service).has_permission(DISPLAY, client)
+        """Check if the client can see this status event.
+
+        Events of services that don't exist anymore (after a reload) are not
+        shown to anyone.
+        """
+        job = self.service2job.get(event.service)
+        return job is not None and job.has_permission(DISPLAY, client)
 
     # Not a command, but needed for XMLRPC.
     def get_service_description(self, client, service, instance):
@@ -233,6 +462,185 @@ class JobHandler:
             job.restart_service(service, instance)
             job.poll_now()
 
+    @command()
+    def control_services(self, client, action, patterns):
+        """Start, stop or restart (*action*) all services matching the
+        *patterns*, and return the result for each service.
+
+        Patterns are service names (``service`` or ``service.instance``) or
+        shell-style patterns of them; a pattern without instance part also
+        matches all instances of the service.  The services of different jobs
+        are controlled concurrently, those of one job one after the other.
+
+        When starting or restarting, jobs are only started once the services
+        of the jobs in their ``after`` option are running.
+        """
+        if action not in ('start', 'stop', 'restart'):
+            raise Fault(f'unknown action: {action}')
+        groups = OrderedDict()
+        unmatched = list(patterns)
+        for job in list(self.jobs.values()):
+            if not job.has_permission(DISPLAY, client):
+                continue
+            for service, instance in job.get_services():
+                name = f'{service}.{instance}' if instance else service
+                matched = [pattern for pattern in patterns
+                           if fnmatch.fnmatchcase(name, pattern) or
+                           ('.' not in pattern and
+                            fnmatch.fnmatchcase(service, pattern))]
+                if matched:
+                    groups.setdefault(job, []).append((service, instance))
+                    unmatched = [p for p in unmatched if p not in matched]
+        # stopping does not wait for anything
+        deps = {job: set() for job in groups} if action == 'stop' else \
+            self._start_deps(list(groups))
+        timeout = float(self.config.general_config.get('start_timeout', 60))
+        job_results = self._control_jobs(client, action, groups, deps, timeout)
+        results = [result for job in groups for result in job_results[job]]
+        results.extend((pattern, '', Errors.FAULT, f'no such service: {pattern}')
+                       for pattern in unmatched)
+        return BulkControlResponse(results)
+
+    def _start_deps(self, jobs):
+        """Return the jobs that each of the *jobs* must be started after,
+        according to their ``after`` option.
+        """
+        deps = {job: {other for other in jobs if other.name in job.after}
+                for job in jobs}
+        # check for circular dependencies, and ignore them
+        done = set()
+        while len(done) < len(jobs):
+            ready = {job for job in jobs
+                     if job not in done and deps[job] <= done}
+            if not ready:
+                cycle = [job for job in jobs if job not in done]
+                self.log.warning('circular "after" dependencies between '
+                                 'jobs %s', ', '.join(job.name for job in cycle))
+                for job in cycle:
+                    deps[job] -= set(cycle)
+                ready = set(cycle)
+            done |= ready
+        return deps
+
+    def _control_jobs(self, client, action, groups, deps, timeout):
+        """Control the services in *groups* of each job as soon as the
+        services of the jobs in *deps* are running; return the results by job.
+        """
+        # jobs whose services must run before other jobs are started
+        needed = set().union(*deps.values())
+        todo = list(groups)
+        running = {}
+        # job -> time to give up waiting for its services to run
+        waiting = {}
+        started = set()
+        failed = set()
+        job_results = {}
+
+        def notify(_future):
+            self._notify_status_changed()
+
+        with ThreadPoolExecutor(min(len(groups), self.BULK_WORKERS) or 1,
+                                thread_name_prefix='control') as pool:
+            while todo or running or waiting:
+                # the states are determined without holding the condition,
+                # since they can be queried from the services
+                with self._status_changed:
+                    changes = self._status_changes
+                for job in list(todo):
+                    failed_deps = [dep.name for dep in deps[job]
+                                   if dep in failed]
+                    if failed_deps:
+                        todo.remove(job)
+                        message = (f'not started, job {failed_deps[0]} '
+                                   'did not start')
+                        job_results[job] = [
+                            (service, instance, Errors.FAULT, message)
+                            for (service, instance) in groups[job]]
+                        failed.add(job)
+                    elif deps[job] <= started:
+                        todo.remove(job)
+                        future = pool.submit(self._control_job, client,
+                                             action, job, groups[job])
+                        running[future] = job
+                        future.add_done_callback(notify)
+                for future in [future for future in running if future.done()]:
+                    job = running.pop(future)
+                    job_results[job] = future.result()
+                    if any(result[2] for result in job_results[job]):
+                        failed.add(job)
+                    elif job in needed:
+                        waiting[job] = monotonic() + timeout
+                    else:
+                        started.add(job)
+                for job, deadline in list(waiting.items()):
+                    state = self._start_state(job, groups[job])
+                    if state is None and monotonic() < deadline:
+                        continue
+                    del waiting[job]
+                    if state:
+                        started.add(job)
+                        continue
+                    if state is None:
+                        job.log.warning('services did not start within %s s',
+                                        timeout)
+                    else:
+                        job.log.warning('services failed to start')
+                    failed.add(job)
+                if any(deps[job] <= started | failed for job in todo):
+                    continue
+                if running or waiting:
+                    # finished commands and status events of the pollers
+                    # wake us up; jobs without polling are checked every second
+                    remaining = min(waiting.values(), default=monotonic() + 1)
+                    with self._status_changed:
+                        if self._status_changes == changes:
+                            self._status_changed.wait(
+                                max(0, min(remaining - monotonic(), 1.0)))
+        return job_results
+
+    def _notify_status_changed(self):
+        """Wake up bulk commands waiting for services to start."""
+        with self._status_changed:
+            self._status_changes += 1
+            self._status_changed.notify_all()
+
+    def _start_state(self, job, services):
+        """Return True if the *services* of the *job* are running according to
+        the polled states, False if they failed, and None if not yet known.
+        """
+        states = [job.polled_service_status(service, instance)[0]
+                  for (service, instance) in services]
+        if any(state in self.FAILED_STATES for state in states):
+            return False
+        if all(state in self.STARTED_STATES for state in states):
+            return True
+        return None
+
+    def _control_job(self, client, action, job, services):
+        """Control some services of a single job, with one lock and poll."""
+        with job.lock:
+            results = [self._control_one(client, action, job, *service)
+                       for service in services]
+            job.poll_now()
+        return results
+
+    def _control_one(self, client, action, job, service, instance):
+        try:
+            job.check_permission(CONTROL, client)
+            job.invalidate(service, instance)
+            getattr(job, f'{action}_service')(service, instance)
+        except Busy as err:
+            return service, instance, Errors.BUSY, str(err)
+        except Denied as err:
+            return service, instance, Errors.DENIED, str(err)
+        except Fault as err:
+            return service, instance, Errors.FAULT, str(err)
+        except Exception as err:
+            job.log.exception('%s of %s.%s failed', action, service, instance)
+            return (service, instance, Errors.EXCEPTION,
+                    f'Unexpected exception: {err}')
+        return service, instance, 0, ''
+
     @command(silent=True)
     def request_service_status(self, client, service, instance):
         """Return the status of a single service."""
@@ -262,6 +670,19 @@ class JobHandler:
         return LogfileResponse(service=service, instance=instance,
                                files=logfiles)
 
+    @command(silent=True)
+    def request_logfiles_since(self, client, service, instance, cursors):
+        """Return what was added to the service's logfiles since the given
+        cursors, together with the new cursors.
+        """
+        # New in protocol version 5.
+        job = self._get_job(service)
+        job.check_permission(DISPLAY, client)
+        with job.lock:
+            files, cursors = job.service_logs_since(service, instance, cursors)
+        return LogUpdateResponse(service=service, instance=instance,
+                                 files=files, cursors=cursors)
+
     @command()
     def view_conffiles(self, client, service, instance):
         """View the relevant configuration file(s) for this service.
@@ -24,6 +24,9 @@
 
 """Base interface class."""
 
+import collections
+import threading
+
 
 class Interface:
 
@@ -69,3 +72,41 @@ class Interface:
         """Shutdown the interface.  This should stop the main loop of the
         interface if possible.
         """
+
+
+class EventBuffer:
+    """A bounded buffer of sequence-numbered events that clients can wait for.
+
+    Interfaces can use this to let clients ask for the events since the last
+    sequence number they have seen, instead of polling the status.
+    """
+
+    def __init__(self, size=1000):
+        self.seq = 0
+        self._events = collections.deque(maxlen=size)
+        self._cond = threading.Condition()
+
+    def add(self, event):
+        with self._cond:
+            self.seq += 1
+            self._events.append((self.seq, event))
+            self._cond.notify_all()
+
+    def wait(self, since, timeout):
+        """Wait at most *timeout* seconds for events after sequence number
+        *since*.
+
+        Returns a tuple of the current sequence number, the list of new
+        events, and a flag that is true if events have been lost, i.e. the
+        client has to get the full state again.
+        """
+        with self._cond:
+            if since < 0:
+                return self.seq, [], False
+            if since > self.seq:
+                # the client saw a previous instance of the daemon
+                return self.seq, [], True
+            self._cond.wait_for(lambda: self.seq > since, timeout)
+            first = self._events[0][0] if self._events else self.seq + 1
+            events = [event for (seq, event) in self._events if seq > since]
+            return self.seq, events, since < first - 1
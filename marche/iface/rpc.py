@@ -31,6 +31,37 @@ This interface allows controlling services via remote procedure calls (RPC)
 over HTTP in the XML format.  This is the main interface of Marche and should
 always be enabled.
 
+The same endpoint also speaks JSON-RPC 2.0 (including batch requests) when
+the request is sent with a ``Content-Type`` of ``application/json``.  The
+available methods are the same as for XML-RPC, and Marche errors are returned
+with the codes also used as XML-RPC fault codes.
+
+The current metrics of the daemon (calls and durations of commands, external
+programs and polling, and numbers of events) can be fetched from the
+``/metrics`` path with a GET request, in the text format understood by
+Prometheus.  This needs the same credentials as the RPC calls, and at least
+the display permission level.
+
+Instead of polling the service status, clients can wait for changes with the
+``WaitEvents(since, timeout)`` call, which returns as soon as there are
+status events newer than the sequence number *since* (or after *timeout*
+seconds).  Since every waiting client occupies a worker, at most half of the
+workers are used for waiting.  Further calls return immediately, and without
+new events the result then contains ``retry_after``, the time in seconds the
+client should wait before calling again.
+
+Many services can be started, stopped or restarted with one
+``BulkControl(action, patterns)`` call, where *action* is ``"start"``,
+``"stop"`` or ``"restart"`` and *patterns* is a list of service names or
+shell-style patterns like ``"nicos.*"``.  It returns a list with an entry for
+each service, containing its name, an error code (0 on success) and message.
+When starting, services are started in the order given by the ``after`` job
+option, so the call can take a while.
+
+``GetLogFiles(name)`` returns the same logs as ``GetLogs``, as a mapping of
+file names to their contents instead of lines prefixed with the file name,
+which is ambiguous for file names that contain a colon.
+
 .. describe:: [interface.rpc]
 
    The configuration settings that can be set within the **interface.rpc**
@@ -41,25 +72,85 @@ always be enabled.
       **Default:** ``"0.0.0.0:8124"``
 
       The local address and port to listen on for xmlrpc requests.
+
+   .. describe:: workers
+
+      **Default:** ``16``
+
+      The maximum number of requests handled concurrently.  A request
+      occupies a worker thread while it is handled; further requests are
+      queued until a worker becomes free.  Idle keep-alive connections don't
+      occupy a worker.
+
+   .. describe:: keepalive
+
+      **Default:** ``10.0``
+
+      The time in seconds an idle HTTP/1.1 keep-alive connection is held open
+      waiting for the next request before it is closed.
 """
 
 import base64
+import json
+import selectors
+import socket
 import threading
 import xmlrpc.client
 import xmlrpc.server
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
 
+from marche import metrics
 from marche.auth import AuthFailed
+from marche.iface.base import EventBuffer
 from marche.iface.base import Interface as BaseInterface
 from marche.jobs import Busy, Denied, Fault
 from marche.permission import DISPLAY, ClientInfo
-from marche.protocol import PROTO_VERSION, Errors
+from marche.protocol import PROTO_VERSION, Errors, StatusResponse
+
+# error codes defined by the JSON-RPC 2.0 specification
+JSON_PARSE_ERROR = -32700
+JSON_INVALID_REQUEST = -32600
+JSON_METHOD_NOT_FOUND = -32601
+JSON_INVALID_PARAMS = -32602
+
+
+def json_error(reqid, code, message):
+    return {'jsonrpc': '2.0', 'id': reqid,
+            'error': {'code': code, 'message': message}}
 
 
 class AuthRequestHandler(xmlrpc.server.SimpleXMLRPCRequestHandler):
     rpc_paths = ('/xmlrpc',)
+    # allow clients to keep their connection open between requests
+    protocol_version = 'HTTP/1.1'
     needs_auth = False
     unauth_level = DISPLAY
 
+    def __init__(self, request, client_address, server):
+        # only set up the connection; the server calls handle_request() for
+        # each request that arrives on it
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    def handle_request(self):
+        """Handle one request; return True if the connection stays open."""
+        self.close_connection = True
+        self.handle_one_request()
+        return not self.close_connection
+
+    def has_buffered_request(self):
+        """Check if (part of) the next request has already been read."""
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
     def log_message(self, fmt, *args):
         self.log.debug('[%s] %s', self.client_address[0], fmt % args)
 
@@ -80,16 +171,213 @@ class AuthRequestHandler(xmlrpc.server.SimpleXMLRPCRequestHandler):
             self.send_error(401)
             return None
 
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return self._do_jsonrpc()
         return xmlrpc.server.SimpleXMLRPCRequestHandler.do_POST(self)
 
-    def _dispatch(self, method, params):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.report_404()
+            return
+        client_info = ClientInfo(self.unauth_level)
+        if 'Authorization' in self.headers:
+            header = self.headers['Authorization'].split()[-1].strip()
+            try:
+                user, passwd = base64.b64decode(header.encode()) \
+                    .decode('utf-8').split(':', 1)
+                client_info = self.authhandler.authenticate(user, passwd)
+            except (ValueError, AuthFailed):
+                self.send_error(401)
+                return
+        elif self.needs_auth:
+            self.send_error(401)
+            return
+        if client_info.level < DISPLAY:
+            self.send_error(403)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _do_jsonrpc(self):
+        if not self.is_rpc_path_valid():
+            self.report_404()
+            return
         try:
-            func = getattr(self.server.instance, method)
-        except AttributeError:
-            raise Exception(f'method "{method}" is not supported') from None
+            data = self.rfile.read(int(self.headers['Content-Length']))
+            request = json.loads(data)
+        except (TypeError, ValueError):
+            response = json_error(None, JSON_PARSE_ERROR, 'parse error')
+        else:
+            if not isinstance(request, list):
+                response = self._json_call(request)
+            elif not request:
+                response = json_error(None, JSON_INVALID_REQUEST,
+                                      'empty batch request')
+            else:
+                # notifications don't get a response
+                response = [resp for resp in map(self._json_call, request)
+                            if resp is not None]
+        if not response:
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json_call(self, request):
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' \
+           or not isinstance(request.get('method'), str):
+            return json_error(None, JSON_INVALID_REQUEST, 'invalid request')
+        reqid = request.get('id')
+        method = request['method']
+        params = request.get('params')
+        if params is None:
+            params = []
+        func = self._get_method(method)
+        if func is None:
+            response = json_error(reqid, JSON_METHOD_NOT_FOUND,
+                                  f'method "{method}" is not supported')
+        elif not isinstance(params, list):
+            response = json_error(reqid, JSON_INVALID_PARAMS,
+                                  'only positional parameters are supported')
+        else:
+            try:
+                result = func(self.client_info, *params)
+            except xmlrpc.client.Fault as err:
+                response = json_error(reqid, err.faultCode, err.faultString)
+            else:
+                response = {'jsonrpc': '2.0', 'id': reqid, 'result': result}
+        if 'id' not in request:
+            return None
+        return response
+
+    def _get_method(self, method):
+        """Return the RPC method called *method*, or None."""
+        func = getattr(self.server.instance, method, None)
+        # only the methods created by `command` can be called
+        return func if getattr(func, 'rpc_method', False) else None
+
+    def _dispatch(self, method, params):
+        func = self._get_method(method)
+        if func is None:
+            raise Exception(f'method "{method}" is not supported')
         return func(self.client_info, *params)
 
 
+class PooledXMLRPCServer(xmlrpc.server.SimpleXMLRPCServer):
+    """XMLRPC server that serves requests from a bounded thread pool.
+
+    A worker is only occupied while it handles a request.  Between requests,
+    keep-alive connections are watched by a selector in a separate thread,
+    which hands a connection back to the pool when the next request arrives,
+    and closes it after it has been idle for *keepalive* seconds.
+    """
+
+    def __init__(self, addr, workers, keepalive=10.0, **kwds):
+        xmlrpc.server.SimpleXMLRPCServer.__init__(self, addr, **kwds)
+        self.keepalive = keepalive
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='rpc')
+        self._idle_lock = threading.Lock()
+        # connections to add to the selector, and the stop flag
+        self._parked = []
+        self._closing = False
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._idle_thread = threading.Thread(target=self._watch_idle,
+                                             daemon=True, name='rpc-idle')
+        self._idle_thread.start()
+
+    def process_request(self, request, client_address):
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        self._submit(handler)
+
+    def _submit(self, handler):
+        try:
+            self._pool.submit(self._serve, handler)
+        except RuntimeError:  # the server has been closed
+            self._close(handler)
+
+    def _serve(self, handler):
+        try:
+            keep = handler.handle_request()
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+            keep = False
+        if not keep:
+            self._close(handler)
+        elif handler.has_buffered_request():
+            # the client didn't wait for the response
+            self._submit(handler)
+        else:
+            with self._idle_lock:
+                if not self._closing:
+                    self._parked.append(handler)
+                    self._wakeup_w.send(b'x')
+                    return
+            self._close(handler)
+
+    def _close(self, handler):
+        handler.finish()
+        self.shutdown_request(handler.request)
+
+    def _watch_idle(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_r, selectors.EVENT_READ)
+        # handler -> time to close it, in the order of parking
+        idle = {}
+        while True:
+            timeout = None
+            if idle:
+                timeout = max(0, next(iter(idle.values())) - monotonic())
+            for key, _ in selector.select(timeout):
+                if key.fileobj is self._wakeup_r:
+                    self._wakeup_r.recv(4096)
+                    continue
+                selector.unregister(key.fileobj)
+                del idle[key.data]
+                self._submit(key.data)
+            with self._idle_lock:
+                parked, self._parked = self._parked, []
+                closing = self._closing
+            now = monotonic()
+            for handler in parked:
+                selector.register(handler.request, selectors.EVENT_READ,
+                                  handler)
+                idle[handler] = now + self.keepalive
+            for handler, deadline in list(idle.items()):
+                if deadline > now and not closing:
+                    break
+                selector.unregister(handler.request)
+                del idle[handler]
+                self._close(handler)
+            if closing:
+                selector.close()
+                return
+
+    def server_close(self):
+        xmlrpc.server.SimpleXMLRPCServer.server_close(self)
+        with self._idle_lock:
+            self._closing = True
+            self._wakeup_w.send(b'x')
+        self._idle_thread.join()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+        self._pool.shutdown(wait=False)
+
+
 def command(method):
     def new_method(self, *args):
         try:
@@ -106,14 +394,20 @@ def command(method):
         else:
             return True if ret is None else ret
     new_method.__name__ = method.__name__
+    new_method.rpc_method = True
     return new_method
 
 
 class RPCFunctions:
 
-    def __init__(self, jobhandler, log):
+    # maximum time a client can wait for events
+    MAX_WAIT = 60.0
+
+    def __init__(self, jobhandler, log, events=None, waiters=1):
         self.jobhandler = jobhandler
         self.log = log
+        self.events = events or EventBuffer()
+        self._waiters = threading.BoundedSemaphore(waiters)
 
     def _split_name(self, name):
         if '.' in name:
@@ -141,9 +435,16 @@ class RPCFunctions:
         return result
 
     @command
-    def GetAllServiceInfo(self, client_info):
-        list_event = self.jobhandler.request_service_list(client_info)
-        return dict(list_event.services)
+    def GetAllServiceInfo(self, client_info, *known_generation):
+        list_event = self.jobhandler.request_service_list(
+            client_info, *known_generation)
+        if not known_generation:
+            # reply format of protocol version 3
+            return dict(list_event.services)
+        if list_event.services is None:
+            return {'generation': list_event.generation, 'unchanged': True}
+        return {'generation': list_event.generation,
+                'services': dict(list_event.services)}
 
     @command
     def GetDescription(self, client_info, name):
@@ -172,6 +473,47 @@ class RPCFunctions:
                 ret.append(fname + ':' + line)  # noqa: PERF401
         return ret
 
+    @command
+    def GetLogFiles(self, client_info, name):
+        log_event = self.jobhandler.request_logfiles(
+            client_info, *self._split_name(name))
+        return dict(log_event.files)
+
+    @command
+    def FollowLogs(self, client_info, name, cursors):
+        log_event = self.jobhandler.request_logfiles_since(
+            client_info, *self._split_name(name), cursors)
+        return {'files': log_event.files, 'cursors': log_event.cursors}
+
+    @command
+    def WaitEvents(self, client_info, since, timeout):
+        timeout = min(float(timeout), self.MAX_WAIT)
+        retry_after = None
+        if self._waiters.acquire(blocking=False):
+            try:
+                seq, events, lost = self.events.wait(int(since), timeout)
+            finally:
+                self._waiters.release()
+        else:
+            # don't let waiting clients occupy all workers; they have to
+            # poll instead
+            seq, events, lost = self.events.wait(int(since), 0)
+            if not events and timeout > 0:
+                retry_after = timeout
+        result = []
+        for event in events:
+            if isinstance(event, StatusResponse):
+                if not self.jobhandler.can_see_status(client_info, event):
+                    continue
+                result.append({'type': 'status', 'service': event.service,
+                               'instance': event.instance,
+                               'state': event.state,
+                               'ext_status': event.ext_status})
+        if retry_after is not None:
+            return {'seq': seq, 'events': result, 'lost': lost,
+                    'retry_after': retry_after}
+        return {'seq': seq, 'events': result, 'lost': lost}
+
     def _process_conf(self, config_event):
         ret = []
         for fname, contents in config_event.files.items():
@@ -209,15 +551,27 @@ class RPCFunctions:
     def Restart(self, client_info, name):
         self.jobhandler.restart_service(client_info, *self._split_name(name))
 
+    @command
+    def BulkControl(self, client_info, action, patterns):
+        bulk_event = self.jobhandler.control_services(client_info, action,
+                                                      patterns)
+        return [{'service': f'{service}.{instance}' if instance else service,
+                 'error': code, 'message': message}
+                for (service, instance, code, message) in bulk_event.results]
+
 
 class Interface(BaseInterface):
 
     iface_name = 'rpc'
-    needs_events = False
+    needs_events = True
     poll_interval = 0.5
 
     def init(self):
         AuthRequestHandler.log = self.log
+        self.events = EventBuffer()
+
+    def emit_event(self, event):
+        self.events.add(event)
 
     def run(self):
         addr = self.config.get('addr', '0.0.0.0')
@@ -230,16 +584,22 @@ class Interface(BaseInterface):
         AuthRequestHandler.authhandler = self.authhandler
         AuthRequestHandler.unauth_level = self.jobhandler.unauth_level
         AuthRequestHandler.needs_auth = self.authhandler.needs_authentication()
+        keepalive = float(self.config.get('keepalive', 10.0))
+        # also the maximum time to receive a request
+        AuthRequestHandler.timeout = keepalive
 
-        self.server = xmlrpc.server.SimpleXMLRPCServer(
-            (host, port), requestHandler=AuthRequestHandler)
-        self.server.register_instance(RPCFunctions(self.jobhandler, self.log))
+        workers = int(self.config.get('workers', 16))
+        self.server = PooledXMLRPCServer(
+            (host, port), workers, keepalive, requestHandler=AuthRequestHandler)
+        self.server.register_instance(RPCFunctions(
+            self.jobhandler, self.log, self.events, max(1, workers // 2)))
 
         threading.Thread(target=self._thread, daemon=True).start()
-        self.log.info('listening on %s:%s', host, port)
+        self.log.info('listening on %s:%s with %d workers', host, port, workers)
 
     def shutdown(self):
         self.server.shutdown()
+        self.server.server_close()
 
     def _thread(self):
         self.server.serve_forever(poll_interval=self.poll_interval)
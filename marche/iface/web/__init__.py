@@ -37,6 +37,27 @@ This interface allows controlling services via a graphical interface.
       **Default:** ``"0.0.0.0:8080"``
 
       The local address and port to listen on for web requests.
+
+   .. describe:: workers
+
+      **Default:** ``8``
+
+      The maximum number of requests to the services (status queries and
+      control commands) processed concurrently.  While all workers are busy,
+      further requests are answered with "503 Service Unavailable".
+
+   .. describe:: timeout
+
+      **Default:** ``10.0``
+
+      The time in seconds after which a request to the services is answered
+      with "503 Service Unavailable" if it has not finished yet.
+
+Besides the pages, the interface serves the status of all services as JSON
+at ``/get_status``, and pushes status changes as they happen to clients of
+the `Server-Sent Events <https://html.spec.whatwg.org/#server-sent-events>`_
+stream at ``/events``.  The first message of the stream contains the status
+of all services, every following one only the changed services.
 """
 
 import asyncio
@@ -45,6 +66,7 @@ import pickle
 import random
 import socket
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from aiohttp import web
@@ -55,9 +77,11 @@ from jinja2 import Environment, FileSystemLoader
 
 from marche import __version__
 from marche.auth import AuthFailed
+from marche.iface.base import EventBuffer
 from marche.iface.base import Interface as BaseInterface
 from marche.jobs import STATE_STR
 from marche.permission import DISPLAY, ClientInfo
+from marche.protocol import StatusResponse
 
 ENV = Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'))
 STATIC = Path(__file__).parent / 'static'
@@ -69,11 +93,32 @@ def split_service_instance(service_instance):
     return service_instance, ''
 
 
+def join_service_instance(service, instance):
+    return f'{service}_{instance}' if instance else service
+
+
 class WebHandler:
-    def __init__(self, jobhandler, authhandler, log):
+    # interval for keepalive comments on idle event streams
+    KEEPALIVE = 30.0
+
+    def __init__(self, jobhandler, authhandler, log, events=None, workers=8,
+                 timeout=10.0):
         self.jobhandler = jobhandler
         self.log = log
         self.auth = authhandler
+        self.timeout = timeout
+        # the job handler calls can block, so they must not run in the loop
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='web')
+        self._workers = workers
+        self._busy = 0
+        self.events = events or EventBuffer()
+        # asyncio events of the connected event streams, set on new events
+        self._streams = set()
+
+    def notify(self):
+        """Wake up the event streams; must be called in the event loop."""
+        for wakeup in self._streams:
+            wakeup.set()
 
     async def _get_login(self, req, key):
         session = await get_session(req)
@@ -87,17 +132,35 @@ class WebHandler:
         session['logged_in'] = logged_in
         session['client_info'] = client_info
 
+    async def _call(self, func, *args):
+        """Call a job handler method in the thread pool."""
+        if self._busy >= self._workers:
+            raise web.HTTPServiceUnavailable(text='too many requests')
+        self._busy += 1
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool, func, *args)
+        # the worker is only free again when the call has actually finished
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.log.warning('%s timed out', func.__name__)
+            raise web.HTTPServiceUnavailable(text='request timed out') from None
+
+    def _release(self, _future):
+        self._busy -= 1
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
     async def _update_status(self, req):
         result = {}
-        for service, info in self.jobhandler.request_service_list(
-                await self._get_login(req, 'client_info')).services.items():
-            for instance in info['instances']:
-                if not instance:
-                    result[service] = \
-                        STATE_STR[info['instances'][instance]['state']]
-                else:
-                    result[service + '_' + instance] = \
-                        STATE_STR[info['instances'][instance]['state']]
+        svclist = await self._call(self.jobhandler.request_service_list,
+                                   await self._get_login(req, 'client_info'))
+        for service, info in svclist.services.items():
+            for instance, instinfo in info['instances'].items():
+                result[join_service_instance(service, instance)] = \
+                    STATE_STR[instinfo['state']]
         return result
 
     async def index(self, req):
@@ -109,24 +172,67 @@ class WebHandler:
 
     async def control(self, req):
         args = await req.post()
+        client_info = await self._get_login(req, 'client_info')
         if 'start' in args:
-            self.jobhandler.start_service(
-                await self._get_login(req, 'client_info'),
-                *split_service_instance(args['start']))
+            await self._call(self.jobhandler.start_service, client_info,
+                             *split_service_instance(args['start']))
         elif 'stop' in args:
-            self.jobhandler.stop_service(
-                await self._get_login(req, 'client_info'),
-                *split_service_instance(args['stop']))
+            await self._call(self.jobhandler.stop_service, client_info,
+                             *split_service_instance(args['stop']))
         elif 'restart' in args:
-            self.jobhandler.restart_service(
-                await self._get_login(req, 'client_info'),
-                *split_service_instance(args['restart']))
+            await self._call(self.jobhandler.restart_service, client_info,
+                             *split_service_instance(args['restart']))
         return web.Response()
 
     async def get_status(self, req):
         return web.Response(body=json.dumps(await self._update_status(req)),
                             content_type='text/json')
 
+    async def stream_events(self, req):
+        client_info = await self._get_login(req, 'client_info')
+        resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream',
+                                           'Cache-Control': 'no-cache'})
+        await resp.prepare(req)
+        # browsers send the last seen id when reconnecting
+        try:
+            since = int(req.headers.get('Last-Event-ID', -1))
+        except ValueError:
+            since = -1
+        wakeup = asyncio.Event()
+        self._streams.add(wakeup)
+        try:
+            while True:
+                # clear before fetching, so that no event is missed
+                wakeup.clear()
+                seq, events, lost = self.events.wait(since, 0)
+                if since < 0 or lost:
+                    try:
+                        status = await self._update_status(req)
+                    except web.HTTPServiceUnavailable:
+                        # the browser will reconnect and try again
+                        break
+                else:
+                    status = {}
+                    for event in events:
+                        if isinstance(event, StatusResponse) and \
+                           self.jobhandler.can_see_status(client_info, event):
+                            status[join_service_instance(
+                                event.service, event.instance)] = \
+                                STATE_STR[event.state]
+                if status:
+                    await resp.write(f'id: {seq}\ndata: {json.dumps(status)}'
+                                     '\n\n'.encode())
+                since = seq
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.KEEPALIVE)
+                except asyncio.TimeoutError:
+                    await resp.write(b': keepalive\n\n')
+        except ConnectionError:
+            pass
+        finally:
+            self._streams.discard(wakeup)
+        return resp
+
     async def get_hostname(self, _req):
         return web.Response(body=json.dumps(socket.getfqdn()),
                             content_type='text/json')
@@ -162,13 +268,27 @@ class WebHandler:
 class Interface(BaseInterface):
 
     iface_name = 'web'
-    needs_events = False
+    needs_events = True
 
     def init(self):
         self._loop = asyncio.get_event_loop()
+        self.events = EventBuffer()
+        self.handler = WebHandler(
+            self.jobhandler, self.authhandler, self.log, self.events,
+            int(self.config.get('workers', 8)),
+            float(self.config.get('timeout', 10.0)))
+
+    def emit_event(self, event):
+        if not isinstance(event, StatusResponse):
+            return
+        self.events.add(event)
+        try:
+            self._loop.call_soon_threadsafe(self.handler.notify)
+        except RuntimeError:  # loop already closed
+            pass
 
     def run(self):
-        handler = WebHandler(self.jobhandler, self.authhandler, self.log)
+        handler = self.handler
         app = web.Application()
         cookies = EncryptedCookieStorage(
             random.randbytes(32),
@@ -179,6 +299,7 @@ class Interface(BaseInterface):
         app.router.add_get('/index', handler.index)
         app.router.add_post('/control', handler.control)
         app.router.add_get('/get_status', handler.get_status)
+        app.router.add_get('/events', handler.stream_events)
         app.router.add_get('/get_hostname', handler.get_hostname)
         app.router.add_get('/help', handler.help)
         app.router.add_get('/login', handler.login)
@@ -189,6 +310,7 @@ class Interface(BaseInterface):
     def shutdown(self):
         for task in asyncio.all_tasks(self._loop):
             task.cancel()
+        self.handler.shutdown()
 
     def _thread(self, app):
         addr = self.config.get('addr', '0.0.0.0')
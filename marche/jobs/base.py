@@ -38,12 +38,13 @@ from marche.jobs import (
     Denied,
     Fault,
 )
+from marche.journal import get_reader
 from marche.permission import ADMIN, CONTROL, DISPLAY, parse_permissions
 from marche.polling import Poller
 from marche.utils import (
     AsyncProcess,
-    convert_journalctl_logs,
     extract_loglines,
+    follow_logfile,
     read_file,
     write_file,
 )
@@ -86,6 +87,8 @@ class Job:
         self.lock = threading.Lock()
         self._processes = {}
         self._output = {}
+        # systemd unit substates provided by the shared systemd collector
+        self.systemd_substates = {}
 
         self._permissions = {DISPLAY: DISPLAY,
                              CONTROL: CONTROL,
@@ -97,6 +100,8 @@ class Job:
             except ValueError:
                 self.log.error('could not parse permission string: %r',
                                config['permissions'])
+        # names of jobs whose services must run before ours are started
+        self.after = list(config.get('after', []))
         self.pollinterval = 3.0
         if 'pollinterval' in config:
             self.pollinterval = float(config['pollinterval'])
@@ -155,16 +160,21 @@ class Job:
         """Return the status of a systemd unit."""
         if sub in self._processes and not self._processes[sub].done:
             return self._processes[sub].status, ''
-        cmd = f'{systemctl} show -p SubState "{unit}"'
-        result = self._sync_call(cmd).stdout[0].strip()[9:]
+        result = self.systemd_substates.get(unit)
+        if result is None:
+            cmd = f'{systemctl} show -p SubState "{unit}"'
+            result = self._sync_call(cmd).stdout[0].strip()[9:]
         return SYSTEMD_STATE_MAP.get(result, DEAD), \
             result if result != 'running' else ''
 
-    def _journalctl_logs(self, unit, n=500):
-        cmd = (f'{self._JOURNALCTL} -n {n} -o json -u {unit} --output-fields='
-               'PRIORITY,_PID,MESSAGE,_SOURCE_REALTIME_TIMESTAMP,TRACEBACK')
-        proc = self._sync_call(cmd)
-        return {'journal': ''.join(convert_journalctl_logs(proc.stdout))}
+    def _journalctl_logs(self, unit):
+        text, _ = get_reader(self._JOURNALCTL, self.log).logs(unit)
+        return {'journal': text}
+
+    def _journalctl_logs_since(self, unit, cursors):
+        text, cursor = get_reader(self._JOURNALCTL, self.log).logs(
+            unit, cursors.get('journal'))
+        return {'journal': text}, {'journal': cursor}
 
     # Public interface
 
@@ -200,9 +210,7 @@ class Job:
 
     def poll_now(self):
         """Let the poller poll now, if possible."""
-        # poll faster after something has changed
-        self.poller.fast_interval = self.poller.interval / 6
-        self.poller.queue.put(True)  # noqa: FBT003
+        self.poller.poll_now()
 
     def polled_service_status(self, service, instance):
         """Return the service status, if possible from the poller cache.
@@ -247,6 +255,17 @@ class Job:
         if self.pollinterval > 0:
             self.poller.start()
 
+    def needs_reinit(self):
+        """Check if the job must be created again on a reload.
+
+        On a reload of the configuration, jobs whose configuration is unchanged
+        are kept running, unless this returns True.  Jobs that determine their
+        services from other files should check here if they have changed.
+
+        The default is to return False.
+        """
+        return False
+
     def shutdown(self):
         """Shut the job down.
 
@@ -350,6 +369,19 @@ class Job:
             states[service, instance] = self.service_status(service, instance)
         return states
 
+    def systemd_units(self):
+        """Return a list of ``(systemctl, unit)`` tuples for the systemd units
+        whose state is queried (using ``_async_status_systemd``) to determine
+        the status of the job's services.
+
+        If this is nonempty, the units are polled together with those of all
+        other jobs, and the results are provided to ``service_status``, which
+        avoids a separate ``systemctl`` call per unit.
+
+        The default is to return no units.
+        """
+        return []
+
     def service_description(self, service, instance):  # noqa: ARG002
         """Return a string description of the service with the given name.
 
@@ -374,6 +406,33 @@ class Job:
         """
         return {}
 
+    def service_logfiles(self, service, instance):  # noqa: ARG002
+        """Return the paths of the logfiles of the service that can be
+        followed by `service_logs_since`.
+
+        The default is to return no logfiles.
+        """
+        return []
+
+    def service_logs_since(self, service, instance, cursors):
+        """Return what was added to the logs of the service since the last
+        call.
+
+        *cursors* is a dict mapping file names to the cursors returned by a
+        previous call; for files without a cursor, the most recent lines are
+        returned.  The return value must be a tuple of two dicts, mapping the
+        file names to the new contents and to the new cursors.
+
+        The default is to follow the files returned by `service_logfiles`.
+        """
+        files = {}
+        new_cursors = {}
+        for path in self.service_logfiles(service, instance):
+            result = follow_logfile(path, cursors.get(str(path)))
+            if result is not None:
+                files[str(path)], new_cursors[str(path)] = result
+        return files, new_cursors
+
     def receive_config(self, service, instance):  # noqa: ARG002
         """Return the contents of the config file(s) of the service, if possible.
 
@@ -416,6 +475,9 @@ class LogfileMixin:
             ret.update(extract_loglines(log_file))
         return ret
 
+    def service_logfiles(self, _service, _instance):
+        return list(self.log_files)
+
 
 class ConfigMixin:
     """Mixin for receiving and sending a number of config files.
@@ -101,6 +101,15 @@ class EntangleBaseJob(BaseJob):
         return True
 
     def init(self):
+        self._resdir, self._logdir, self._services = self._read_config()
+        BaseJob.init(self)
+
+    def needs_reinit(self):
+        # new or removed resource files change the services
+        return self._read_config() != (self._resdir, self._logdir,
+                                       self._services)
+
+    def _read_config(self):
         substitutions = {
             'hostname': socket.gethostname().split('.')[0],
             'macaddress': ':'.join(re.findall('..', f'{uuid.getnode():012x}')),
@@ -114,15 +123,14 @@ class EntangleBaseJob(BaseJob):
 
         section = cfg.get('entangle', {})
         if 'resdir' in section:
-            self._resdir = Path(section['resdir'].format(**substitutions))
+            resdir = Path(section['resdir'].format(**substitutions))
         else:
-            self._resdir = Path('/etc/entangle')  # pragma: no cover
-        self._logdir = Path(section.get('logdir', '/var/log/entangle'))
+            resdir = Path('/etc/entangle')  # pragma: no cover
+        logdir = Path(section.get('logdir', '/var/log/entangle'))
 
         all_servers = [('entangle', entry.stem) for entry in
-                       self._resdir.glob('*.res')]
-        self._services = sorted(all_servers)
-        BaseJob.init(self)
+                       resdir.glob('*.res')]
+        return resdir, logdir, sorted(all_servers)
 
     def get_services(self):
         return self._services
@@ -152,6 +160,9 @@ class EntangleBaseJob(BaseJob):
         logname = self._logdir / instance / 'current'
         return extract_loglines(logname)
 
+    def service_logfiles(self, _service, instance):
+        return [self._logdir / instance / 'current']
+
     def receive_config(self, _service, instance):
         cfgname = self._resdir / f'{instance}.res'
         # don't send conffiles which we can't write
@@ -194,10 +205,20 @@ class SystemdJob(EntangleBaseJob):
     def service_logs(self, _service, instance):
         return self._journalctl_logs(f'entangle@{instance}')
 
+    def service_logfiles(self, _service, _instance):
+        return []
+
+    def service_logs_since(self, _service, instance, cursors):
+        return self._journalctl_logs_since(f'entangle@{instance}', cursors)
+
     def service_status(self, _service, instance):
         return self._async_status_systemd(instance, f'entangle@{instance}',
                                           self._control_tool)
 
+    def systemd_units(self):
+        return [(str(self._control_tool), f'entangle@{instance}')
+                for (_service, instance) in self._services]
+
 
 def Job(*args, **kwargs):
     if determine_init_system() == 'systemd':
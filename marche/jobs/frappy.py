@@ -96,13 +96,20 @@ class Job(BaseJob):
         return True
 
     def init(self):
+        self._services = self._find_services()
+        BaseJob.init(self)
+
+    def needs_reinit(self):
+        # new or removed config files change the services
+        return self._find_services() != self._services
+
+    def _find_services(self):
         try:
             nodes = [('frappy', fn.stem[:-4])
                      for fn in self._configdir.glob('*_cfg.py')]
         except OSError:
             nodes = []
-        self._services = sorted(nodes)
-        BaseJob.init(self)
+        return sorted(nodes)
 
     def get_services(self):
         return self._services
@@ -123,12 +130,19 @@ class Job(BaseJob):
         return self._async_status_systemd(instance, f'frappy@{instance}',
                                           self._control_tool)
 
+    def systemd_units(self):
+        return [(str(self._control_tool), f'frappy@{instance}')
+                for (_service, instance) in self._services]
+
     def service_output(self, _service, instance):
         return list(self._output.get(instance, []))
 
     def service_logs(self, _service, instance):
         return self._journalctl_logs(f'frappy@{instance}')
 
+    def service_logs_since(self, _service, instance, cursors):
+        return self._journalctl_logs_since(f'frappy@{instance}', cursors)
+
     def receive_config(self, _service, instance):
         cfgname = self._configdir / f'{instance}_cfg.py'
         # don't send conffiles which we can't write
@@ -96,7 +96,13 @@ class NicosBaseJob(BaseJob):
     def service_output(self, _service, instance):
         return list(self._output.get(instance, []))
 
-    def service_logs(self, _service, instance):
+    def service_logs(self, service, instance):
+        result = {}
+        for logfile in self.service_logfiles(service, instance):
+            result.update(extract_loglines(logfile))
+        return result
+
+    def service_logfiles(self, _service, instance):
         if self._logpath is None:
             # extract nicos log directory from nicos.conf
             conffile = self._root / 'nicos.conf'
@@ -110,13 +116,9 @@ class NicosBaseJob(BaseJob):
                 self._logpath = self._root / 'log'
 
         if not instance:
-            result = {}
-            for subdir in self._logpath.iterdir():
-                logfile = subdir / 'current'
-                if logfile.is_symlink():  # pragma: no cover
-                    result.update(extract_loglines(logfile))
-            return result
-        return extract_loglines(self._logpath / instance / 'current')
+            return [subdir / 'current' for subdir in self._logpath.iterdir()
+                    if (subdir / 'current').is_symlink()]
+        return [self._logpath / instance / 'current']
 
     def receive_config(self, _service, instance):
         if instance not in ('', 'daemon'):
@@ -164,13 +166,21 @@ class InitJob(NicosBaseJob):
         return True
 
     def init(self):
-        self._services = [('nicos', '')]
+        self._services = self._find_services()
+        BaseJob.init(self)
+
+    def needs_reinit(self):
+        # the services are configured in the NICOS installation
+        return self._find_services() != self._services
+
+    def _find_services(self):
+        services = [('nicos', '')]
         lines = self._sync_call(f'{self._script} 2>&1').stdout
         prefix = 'Possible services are '
         if len(lines) >= 2 and lines[-1].startswith(prefix):
-            self._services.extend(('nicos', entry.strip()) for entry in
-                                  lines[-1][len(prefix):].split(','))
-        BaseJob.init(self)
+            services.extend(('nicos', entry.strip()) for entry in
+                            lines[-1][len(prefix):].split(','))
+        return services
 
     def start_service(self, _service, instance):
         return self._async_start(instance, f'{self._script} start {instance}')
@@ -257,16 +267,23 @@ class SystemdJob(NicosBaseJob):
         return True
 
     def init(self):
-        # for now, just offer the basic service corresponding to nicos.target
-        self._services = [('nicos', '')]
+        # the poller needs the units to decide how to poll them
+        self._services = self._find_services()
         BaseJob.init(self)
 
     def get_services(self):
         # repeatedly try to get the actual service list until the generator
         # has run through
-        if len(self._services) > 1:
-            return self._services
+        if len(self._services) <= 1:
+            self._services = self._find_services()
+        return self._services
+
+    def needs_reinit(self):
+        # the generator creates the units from the NICOS configuration
+        return self._find_services() != self._services
 
+    def _find_services(self):
+        services = [('nicos', '')]
         # TODO: switch to `-o json` mode once we can depend on newer systemd
         lines = self._sync_call('systemctl list-units --all --no-legend '
                                 '"nicos-*" 2>&1').stdout
@@ -277,8 +294,8 @@ class SystemdJob(NicosBaseJob):
             if split[0].startswith('nicos-'):
                 instance = split[0][6:-8]
                 if instance != 'late-generator':
-                    self._services.append(('nicos', instance))
-        return self._services
+                    services.append(('nicos', instance))
+        return services
 
     def start_service(self, _service, instance):
         if instance:
@@ -304,10 +321,18 @@ class SystemdJob(NicosBaseJob):
             return async_st or self.all_service_status()[service, '']
         return self._async_status_systemd(instance, f'nicos-{instance}')
 
-    def all_service_status(self):
-        result = {}
-        initstates = {}
-        something_dead = something_running = False
+    def systemd_units(self):
+        # called on every poll, so don't look for new services here
+        return [('systemctl', f'nicos-{instance}')
+                for (_service, instance) in self._services if instance]
+
+    def _instance_substates(self):
+        units = {f'nicos-{instance}': instance
+                 for (_service, instance) in self._services if instance}
+        if units and all(unit in self.systemd_substates for unit in units):
+            return {instance: self.systemd_substates[unit]
+                    for (unit, instance) in units.items()}
+        substates = {}
         name = ''
         for line in self._sync_call('systemctl show -p Id -p SubState '
                                     '"nicos-*"').stdout:
@@ -318,15 +343,21 @@ class SystemdJob(NicosBaseJob):
             if 'late-generator' in name:
                 continue
             if line.startswith('SubState='):
-                state = line[9:]
-                stateconst = SYSTEMD_STATE_MAP.get(state, DEAD)
-                if stateconst == DEAD:
-                    something_dead = True
-                elif stateconst == RUNNING:
-                    something_running = True
-                instance = name[6:-8]
-                initstates[instance] = (stateconst,
-                                        state if state != 'running' else '')
+                substates[name[6:-8]] = line[9:]
+        return substates
+
+    def all_service_status(self):
+        result = {}
+        initstates = {}
+        something_dead = something_running = False
+        for instance, state in self._instance_substates().items():
+            stateconst = SYSTEMD_STATE_MAP.get(state, DEAD)
+            if stateconst == DEAD:
+                something_dead = True
+            elif stateconst == RUNNING:
+                something_running = True
+            initstates[instance] = (stateconst,
+                                    state if state != 'running' else '')
         for service, instance in self._services:
             async_st = self._async_status_only(instance)
             if async_st is not None:
@@ -0,0 +1,282 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+""".. index:: remote; job
+
+.. _remote-job:
+
+Remote daemon job
+=================
+
+This job provides the services of another Marche daemon.  A daemon with
+``remote`` jobs for many hosts works as a gateway: clients only talk to the
+gateway, which keeps one connection to each host, regardless of the number of
+clients.
+
+The job caches the service info of the remote daemon.  Daemons that support it
+(Marche 5 and newer) report status changes as they happen, which are passed
+on to the clients of the gateway immediately; older daemons are polled every
+``pollinterval`` seconds.  Starting, stopping and restarting services, as well
+as logs and config files, are forwarded to the remote daemon.
+
+The services are provided under the name ``prefix:service``, so that services
+with the same name on different hosts can be told apart.
+
+The list of services is read when the job is created.  If the remote daemon
+provides other services later (or could not be reached at first), reloading
+the gateway's configuration picks them up.
+
+This job has the following configuration parameters:
+
+.. describe:: [job.xxx]
+
+   .. describe:: type
+
+      Must be ``"remote"``.
+
+   .. describe:: host
+
+      The remote daemon, as ``"host"`` or ``"host:port"``.  The default port is
+      8124.
+
+   .. describe:: user
+                 passwd
+
+      The credentials used to log in to the remote daemon.  They determine
+      what the gateway is allowed to do there; the permissions of the gateway's
+      clients are checked as for any other job.
+
+   .. describe:: prefix
+
+      The prefix for the service names.  The default is the job name.
+
+   .. describe:: permissions
+                 pollinterval
+
+      The :ref:`standard parameters <standard-params>` present for all jobs.
+
+A typical section looks like this::
+
+    [job.instr1]
+    type = "remote"
+    host = "instr1.example.com"
+    user = "gateway"
+    passwd = "secret"
+"""
+
+import threading
+
+from marche.client import Client, ClientError
+from marche.jobs import NOT_AVAILABLE, Busy, Denied, Fault
+from marche.jobs.base import Job as BaseJob
+from marche.protocol import Errors
+
+DEFAULT_PORT = 8124
+
+
+class Job(BaseJob):
+
+    # maximum time to wait for events from the remote daemon
+    WAIT_TIMEOUT = 5.0
+
+    def configure(self, config):
+        host, _, port = config['host'].partition(':')
+        self.host = host
+        self.port = int(port or DEFAULT_PORT)
+        self.user = config.get('user')
+        self.passwd = config.get('passwd')
+        self.prefix = config.get('prefix', self.name)
+        self.client = None
+        # the remote service info: (service, instance) -> instance info
+        self._info = {}
+        self._services = []
+        self._seq = -1
+        self._stopflag = threading.Event()
+        self._thread = None
+
+    def init(self):
+        try:
+            self._connect()
+            if self.client.version >= 5:
+                # get the current sequence number before the status, so that
+                # no events are missed
+                self._seq = self.client.waitEvents(-1, 0)[0]
+            self._info = self._parse(self.client.getAllServiceInfo())
+        except Exception as err:
+            self.client = None
+            self.log.warning('cannot reach %s:%s: %s', self.host, self.port,
+                             err)
+        self._services = [(f'{self.prefix}:{service}', instance)
+                          for (service, instance) in self._info]
+        BaseJob.init(self)
+        self._thread = threading.Thread(target=self._entry, daemon=True,
+                                        name=f'remote-{self.name}')
+        self._thread.start()
+
+    def needs_reinit(self):
+        return [(f'{self.prefix}:{service}', instance)
+                for (service, instance) in self._info] != self._services
+
+    def shutdown(self):
+        # not waiting for the thread, which can be waiting for events
+        self._stopflag.set()
+        BaseJob.shutdown(self)
+
+    def _connect(self):
+        self.client = Client(self.host, self.port, self.user, self.passwd)
+        if self.client.version < 3:
+            raise Fault('remote daemon is too old')
+
+    def _parse(self, services):
+        info = {}
+        for service, svcinfo in services.items():
+            for instance, instinfo in svcinfo['instances'].items():
+                info[service, instance] = instinfo
+        return info
+
+    def _update(self, services):
+        """Update the cache from the remote service info, and pass status
+        changes on to the clients.
+        """
+        self._info = self._parse(services)
+        self._emit(self.all_service_status())
+
+    def _emit(self, states):
+        # a job that is shut down might still receive data
+        if not self._stopflag.is_set():
+            self.poller.update(states)
+
+    def _apply(self, events):
+        """Update the cache from status events of the remote daemon."""
+        states = {}
+        for event in events:
+            key = (event['service'], event['instance'])
+            if event['type'] != 'status' or key not in self._info:
+                continue
+            self._info[key] = dict(self._info[key], state=event['state'],
+                                   ext_status=event['ext_status'])
+            states[f'{self.prefix}:{key[0]}', key[1]] = \
+                (event['state'], event['ext_status'])
+        self._emit(states)
+
+    def _entry(self):
+        generation = None
+        seq = self._seq
+        resync = True
+        while not self._stopflag.is_set():
+            try:
+                if self.client is None:
+                    self._connect()
+                    generation = None
+                    seq = -1
+                if self.client.version < 5:
+                    self._update(self.client.getAllServiceInfo())
+                    self._stopflag.wait(self.pollinterval or 3.0)
+                    continue
+                if seq < 0:
+                    seq = self.client.waitEvents(-1, 0)[0]
+                    resync = True
+                if resync:
+                    generation, services = \
+                        self.client.getServiceInfoUpdate(generation)
+                    if services is not None:
+                        self._update(services)
+                # block until something changes
+                seq, events, lost = self.client.waitEvents(
+                    seq, self.WAIT_TIMEOUT)
+                self._apply(events)
+                # check for other changes (e.g. descriptions) if there were
+                # no events, which is cheap if nothing has changed
+                resync = lost or not events
+                if lost:
+                    generation = None
+            except Exception as err:
+                if self.client is not None:
+                    self.log.warning('lost connection to %s:%s: %s',
+                                     self.host, self.port, err)
+                self.client = None
+                self._info = {key: dict(info, state=NOT_AVAILABLE,
+                                        ext_status='remote daemon unreachable')
+                              for (key, info) in self._info.items()}
+                self._emit(self.all_service_status())
+                self._stopflag.wait(self.pollinterval or 3.0)
+
+    def _remote(self, service):
+        """Return the name of the service on the remote daemon."""
+        return service[len(self.prefix) + 1:]
+
+    def _forward(self, method, service, instance, *args):
+        client = self.client
+        if client is None:
+            raise Fault('remote daemon unreachable')
+        try:
+            return getattr(client, method)(self._remote(service), instance,
+                                           *args)
+        except ClientError as err:
+            if err.code == Errors.BUSY:
+                raise Busy(str(err)) from None
+            if err.code == Errors.DENIED:
+                raise Denied(str(err)) from None
+            raise Fault(str(err)) from None
+
+    def get_services(self):
+        return self._services
+
+    def start_service(self, service, instance):
+        self._forward('startService', service, instance)
+
+    def stop_service(self, service, instance):
+        self._forward('stopService', service, instance)
+
+    def restart_service(self, service, instance):
+        self._forward('restartService', service, instance)
+
+    def service_status(self, service, instance):
+        info = self._info.get((self._remote(service), instance))
+        if info is None:
+            return NOT_AVAILABLE, 'remote daemon unreachable'
+        return info['state'], info['ext_status']
+
+    def all_service_status(self):
+        return {key: self.service_status(*key) for key in self._services}
+
+    def service_description(self, service, instance):
+        info = self._info.get((self._remote(service), instance))
+        return info['desc'] if info else ''
+
+    def service_output(self, service, instance):
+        return self._forward('getServiceOutput', service, instance)
+
+    def service_logs(self, service, instance):
+        return self._forward('getServiceLogFiles', service, instance)
+
+    def service_logs_since(self, service, instance, cursors):
+        return self._forward('followServiceLogs', service, instance, cursors)
+
+    def receive_config(self, service, instance):
+        data = self._forward('receiveServiceConfig', service, instance)
+        return dict(zip(data[::2], data[1::2]))
+
+    def send_config(self, service, instance, filename, contents):
+        self._forward('sendServiceConfig', service, instance,
+                      [filename, contents])
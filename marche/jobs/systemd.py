@@ -117,6 +117,9 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
     def service_status(self, service, _instance):
         return self._async_status_systemd(service, self.unit, self.SYSTEMCTL)
 
+    def systemd_units(self):
+        return [(self.SYSTEMCTL, self.unit)]
+
     def service_output(self, service, _instance):
         return list(self._output.get(service, []))
 
@@ -124,3 +127,8 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
         if not self.log_files:
             return self._journalctl_logs(f'{self.unit}')
         return LogfileMixin.service_logs(self, service, instance)
+
+    def service_logs_since(self, service, instance, cursors):
+        if not self.log_files:
+            return self._journalctl_logs_since(f'{self.unit}', cursors)
+        return BaseJob.service_logs_since(self, service, instance, cursors)
@@ -0,0 +1,216 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Serving journal entries of systemd units from memory."""
+
+import collections
+import json
+import shlex
+import threading
+from subprocess import DEVNULL, PIPE, Popen
+from time import monotonic
+
+from marche.systemdbus import mangle_unit_name
+from marche.utils import AsyncProcess, convert_journalctl_logs
+
+# fields selected by "journalctl -u", used to assign entries to units
+UNIT_FIELDS = ('_SYSTEMD_UNIT', 'UNIT', 'OBJECT_SYSTEMD_UNIT', 'COREDUMP_UNIT')
+
+OUTPUT_FIELDS = 'PRIORITY,_PID,MESSAGE,_SOURCE_REALTIME_TIMESTAMP,TRACEBACK'
+
+
+class JournalReader:
+    """Keeps the recent journal entries of systemd units in memory.
+
+    A unit's entries are read with ``journalctl -n`` when they are first
+    requested.  From then on, a single ``journalctl -f`` process following
+    all requested units adds their new entries.  It is restarted (after the
+    last entry it has seen) when another unit is requested.
+
+    While the follower is not running (e.g. if it exits, until it is
+    restarted), the entries are read with ``journalctl -n`` every time.
+    """
+
+    ENTRIES = 500
+    RESTART_INTERVAL = 10.0
+
+    def __init__(self, journalctl, log):
+        self.journalctl = journalctl
+        self.log = log
+        self._lock = threading.Lock()
+        # mangled unit name -> deque of (cursor, formatted entry)
+        self._buffers = {}
+        # units being read with journalctl -n -> entries followed meanwhile
+        self._pending = {}
+        # mangled unit name -> unit name, for all units to follow
+        self._units = {}
+        # cursor of the last entry seen by the follower
+        self._cursor = None
+        self._proc = None
+        self._generation = 0
+        self._last_start = None
+
+    def stop(self):
+        with self._lock:
+            self._stop_follower()
+
+    def logs(self, unit, after_cursor=None):
+        """Return the entries of *unit* after *after_cursor*, or all recent
+        ones if not given or not known anymore.
+
+        Returns a tuple of the formatted entries and the cursor of the last
+        entry.
+        """
+        name = mangle_unit_name(unit)
+        with self._lock:
+            if name not in self._units:
+                self._units[name] = unit
+                # restart the follower to include the new unit
+                self._stop_follower()
+            self._ensure_running()
+            buf = self._buffers.get(name)
+            if buf is None:
+                self._pending.setdefault(name, [])
+                generation = self._generation
+        if buf is None:
+            buf = self._backfill(unit, name, generation)
+        else:
+            with self._lock:
+                buf = list(buf)
+        cursors = [cursor for (cursor, _) in buf]
+        if after_cursor and after_cursor in cursors:
+            buf = buf[cursors.index(after_cursor) + 1:]
+        cursor = buf[-1][0] if buf else after_cursor
+        return ''.join(text for (_, text) in buf), cursor or ''
+
+    def _backfill(self, unit, name, generation):
+        proc = AsyncProcess(0, self.log,
+                            f'{self.journalctl} -n {self.ENTRIES} -o json '
+                            f'-u {unit} --output-fields={OUTPUT_FIELDS}')
+        proc.start()
+        proc.join()
+        entries = [self._convert(line) for line in proc.stdout]
+        with self._lock:
+            followed = self._pending.pop(name, [])
+            if generation == self._generation and self._proc and \
+               name not in self._buffers:
+                # add what the follower has seen meanwhile
+                seen = {cursor for (cursor, _) in entries}
+                entries.extend(entry for entry in followed
+                               if entry[0] not in seen)
+                self._buffers[name] = collections.deque(
+                    entries, maxlen=self.ENTRIES)
+        return entries[-self.ENTRIES:]
+
+    @staticmethod
+    def _convert(line):
+        try:
+            cursor = json.loads(line)['__CURSOR']
+        except (ValueError, KeyError, TypeError):
+            cursor = None
+        return cursor, ''.join(convert_journalctl_logs([line]))
+
+    def _stop_follower(self):
+        proc = self._proc
+        self._proc = None
+        self._last_start = None
+        if proc:
+            proc.kill()
+
+    def _ensure_running(self):
+        if self._proc or (self._last_start is not None and
+                          monotonic() < self._last_start + self.RESTART_INTERVAL):
+            return
+        self._last_start = monotonic()
+        self._generation += 1
+        fields = ','.join((OUTPUT_FIELDS, *UNIT_FIELDS))
+        units = ' '.join(f'-u {shlex.quote(unit)}'
+                         for unit in self._units.values())
+        if self._cursor:
+            # continue where the previous follower stopped
+            start = f'--after-cursor={shlex.quote(self._cursor)}'
+        else:
+            # entries could be missing since the previous follower started
+            start = '-n 0'
+            self._buffers.clear()
+        try:
+            # exec, so that killing the process doesn't leave journalctl
+            self._proc = Popen(  # noqa: S602
+                f'exec {self.journalctl} -f {start} -o json '
+                f'--output-fields={fields} {units}', shell=True,
+                stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL)
+        except OSError as err:
+            self.log.warning('could not start journal follower: %s', err)
+            return
+        threading.Thread(target=self._follow, args=(self._proc,),
+                         daemon=True, name='journal').start()
+
+    def _follow(self, proc):
+        for line in proc.stdout:
+            line = line.decode('utf-8', 'replace')
+            try:
+                entry = json.loads(line)
+                cursor = entry['__CURSOR']
+            except (ValueError, KeyError, TypeError):
+                continue
+            text = ''.join(convert_journalctl_logs([line]))
+            with self._lock:
+                if self._proc is not proc:
+                    # replaced by a new follower, which continues from here
+                    break
+                self._cursor = cursor
+                for name in {entry.get(field) for field in UNIT_FIELDS}:
+                    if name in self._buffers:
+                        self._buffers[name].append((cursor, text))
+                    elif name in self._pending:
+                        self._pending[name].append((cursor, text))
+        proc.wait()
+        with self._lock:
+            if self._proc is not proc:
+                return
+            self.log.warning('journal follower exited with code %s',
+                             proc.returncode)
+            # entries could be missing now, start over
+            self._proc = None
+            self._cursor = None
+            self._generation += 1
+            self._buffers.clear()
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def get_reader(journalctl, log):
+    """Return the shared reader for the given journalctl command."""
+    with _readers_lock:
+        if journalctl not in _readers:
+            _readers[journalctl] = JournalReader(journalctl, log)
+        return _readers[journalctl]
+
+
+def stop_readers():
+    with _readers_lock:
+        for reader in _readers.values():
+            reader.stop()
+        _readers.clear()
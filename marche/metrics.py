@@ -0,0 +1,200 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Runtime metrics of the daemon, in the Prometheus text format."""
+
+import threading
+
+#: The content type of the text format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+                     .replace('\n', r'\n')
+
+
+def _format_labels(names, values, extra=''):
+    parts = [f'{name}="{_escape(value)}"' for (name, value) in
+             zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class for metrics; values are kept per combination of labels."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def remove(self, **labels):
+        """Remove the value for the given labels, e.g. of a removed job."""
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.doc}',
+                 f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        labels = _format_labels(self.labels, key)
+        return [f'{self.name}{labels} {_format_number(value)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, doc, labels)
+        self.buckets = (*sorted(buckets), float('inf'))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                # counts per bucket, sum
+                self._values[key] = [[0] * len(self.buckets), 0.0]
+            entry = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+
+    def get(self, **labels):
+        """Return the number and sum of the observations."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            if entry is None:
+                return None
+            return sum(entry[0]), entry[1]
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.labels, key,
+                                    f'le="{_format_number(bound)}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labels, key)
+        lines.append(f'{self.name}_sum{labels} {_format_number(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render():
+    """Return all metrics in the Prometheus text format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+COMMAND_CALLS = Counter(
+    'marche_command_calls_total', 'Number of job handler commands called.',
+    ['command'])
+COMMAND_ERRORS = Counter(
+    'marche_command_errors_total', 'Number of failed job handler commands.',
+    ['command', 'error'])
+COMMAND_SECONDS = Histogram(
+    'marche_command_duration_seconds', 'Duration of job handler commands.',
+    ['command'])
+
+PROCESS_SECONDS = Histogram(
+    'marche_process_duration_seconds', 'Duration of external commands.',
+    ['program'])
+PROCESS_TIMEOUTS = Counter(
+    'marche_process_timeouts_total', 'Number of timed out external commands.',
+    ['program'])
+PROCESSES_RUNNING = Gauge(
+    'marche_processes_running', 'Number of running external commands.')
+
+POLL_SECONDS = Histogram(
+    'marche_poll_duration_seconds', 'Duration of polling the service states '
+    'of a job.', ['job'])
+POLL_LAG = Gauge(
+    'marche_poll_lag_seconds', 'Delay of the last poll of a job beyond its '
+    'polling interval.', ['job'])
+POLL_ERRORS = Counter(
+    'marche_poll_errors_total', 'Number of failed polls of a job.', ['job'])
+
+EVENTS = Counter(
+    'marche_events_total', 'Number of events emitted to the interfaces.',
+    ['type'])
+EVENT_DELIVERIES = Counter(
+    'marche_event_deliveries_total', 'Number of events handed to interfaces.',
+    ['interface'])
@@ -27,11 +27,18 @@ import queue
 import threading
 from time import monotonic
 
+from marche import systemdbus
+from marche.metrics import POLL_ERRORS, POLL_LAG, POLL_SECONDS
 from marche.protocol import StatusResponse
 
 
 class Poller:
-    """The poller object; each job instantiates a poller and can start it."""
+    """The poller object; each job instantiates a poller and can start it.
+
+    If the job's services are systemd units (see `Job.systemd_units`), the
+    poller does not start its own thread, but is served by the daemon-wide
+    `SystemdCollector`.
+    """
 
     def __init__(self, job, interval, event_callback):
         self.job = job
@@ -39,16 +46,27 @@ class Poller:
         self.fast_interval = interval
         self.queue = queue.Queue()
         self.event_callback = event_callback
+        self.collector = None
         self._thread = None
         self._stoprequest = False
+        self._errors = 0
         self._cache = {}
+        self._last_poll = None
 
     def start(self):
+        if self.job.systemd_units():
+            self.collector = systemd_collector
+            self.collector.register(self)
+            return
         self._stoprequest = False
         self._thread = threading.Thread(target=self._entry, daemon=True)
         self._thread.start()
 
     def stop(self):
+        POLL_LAG.remove(job=self.job.name)
+        if self.collector:
+            self.collector.unregister(self)
+            self.collector = None
         if self._thread and self._thread.is_alive():
             self._stoprequest = True
             self.queue.put(None)
@@ -63,8 +81,58 @@ class Poller:
     def invalidate(self, service, instance):
         self._cache.pop((service, instance), None)
 
+    def poll_now(self):
+        if self.collector:
+            self.collector.poll_now()
+            return
+        # poll faster after something has changed
+        self.fast_interval = self.interval / 6
+        self.queue.put(True)  # noqa: FBT003
+
+    def poll(self, substates=None):
+        """Poll the status of all services of the job once.
+
+        *substates* can be a dictionary of already known systemd unit
+        substates, which the job uses instead of querying systemd itself.
+        """
+        started = monotonic()
+        if self._last_poll is not None:
+            POLL_LAG.set(max(0.0, started - self._last_poll - self.interval),
+                         job=self.job.name)
+        self._last_poll = started
+        try:
+            with self.job.lock:
+                self.job.systemd_substates = substates or {}
+                try:
+                    states = self.job.all_service_status()
+                finally:
+                    self.job.systemd_substates = {}
+        except Exception:
+            POLL_ERRORS.inc(job=self.job.name)
+            if self._errors < 3:
+                self.job.log.exception('error while polling')
+            self._errors += 1
+            return
+        finally:
+            POLL_SECONDS.observe(monotonic() - started, job=self.job.name)
+        self._errors = 0
+        self.update(states)
+
+    def update(self, states):
+        """Update the cache with new states, and emit events for changes."""
+        for key, result in states.items():
+            if result != self._cache.get(key, [0, None])[1]:
+                self._cache[key] = [monotonic(), result]
+                self.event_callback(StatusResponse(
+                    service=key[0],
+                    instance=key[1],
+                    state=result[0],
+                    ext_status=result[1],
+                ))
+            else:
+                self._cache[key][0] = monotonic()
+
     def _entry(self):
-        errors = 0
         while not self._stoprequest:
             try:
                 # Wait interval or until something arrives in the queue.
@@ -76,23 +144,140 @@ class Poller:
                     continue
             except queue.Empty:
                 pass
+            self.poll()
+
+
+class SystemdCollector:
+    """Polls the systemd units of all registered pollers in one thread.
+
+    Each cycle, the substates of all units are queried with a single
+    ``systemctl show`` call (one per distinct systemctl command), and then
+    handed to the jobs to determine their service states.
+
+    If enabled with `enable_dbus`, unit substates are instead tracked by a
+    `SystemdWatcher`, which lets the jobs update their states as soon as a
+    unit changes.  The polling cycle then only refreshes the states from
+    the known substates, and falls back to querying systemctl for units that
+    are not tracked (or while the bus is unavailable).
+    """
+
+    def __init__(self):
+        self.interval = 3.0
+        self.fast_interval = self.interval
+        self.watcher = None
+        self._pollers = []
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+        self._stoprequest = False
+
+    def register(self, poller):
+        with self._lock:
+            self._pollers.append(poller)
+            self.interval = min(p.interval for p in self._pollers)
+            if self._thread is None:
+                self._stoprequest = False
+                self._thread = threading.Thread(target=self._entry,
+                                                daemon=True)
+                self._thread.start()
+        # get the initial state of the new units right away
+        self._event.set()
+
+    def unregister(self, poller):
+        with self._lock:
+            if poller in self._pollers:
+                self._pollers.remove(poller)
+
+    def poll_now(self):
+        # poll faster after something has changed
+        self.fast_interval = self.interval / 6
+        self._event.set()
+
+    def stop(self):
+        """Stop the collector thread and the D-Bus watcher, if running."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stoprequest = True
+        if thread:
+            self._event.set()
+            thread.join()
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
+
+    def enable_dbus(self, log, bus='SYSTEM'):
+        """Track unit states via D-Bus signals, if possible."""
+        if self.watcher is not None:
+            return
+        if systemdbus.jeepney is None:
+            log.warning('jeepney module not available, cannot track systemd '
+                        'units via D-Bus')
+            return
+        self.watcher = systemdbus.SystemdWatcher(self._units_changed, log, bus)
+        self.watcher.start()
+
+    def _units_changed(self, units):
+        with self._lock:
+            pollers = list(self._pollers)
+        substates = dict(self.watcher.substates)
+        for poller in pollers:
+            if any(unit in units for (_, unit) in poller.job.systemd_units()):
+                poller.poll(substates)
+
+    def _entry(self):
+        while not self._stoprequest:
+            self._event.wait(self.fast_interval)
+            self._event.clear()
+            if self._stoprequest:
+                break
+            # increase gradually fast interval up to normal value
+            self.fast_interval = min(self.interval, self.fast_interval * 1.5)
+            with self._lock:
+                pollers = list(self._pollers)
+            if pollers:
+                self.poll(pollers)
+
+    def poll(self, pollers):
+        substates = {}
+        if self.watcher:
+            self.watcher.watch(unit for poller in pollers
+                               for (_, unit) in poller.job.systemd_units())
+            if self.watcher.connected:
+                substates.update(self.watcher.substates)
+        commands = {}
+        for poller in pollers:
+            for systemctl, unit in poller.job.systemd_units():
+                if unit in substates:
+                    continue
+                job, units = commands.setdefault(systemctl, (poller.job, set()))
+                units.add(unit)
+        for systemctl, (job, units) in commands.items():
             try:
-                with self.job.lock:
-                    states = self.job.all_service_status()
-            except Exception:
-                if errors < 3:
-                    self.job.log.exception('error while polling')
-                errors += 1
-                continue
-            errors = 0
-            for key, result in states.items():
-                if result != self._cache.get(key, [0, None])[1]:
-                    self._cache[key] = [monotonic(), result]
-                    self.event_callback(StatusResponse(
-                        service=key[0],
-                        instance=key[1],
-                        state=result[0],
-                        ext_status=result[1],
-                    ))
-                else:
-                    self._cache[key][0] = monotonic()
+                substates.update(self._query(job, systemctl, sorted(units)))
+            except Exception:  # noqa: PERF203
+                job.log.exception('error while querying systemd units')
+        for poller in pollers:
+            poller.poll(substates)
+
+    def _query(self, job, systemctl, units):
+        cmd = f'{systemctl} show -p Id -p SubState ' + \
+            ' '.join(f'"{unit}"' for unit in units)
+        blocks = [{}]
+        for line in job._sync_call(cmd).stdout:  # noqa: SLF001
+            key, sep, value = line.strip().partition('=')
+            if sep:
+                blocks[-1][key] = value
+            elif blocks[-1]:
+                blocks.append({})
+        if not blocks[-1]:
+            blocks.pop()
+        # systemctl outputs one block per unit in the given order; if that
+        # doesn't match up, the jobs query their units themselves
+        if len(blocks) != len(units):
+            return {}
+        return {unit: block['SubState'] for (unit, block) in zip(units, blocks)
+                if 'SubState' in block}
+
+
+#: The collector shared by all jobs of the daemon.
+systemd_collector = SystemdCollector()
@@ -24,7 +24,7 @@
 """Constants for use with the new Marche protocol."""
 
 # Increment this when making changes to the protocol.
-PROTO_VERSION = 4
+PROTO_VERSION = 6
 
 
 class Errors:
@@ -44,8 +44,9 @@ class Response:  # noqa: PLW1641  TODO: implement hash?
 
 
 class ServiceListResponse(Response):
-    def __init__(self, services):
+    def __init__(self, services, generation=None):
         self.services = services
+        self.generation = generation
 
 
 class ServiceResponse(Response):
@@ -68,6 +69,12 @@ class ErrorResponse(ServiceResponse):
         self.desc = desc
 
 
+class BulkControlResponse(Response):
+    def __init__(self, results):
+        # list of (service, instance, error code or 0, error message)
+        self.results = results
+
+
 class ControlOutputResponse(ServiceResponse):
     def __init__(self, service, instance, content):
         ServiceResponse.__init__(self, service, instance)
@@ -88,6 +95,12 @@ class LogfileResponse(FileResponse):
     pass
 
 
+class LogUpdateResponse(FileResponse):
+    def __init__(self, service, instance, files, cursors):
+        FileResponse.__init__(self, service, instance, files)
+        self.cursors = cursors
+
+
 class FoundHostResponse(Response):
     def __init__(self, host, version):
         self.host = host
@@ -23,10 +23,15 @@
 
 """Utils for scanning for Marche daemons within the network."""
 
+import errno
 import os
 import select
+import selectors
 import socket
 import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from time import monotonic
 from time import time as currenttime
 
 from marche.iface.udp import UDP_PORT
@@ -36,6 +41,52 @@ if os.name != 'nt':
 else:
     netifaces = None
 
+# connect_ex() results of a connection in progress
+CONNECT_PENDING = {errno.EINPROGRESS, errno.EWOULDBLOCK,
+                   getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)}
+
+# how long to wait for the name of a responder before reporting its address
+RESOLVE_TIMEOUT = 1.0
+# how long resolved names are remembered
+NAME_CACHE_TIME = 600.0
+
+_names_lock = threading.Lock()
+# address -> (name, expiry time)
+_names = {}
+# address -> future of lookups in progress
+_lookups = {}
+
+
+def _lookup(addr, future):
+    try:
+        name = socket.gethostbyaddr(addr)[0]
+    except OSError:
+        name = addr
+    with _names_lock:
+        _names[addr] = (name, monotonic() + NAME_CACHE_TIME)
+        del _lookups[addr]
+    future.set_result(name)
+
+
+def resolve(addr):
+    """Return a future for the host name of *addr*.
+
+    The lookup runs in a separate thread; names (or the address, if there is
+    no name) are cached for `NAME_CACHE_TIME` seconds.
+    """
+    with _names_lock:
+        name, expiry = _names.get(addr, (None, 0))
+        if expiry > monotonic():
+            future = Future()
+            future.set_result(name)
+            return future
+        if addr in _lookups:
+            return _lookups[addr]
+        future = _lookups[addr] = Future()
+    # daemon threads, since lookups can hang and cannot be cancelled
+    threading.Thread(target=_lookup, args=(addr, future), daemon=True,
+                     name='resolve').start()
+    return future
 
 
 def scan(my_uid, max_wait=1.0):
@@ -57,36 +108,56 @@ def scan(my_uid, max_wait=1.0):
                 if 'broadcast' in addr:
                     s.sendto(b'PING', (addr['broadcast'], UDP_PORT))
     start = currenttime()
+    # responders are reported once their name is known, so that slow lookups
+    # don't hold up reading the other replies
+    lookups = []
+    addrs = set()
     seen = set()
-    while currenttime() < start + max_wait:
-        res = select.select([s], [], [], 0.1)
-        if res[0]:
-            try:
-                msg, addr = s.recvfrom(1024)
-            except OSError:  # pragma: no cover
-                continue
-            msg = msg.decode().split()
-            if msg[0] != 'PONG':
-                continue
-            if len(msg) < 2:
-                msg.append(1)
-            if len(msg) < 3:
-                msg.append('')
-            try:
-                version = int(msg[1])
-                uid = msg[2]
-            except Exception:  # noqa: S112
-                continue
-            if uid == my_uid:
-                continue
-            try:
-                addr = socket.gethostbyaddr(addr[0])[0]
-            except OSError:  # pragma: no cover
-                addr = addr[0]
-            if addr in seen:
-                continue
-            seen.add(addr)
-            yield addr, version
+
+    def report(lookup):
+        future, addr, version = lookup[:3]
+        name = future.result() if future.done() else addr
+        if name not in seen:
+            seen.add(name)
+            yield name, version
+
+    try:
+        while currenttime() < start + max_wait:
+            res = select.select([s], [], [], 0.1)
+            if res[0]:
+                try:
+                    msg, addr = s.recvfrom(1024)
+                except OSError:  # pragma: no cover
+                    continue
+                msg = msg.decode().split()
+                if msg[0] != 'PONG':
+                    continue
+                if len(msg) < 2:
+                    msg.append(1)
+                if len(msg) < 3:
+                    msg.append('')
+                try:
+                    version = int(msg[1])
+                    uid = msg[2]
+                except Exception:  # noqa: S112
+                    continue
+                if uid == my_uid or addr[0] in addrs:
+                    continue
+                addrs.add(addr[0])
+                lookups.append((resolve(addr[0]), addr[0], version,
+                                monotonic() + RESOLVE_TIMEOUT))
+            for lookup in [lookup for lookup in lookups if lookup[0].done()]:
+                lookups.remove(lookup)
+                yield from report(lookup)
+    finally:
+        s.close()
+    # wait for the remaining names, but not longer than the lookup timeout
+    for lookup in lookups:
+        try:
+            lookup[0].result(max(0, lookup[3] - monotonic()))
+        except FutureTimeout:
+            pass
+        yield from report(lookup)
 
 
 def scan_async(callback, my_uid, max_wait=1.0):
@@ -94,3 +165,64 @@ def scan_async(callback, my_uid, max_wait=1.0):
         for host, version in scan(my_uid, max_wait):
             callback(host, version)
     threading.Thread(target=thread, daemon=True).start()
+
+
+def probe_hosts(hosts, port, timeout=0.2, max_pending=512, progress=None):
+    """Try to connect to *port* on all *hosts*, and yield the hosts that
+    accept the connection as soon as they do.
+
+    The connections are made concurrently, with at most *max_pending* in
+    flight, and are given up after *timeout* seconds.  If given, *progress*
+    is called with the number of hosts that are done so far.
+    """
+    hosts = iter(hosts)
+    sel = selectors.DefaultSelector()
+    # socket -> deadline, in the order of the connects
+    pending = {}
+    done = 0
+
+    def finish(sock):
+        nonlocal done
+        sel.unregister(sock)
+        del pending[sock]
+        sock.close()
+        done += 1
+
+    try:
+        while True:
+            for host in hosts:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)  # noqa: FBT003
+                try:
+                    err = sock.connect_ex((host, port))
+                except OSError:
+                    err = -1
+                if err not in CONNECT_PENDING and err != 0:
+                    sock.close()
+                    done += 1
+                    continue
+                sel.register(sock, selectors.EVENT_WRITE, host)
+                pending[sock] = monotonic() + timeout
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                return
+            first_deadline = next(iter(pending.values()))
+            for key, _ in sel.select(max(0, first_deadline - monotonic())):
+                sock = key.fileobj
+                connected = sock.getsockopt(socket.SOL_SOCKET,
+                                            socket.SO_ERROR) == 0
+                finish(sock)
+                if connected:
+                    yield key.data
+            now = monotonic()
+            for sock, deadline in list(pending.items()):
+                if deadline > now:
+                    break
+                finish(sock)
+            if progress:
+                progress(done)
+    finally:
+        for sock in pending:
+            sock.close()
+        sel.close()
@@ -0,0 +1,189 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Tracking of systemd unit states via D-Bus signals."""
+
+import collections
+import threading
+
+try:
+    import jeepney
+    import jeepney.io.blocking
+except ImportError:  # pragma: no cover
+    jeepney = None
+
+SYSTEMD_BUS_NAME = 'org.freedesktop.systemd1'
+SYSTEMD_PATH = '/org/freedesktop/systemd1'
+UNIT_PATH_PREFIX = '/org/freedesktop/systemd1/unit'
+MANAGER_INTERFACE = 'org.freedesktop.systemd1.Manager'
+UNIT_INTERFACE = 'org.freedesktop.systemd1.Unit'
+
+UNIT_SUFFIXES = ('.service', '.socket', '.device', '.mount', '.automount',
+                 '.swap', '.target', '.path', '.timer', '.slice', '.scope')
+
+
+def mangle_unit_name(unit):
+    """Add the ``.service`` suffix to a unit name, like systemctl does."""
+    if unit.endswith(UNIT_SUFFIXES):
+        return unit
+    return unit + '.service'
+
+
+def changed_signal_rule(sender=None):
+    rule = jeepney.MatchRule(type='signal', sender=sender,
+                             interface='org.freedesktop.DBus.Properties',
+                             member='PropertiesChanged',
+                             path_namespace=UNIT_PATH_PREFIX)
+    rule.add_arg_condition(0, UNIT_INTERFACE)
+    return rule
+
+
+class SystemdWatcher:
+    """Watches the substate of systemd units via D-Bus.
+
+    The watcher subscribes to the ``PropertiesChanged`` signals of the units
+    given to `watch`, keeps their current substate in `substates`, and calls
+    *callback* with the set of unit names whenever a substate changes.
+
+    The bus connection is handled by a separate thread, which tries to
+    reconnect if the bus goes away.  While not `connected`, the unit states
+    have to be determined by other means.
+    """
+
+    RECONNECT_INTERVAL = 10.0
+    CALL_TIMEOUT = 2.0
+
+    def __init__(self, callback, log, bus='SYSTEM'):
+        self.callback = callback
+        self.log = log
+        self.bus = bus
+        self.connected = False
+        self.substates = {}
+        self._manager = jeepney.DBusAddress(SYSTEMD_PATH, SYSTEMD_BUS_NAME,
+                                            MANAGER_INTERFACE)
+        self._units = set()
+        self._loaded = set()
+        self._paths = {}
+        self._lock = threading.Lock()
+        self._stopflag = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopflag.clear()
+        self._thread = threading.Thread(target=self._entry, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopflag.set()
+        if self._thread:
+            self._thread.join()
+
+    def watch(self, units):
+        """Add units to watch, they are subscribed to by the thread."""
+        with self._lock:
+            self._units.update(units)
+
+    def _entry(self):
+        warned = False
+        while not self._stopflag.is_set():
+            try:
+                with jeepney.io.blocking.open_dbus_connection(self.bus) as conn:
+                    self._run(conn)
+            except Exception as err:
+                if self.connected:
+                    self.log.warning('lost D-Bus connection to systemd: %s',
+                                     err)
+                elif not warned:
+                    self.log.warning('cannot track systemd units via D-Bus, '
+                                     'polling instead: %s', err)
+                warned = True
+            self.connected = False
+            self.substates = {}
+            self._loaded = set()
+            self._paths = {}
+            self._stopflag.wait(self.RECONNECT_INTERVAL)
+
+    def _call(self, conn, msg):
+        reply = conn.send_and_get_reply(msg, timeout=self.CALL_TIMEOUT)
+        return jeepney.wrappers.unwrap_msg(reply)
+
+    def _run(self, conn):
+        # the signal sender's well-known name can only be matched by the bus
+        # daemon, not in the local filter
+        self._call(conn, jeepney.message_bus.AddMatch(
+            changed_signal_rule(SYSTEMD_BUS_NAME)))
+        with conn.filter(changed_signal_rule(),
+                         queue=collections.deque()) as signals:
+            self._call(conn, jeepney.new_method_call(self._manager,
+                                                     'Subscribe'))
+            self.connected = True
+            self.log.info('tracking systemd units via D-Bus')
+            while not self._stopflag.is_set():
+                changed = self._load_units(conn)
+                try:
+                    conn.recv_messages(timeout=0.5)
+                except TimeoutError:
+                    pass
+                while signals:
+                    changed.update(self._handle_signal(conn, signals.popleft()))
+                if changed:
+                    self.callback(changed)
+
+    def _get_substate(self, conn, path):
+        unit = jeepney.DBusAddress(path, SYSTEMD_BUS_NAME, UNIT_INTERFACE)
+        return self._call(conn, jeepney.Properties(unit).get('SubState'))[0][1]
+
+    def _load_units(self, conn):
+        with self._lock:
+            new = self._units - self._loaded
+        for unit in sorted(new):
+            self._loaded.add(unit)
+            try:
+                path = self._call(conn, jeepney.new_method_call(
+                    self._manager, 'LoadUnit', 's',
+                    (mangle_unit_name(unit),)))[0]
+                substate = self._get_substate(conn, path)
+            except jeepney.DBusErrorResponse as err:
+                self.log.warning('cannot track unit %s via D-Bus: %s',
+                                 unit, err)
+                continue
+            self._paths.setdefault(path, set()).add(unit)
+            self.substates[unit] = substate
+        return new & set(self.substates)
+
+    def _handle_signal(self, conn, msg):
+        units = self._paths.get(msg.header.fields.get(
+            jeepney.HeaderFields.path), ())
+        if not units:
+            return ()
+        _iface, changed, invalidated = msg.body
+        if 'SubState' in changed:
+            substate = changed['SubState'][1]
+        elif 'SubState' in invalidated:
+            substate = self._get_substate(
+                conn, msg.header.fields[jeepney.HeaderFields.path])
+        else:
+            return ()
+        for unit in units:
+            self.substates[unit] = substate
+        return units
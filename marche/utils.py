@@ -24,18 +24,20 @@
 
 """Utilities for the package."""
 
-import collections
+import asyncio
+import concurrent.futures
 import json
 import os
 import re
-import select
 import socket
 import sys
+import threading
 from pathlib import Path
 from subprocess import PIPE, CalledProcessError, Popen, check_output
-from threading import Thread
 from time import localtime, monotonic, strftime
 
+from marche.metrics import PROCESS_SECONDS, PROCESS_TIMEOUTS, PROCESSES_RUNNING
+
 
 class lazy_property:  # noqa: N801
     """A property that calculates its value only once."""
@@ -52,30 +54,83 @@ class lazy_property:  # noqa: N801
         return obj.__dict__[self.__name__]
 
 
-if os.name == 'nt':  # pragma: no cover
-    class Poller:
-        """A poor imitation of polling for Windows."""
-
-        def __init__(self):
-            self.fds = []
-
-        def register(self, fp, _opt):
-            self.fds.append(fp.fileno())
-
-        def poll(self, _timeout):
-            return [(fd, None) for fd in self.fds]
-    POLLIN = None
-
-else:
-    Poller = select.poll
-    POLLIN = select.POLLIN
-
-
-class AsyncProcess(Thread):
+class ProcessRunner:
+    """Runs the subprocesses of all `AsyncProcess` instances.
+
+    Instead of a thread per process, all processes are started and their
+    output is collected by a single asyncio event loop running in a
+    background thread, which is created on first use.
+    """
+
+    # maximum line length read from the pipes
+    LINE_LIMIT = 1024 * 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self.in_flight = 0
+        self.peak = 0
+        self.started = 0
+        self.timeouts = 0
+
+    def _get_loop(self):
+        with self._lock:
+            # after a fork (e.g. daemonizing), the loop thread is gone
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever, daemon=True,
+                                 name='processes').start()
+            return self._loop
+
+    def submit(self, proc):
+        """Start running the `AsyncProcess` *proc*, return a future."""
+        return asyncio.run_coroutine_threadsafe(self._run(proc),
+                                                self._get_loop())
+
+    def stats(self):
+        """Return statistics about the processes run so far."""
+        return {
+            'in_flight': self.in_flight,
+            'peak': self.peak,
+            'started': self.started,
+            'timeouts': self.timeouts,
+        }
+
+    async def _run(self, proc):
+        self.started += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        PROCESSES_RUNNING.set(self.in_flight)
+        program = proc.program()
+        started = monotonic()
+        try:
+            await asyncio.wait_for(proc.run(self.LINE_LIMIT), proc.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            PROCESS_TIMEOUTS.inc(program=program)
+            proc.log.warning('timeout occurred calling %s', proc.cmd)
+            proc.retcode = -1
+        except Exception as err:
+            proc.log.warning('could not call %s: %s', proc.cmd, err)
+        finally:
+            proc.kill()
+            # collect the exit status, the process would remain a zombie
+            await proc.reap()
+            self.in_flight -= 1
+            PROCESSES_RUNNING.set(self.in_flight)
+            PROCESS_SECONDS.observe(monotonic() - started, program=program)
+            proc.done = True
+
+
+#: The runner shared by all processes of the daemon.
+process_runner = ProcessRunner()
+
+
+class AsyncProcess:
     def __init__(self, status, log, cmd, stdout=None, stderr=None, *, sh=True,
                  timeout=5.0):
-        Thread.__init__(self, daemon=True)
-
         self.status = status
         self.log = log
         self.cmd = cmd
@@ -87,100 +142,222 @@ class AsyncProcess(Thread):
         self.stdout = stdout if stdout is not None else []
         self.stderr = stderr if stderr is not None else []
 
-    def run(self):
-        self.log.debug('call [sh:%s]: %s', self.use_sh, self.cmd)
-        proc = None
-        poller = None
-        started = monotonic()
+        self._proc = None
+        self._future = None
 
-        def poll_output():
-            """Read, log and store output (if any) from processes pipes."""
-            # collect fds with new output
-            fds = [entry[0] for entry in poller.poll(1000)]
-
-            if proc.stdout.fileno() in fds:
-                for line in iter(proc.stdout.readline, b''):
-                    line = line.translate(None, b'\r')
-                    line = line.decode('utf-8', 'replace')
-                    self.log.debug(line.rstrip())
-                    self.stdout.append(line)
-            if proc.stderr.fileno() in fds:
-                for line in iter(proc.stderr.readline, b''):
-                    line = line.translate(None, b'\r')
-                    line = line.decode('utf-8', 'replace')
-                    self.log.warning(line.rstrip())
-                    self.stderr.append(line)
+    def program(self):
+        """Return the name of the called program, without the path."""
+        args = self.cmd.split() if isinstance(self.cmd, str) else self.cmd
+        args = [arg for arg in args if arg != 'exec']
+        return Path(str(args[0])).name if args else ''
 
-        while True:
-            if proc is None:
-                # create and start process
-                proc = Popen(self.cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE,
-                             shell=self.use_sh)
-
-                # create poller
-                poller = Poller()
-
-                # register pipes to polling
-                poller.register(proc.stdout, POLLIN)
-                poller.register(proc.stderr, POLLIN)
-
-            poll_output()
-
-            # proc finished?
-            if proc.poll() is not None:
-                # poll once after the process ended to collect all the
-                # missing output
-                poll_output()
-                # assign return code
-                self.retcode = proc.returncode
-                self.log.debug('call retcode: %s', self.retcode)
-                break
+    def start(self):
+        self._future = process_runner.submit(self)
 
-            # timeout occurred?
-            if monotonic() > started + self.timeout:
-                try:
-                    proc.kill()
-                except Exception:
-                    pass
-                self.log.warning('timeout occurred calling %s', self.cmd)
-                self.retcode = -1
-                break
+    def join(self, timeout=None):
+        try:
+            self._future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            pass
+
+    def kill(self):
+        if self._proc is not None and self._proc.returncode is None:
+            try:
+                self._proc.kill()
+            except ProcessLookupError:  # pragma: no cover
+                pass
+
+    async def reap(self):
+        """Wait for the process to exit after it has been killed."""
+        if self._proc is not None and self._proc.returncode is None:
+            await self._wait()
 
-        self.done = True
+    async def run(self, limit):
+        self.log.debug('call [sh:%s]: %s', self.use_sh, self.cmd)
+        # only the fork/exec blocks here, asyncio.create_subprocess_* would
+        # need a child watcher thread per process before Python 3.12
+        self._proc = Popen(self.cmd, stdin=PIPE,  # noqa: ASYNC220
+                           stdout=PIPE, stderr=PIPE, shell=self.use_sh)
+        await asyncio.gather(
+            self._read(self._proc.stdout, self.stdout, self.log.debug, limit),
+            self._read(self._proc.stderr, self.stderr, self.log.warning, limit))
+        self.retcode = await self._wait()
+        self.log.debug('call retcode: %s', self.retcode)
+
+    async def _read(self, pipe, lines, log, limit):
+        """Read, log and store output from one of the process pipes."""
+        loop = asyncio.get_running_loop()
+        if os.name == 'nt':  # pragma: no cover
+            # the pipes created by Popen can't be added to the event loop on
+            # Windows, so read them in a thread
+            await loop.run_in_executor(None, self._read_blocking, pipe, lines,
+                                       log, limit)
+            return
+        reader = asyncio.StreamReader(limit=limit, loop=loop)
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader, loop=loop), pipe)
+        try:
+            while True:
+                line = await self._readline(reader, limit)
+                if not line:
+                    return
+                self._store(line, lines, log)
+        finally:
+            transport.close()
+
+    async def _readline(self, reader, limit):
+        """Read a line, and truncate it if it is longer than *limit*."""
+        try:
+            return await reader.readuntil(b'\n')
+        except asyncio.IncompleteReadError as err:
+            return err.partial
+        except asyncio.LimitOverrunError:
+            line = await reader.read(limit)
+        # skip the rest of the line
+        while True:
+            try:
+                await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError:
+                pass
+            except asyncio.LimitOverrunError:
+                await reader.read(limit)
+                continue
+            return line + b'\n'
+
+    def _read_blocking(self, pipe, lines, log, limit):  # pragma: no cover
+        for line in iter(lambda: pipe.readline(limit), b''):
+            if not line.endswith(b'\n'):
+                # skip the rest of the line, if it was too long
+                rest = line
+                while len(rest) == limit and not rest.endswith(b'\n'):
+                    rest = pipe.readline(limit)
+                line += b'\n'
+            self._store(line, lines, log)
+
+    def _store(self, line, lines, log):
+        line = line.translate(None, b'\r').decode('utf-8', 'replace')
+        log(line.rstrip())
+        lines.append(line)
+
+    async def _wait(self):
+        """Wait for the process to exit, without blocking the loop."""
+        loop = asyncio.get_running_loop()
+        try:
+            pidfd = os.pidfd_open(self._proc.pid)
+        except (AttributeError, OSError):  # pragma: no cover
+            # no pidfd support: wait in a thread of the default executor
+            return await loop.run_in_executor(None, self._proc.wait)
+        exited = loop.create_future()
+
+        def set_exited():
+            if not exited.done():
+                exited.set_result(None)
+        loop.add_reader(pidfd, set_exited)
+        try:
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+        return self._proc.wait()
 
 
 nontext_re = re.compile(r'[^\n\t\x20-\x7e]')
 
 
-def extract_loglines(fpath, n=500):
+# block size for reading files backwards
+TAIL_BLOCKSIZE = 64 * 1024
+
+# maximum number of rotated logs (name.1, name.2, ...) returned with a log
+MAX_ROTATED_LOGS = 5
+
+
+def _tail(fp, end, n, maxbytes):
+    limit = max(0, end - maxbytes)
+    blocks = []
+    newlines = 0
+    # the newline before the first wanted line must be found too
+    while end > limit and newlines <= n:
+        size = min(TAIL_BLOCKSIZE, end - limit)
+        end -= size
+        fp.seek(end)
+        block = fp.read(size)
+        blocks.append(block)
+        newlines += block.count(b'\n')
+    lines = b''.join(reversed(blocks)).split(b'\n')
+    last = lines.pop()
+    lines = [line + b'\n' for line in lines]
+    if last:
+        lines.append(last)
+    return b''.join(lines[-n:])
+
+
+def tail_file(fpath, n, maxbytes):
+    """Return the last *n* lines of the file as bytes.
+
+    The file is read backwards in blocks until enough lines are found, but
+    at most *maxbytes* from its end, so that very long lines can't make us
+    read the whole file.
+    """
+    with fpath.open('rb') as fp:
+        return _tail(fp, fp.seek(0, 2), n, maxbytes)
+
+
+def _decode_log(data):
+    return nontext_re.sub('', data.decode('latin1', 'ignore'))
+
+
+def extract_loglines(fpath, n=500, max_rotated=MAX_ROTATED_LOGS):
     def extract(fpath):
-        lines = collections.deque(maxlen=n)
-        with fpath.open('rb') as fp:
-            try:
-                # For very long files, skipping over all unneeded lines can
-                # take a while.  Set a limit on average line length instead.
-                fp.seek(-1000 * n, 2)
-            except OSError:
-                pass  # the file is too short
-            for line in fp:
-                line = line.decode('latin1', 'ignore')
-                lines.append(nontext_re.sub('', line))
-        return ''.join(lines)
+        # limit the average line length to keep reading bounded
+        return _decode_log(tail_file(fpath, n, 1000 * n))
     if not fpath.is_file():
         return {}
     fpath = fpath.resolve()
     result = {str(fpath): extract(fpath)}
-    # also add rotated logs
-    i = 1
-    while True:
+    # also add the most recent rotated logs
+    for i in range(1, max_rotated + 1):
         new = fpath.with_name(fpath.name + f'.{i}')
         if not new.is_file():
             break
         result[str(new)] = extract(new)
-        i += 1
     return result
 
 
+def follow_logfile(fpath, cursor=None, n=500):
+    """Return the contents appended to a logfile since *cursor*.
+
+    The cursor is a string ``"inode:offset"`` as returned by a previous call.
+    Without a valid cursor, or if the file was rotated or truncated since,
+    the last *n* lines are returned instead.  Only complete lines are
+    returned, and at most as much as `extract_loglines` would return.
+
+    Returns a tuple of the new contents and the new cursor, or None if the
+    file does not exist.
+    """
+    maxbytes = 1000 * n
+    try:
+        inode, offset = map(int, cursor.split(':'))
+    except (AttributeError, ValueError):
+        inode = offset = None
+    try:
+        fp = fpath.open('rb')
+    except OSError:
+        return None
+    with fp:
+        st = os.fstat(fp.fileno())
+        if inode == st.st_ino and 0 <= offset <= st.st_size:
+            start = max(offset, st.st_size - maxbytes)
+            fp.seek(start)
+            data = fp.read(st.st_size - start)
+        else:
+            data = _tail(fp, st.st_size, n, maxbytes)
+            start = st.st_size - len(data)
+    # keep an incomplete last line for the next call, unless it's too long
+    if len(data) < maxbytes:
+        data = data[:data.rfind(b'\n') + 1]
+    return _decode_log(data), f'{st.st_ino}:{start + len(data)}'
+
+
 SYSLOG_PRIO = {
     '0': 'emerg',
     '1': 'alert',
@@ -247,7 +424,39 @@ INIT_PKG_REQUESTS = [
 ]
 
 
+# directory that exists if systemd is running, see sd_booted(3)
+SYSTEMD_RUNTIME_DIR = '/run/systemd/system'
+
+_init_system = None
+_init_system_override = None
+_init_system_lock = threading.Lock()
+
+
+def set_init_system(init_system):
+    """Override the detected init system, or go back to detection if None."""
+    global _init_system_override  # noqa: PLW0603
+    _init_system_override = init_system or None
+
+
 def determine_init_system():
+    """Return the name of the init system.
+
+    It is only detected on the first call, the result is reused for the
+    lifetime of the process.
+    """
+    global _init_system  # noqa: PLW0603
+    if _init_system_override:
+        return _init_system_override
+    with _init_system_lock:
+        if _init_system is None:
+            _init_system = _probe_init_system()
+        return _init_system
+
+
+def _probe_init_system():
+    if Path(SYSTEMD_RUNTIME_DIR).is_dir():
+        return 'systemd'
+
     init_pkg = b''
 
     for entry in INIT_PKG_REQUESTS:
@@ -25,6 +25,8 @@
 
 from pathlib import Path
 
+import pytest
+
 from marche.config import Config
 from marche.permission import ADMIN, DISPLAY
 
@@ -47,3 +49,12 @@ def test_config():
         '$2b$10$UZgT67bTP6uSAHH3qjxN4OW.EXb6KlWvTt5adWiS9nrVrSofdRr6.',
     }]}
     assert config.iface_config == {'rpc': {}}
+
+
+def test_reload_error(tmp_path):
+    (tmp_path / 'job.conf').write_text('[job.myjob]\ntype = "init"\n')
+    config = Config(tmp_path)
+    (tmp_path / 'job.conf').write_text('[job.myjob\n')
+    pytest.raises(RuntimeError, config.reload)
+    # the previous configuration is kept
+    assert config.job_config == {'myjob': {'type': 'init'}}
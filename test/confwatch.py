@@ -0,0 +1,82 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for the configuration directory watcher."""
+
+import logging
+import time
+
+import pytest
+
+from marche import confwatch
+from test.utils import LogHandler, wait
+
+logger = logging.getLogger('testconfwatch')
+testhandler = LogHandler()
+logger.addHandler(testhandler)
+
+
+@pytest.fixture(params=['inotify', 'polling'])
+def watcher(request, tmp_path, monkeypatch):
+    if request.param == 'polling':
+        monkeypatch.setattr(confwatch, 'inotify_open', lambda _path: None)
+    elif confwatch.inotify_open(tmp_path) is None:
+        pytest.skip('inotify not available')
+    (tmp_path / 'job.conf').write_text('[job.a]\ntype = "init"\n')
+    reloads = []
+    watcher = confwatch.ConfigWatcher(tmp_path, lambda: reloads.append(1),
+                                      logger)
+    watcher.DEBOUNCE = 0.2
+    watcher.POLL_INTERVAL = 0.05
+    watcher.start()
+    # let the thread take the initial state
+    time.sleep(0.2)
+    yield tmp_path, reloads
+    watcher.stop()
+
+
+def test_watcher(watcher):
+    confdir, reloads = watcher
+    # a burst of changes results in a single reload
+    for i in range(5):
+        (confdir / 'job.conf').write_text(f'[job.a]\ntype = "init"\nn = {i}\n')
+        time.sleep(0.02)
+    wait(100, lambda: reloads)
+    time.sleep(0.5)
+    assert len(reloads) == 1
+
+    # other files are ignored
+    (confdir / 'job.conf~').write_text('foo')
+    time.sleep(0.5)
+    assert len(reloads) == 1
+
+    # invalid files are not loaded
+    nwarnings = len(testhandler.warnings)
+    (confdir / 'other.conf').write_text('[job.b\n')
+    wait(100, lambda: len(testhandler.warnings) > nwarnings)
+    assert len(reloads) == 1
+    (confdir / 'other.conf').write_text('[job.b]\ntype = "init"\n')
+    wait(100, lambda: len(reloads) == 2)
+
+    (confdir / 'other.conf').unlink()
+    wait(100, lambda: len(reloads) == 3)
@@ -0,0 +1,90 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for the shared status poller of the GUI."""
+
+import logging
+import socket
+import time
+
+import pytest
+
+from marche.config import Config
+from marche.gui.poller import Poller
+from marche.iface.rpc import Interface
+from test.utils import LogHandler, MockAuthHandler, MockJobHandler, wait
+
+logger = logging.getLogger('testpoller')
+logger.addHandler(LogHandler())
+
+
+@pytest.fixture
+def port():
+    config = Config()
+    config.iface_config['rpc'] = {'addr': '127.0.0.1:0'}
+    iface = Interface(config, MockJobHandler(), MockAuthHandler(), logger)
+    iface.run()
+    yield iface.server.server_address[1]
+    iface.shutdown()
+
+
+@pytest.fixture
+def poller():
+    poller = Poller(interval=0.2, timeout=1.0)
+    poller.WAIT_TIMEOUT = 0.2
+    poller.start()
+    yield poller
+    poller.stop()
+
+
+def test_poller(port, poller):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        closed_port = sock.getsockname()[1]
+
+    results = {}
+
+    def callback(key, services):
+        results.setdefault(key, []).append(services)
+
+    for i in range(10):
+        poller.add(i, '127.0.0.1', port, 'test', 'test', callback=callback)
+    poller.add('creds', '127.0.0.1', port, 'wrong', 'creds', callback=callback)
+    poller.add('closed', '127.0.0.1', closed_port, callback=callback)
+    wait(100, lambda: len(results) == 12)
+
+    for i in range(10):
+        assert results[i][0]['svc']['instances']['inst']['state'] is not None
+    assert results['creds'][0] is None
+    assert results['closed'][0] is None
+
+    # unchanged service info is not reported again
+    time.sleep(0.5)
+    assert len(results[0]) == 1
+
+    # hosts are not polled anymore after removing them
+    poller.remove('closed')
+    time.sleep(0.1)
+    del results['closed']
+    time.sleep(0.5)
+    assert 'closed' not in results
@@ -26,6 +26,9 @@
 import logging
 import socket
 import sys
+import threading
+import time
+import types
 from unittest.mock import patch
 
 import pytest
@@ -33,13 +36,18 @@ import pytest
 from marche.config import Config
 from marche.handler import JobHandler
 from marche.jobs import Busy, Denied, Fault
-from marche.jobs.base import DEAD, RUNNING
+from marche.jobs.base import DEAD, RUNNING, STARTING
+from marche.journal import get_reader
+from marche.metrics import COMMAND_ERRORS, COMMAND_SECONDS
 from marche.permission import ADMIN, CONTROL, DISPLAY, ClientInfo
+from marche.polling import systemd_collector
 from marche.protocol import (
     ConffileResponse,
     ControlOutputResponse,
     ErrorResponse,
+    Errors,
     LogfileResponse,
+    LogUpdateResponse,
     ServiceListResponse,
     StatusResponse,
 )
@@ -51,6 +59,50 @@ from test.utils import LogHandler, MockIface, MockJob, wait
 sys.modules['marche.jobs.test'] = sys.modules[__name__]
 Job = MockJob
 
+
+class SlowJob(MockJob):
+    def check(self):
+        time.sleep(0.2)
+        return True
+
+    def get_services(self):
+        return [(self.name, '')]
+
+
+sys.modules['marche.jobs.testslow'] = types.ModuleType('marche.jobs.testslow')
+sys.modules['marche.jobs.testslow'].Job = SlowJob
+
+
+class DelayedStartJob(MockJob):
+    """A job whose service takes a while to run after being started."""
+
+    started = []
+
+    def init(self):
+        MockJob.init(self)
+        self.state = DEAD
+
+    def get_services(self):
+        return [(self.name, '')]
+
+    def service_status(self, _service, _instance):
+        return self.state, ''
+
+    def start_service(self, service, instance):
+        self.started.append((self.name, time.monotonic()))
+        self.state = STARTING
+        threading.Timer(self.config.get('delay', 0.2), self._started,
+                        (service, instance)).start()
+
+    def _started(self, service, instance):
+        self.state = DEAD if self.config.get('dies') else RUNNING
+        self.poller.update({(service, instance): (self.state, '')})
+
+
+sys.modules['marche.jobs.testdelayed'] = \
+    types.ModuleType('marche.jobs.testdelayed')
+sys.modules['marche.jobs.testdelayed'].Job = DelayedStartJob
+
 logger = logging.getLogger('testhandler')
 testhandler = LogHandler()
 logger.addHandler(testhandler)
@@ -84,6 +136,19 @@ def test_exceptions():
     testhandler.assert_error(JobHandler, config, logger)
 
 
+def test_parallel_init():
+    config = Config()
+    names = [f'job{i}' for i in range(8, 0, -1)]
+    config.job_config = {name: {'type': 'testslow'} for name in names}
+    config.general_config = {'init_workers': 8}
+    started = time.monotonic()
+    handler = JobHandler(config, logger)
+    # 1.6 seconds if done one after another
+    assert time.monotonic() - started < 1.0
+    assert list(handler.jobs) == names
+    assert set(handler.service2job) == set(names)
+
+
 def test_event(handler):
     ev = ErrorResponse('svc', 'inst', 42, 'string')
     handler.emit_event(ev)
@@ -100,9 +165,50 @@ def test_joblist(handler):
 
 
 def test_reload(handler):
+    reader = get_reader('journalctl', logger)
     handler.trigger_reload()
     # Now that we did config.reload(), the injected config is gone
     assert not handler.jobs
+    # journal followers are stopped, new ones are started when needed
+    assert get_reader('journalctl', logger) is not reader
+
+
+def test_shutdown(handler, monkeypatch):
+    job = handler.jobs['mytest']
+    monkeypatch.setattr(job, 'shutdown',
+                        lambda: job.test_stopped.append('job'))
+    stopped = []
+    monkeypatch.setattr(systemd_collector, 'stop', lambda: stopped.append(1))
+    handler.shutdown()
+    assert job.test_stopped == ['job']
+    # the shared systemd poller is stopped as well
+    assert stopped == [1]
+
+
+def test_incremental_reload(tmp_path):
+    conffile = tmp_path / 'job.conf'
+    conffile.write_text('[job.job1]\ntype = "testslow"\n'
+                        '[job.job2]\ntype = "testslow"\n')
+    handler = JobHandler(Config(tmp_path), logger)
+    job1, job2 = handler.jobs['job1'], handler.jobs['job2']
+    job2.shutdown = lambda: job2.test_stopped.append('job')
+
+    conffile.write_text('[job.job1]\ntype = "testslow"\n'
+                        '[job.job2]\ntype = "testslow"\nfoo = 1\n'
+                        '[job.job3]\ntype = "testslow"\n')
+    handler.trigger_reload()
+    assert list(handler.jobs) == ['job1', 'job2', 'job3']
+    # unchanged jobs are kept, changed ones are recreated
+    assert handler.jobs['job1'] is job1
+    assert handler.jobs['job2'] is not job2
+    assert job2.test_stopped == ['job']
+    assert handler.service2job['job3'] is handler.jobs['job3']
+
+    conffile.write_text('[job.job1]\ntype = "testslow"\n')
+    handler.trigger_reload()
+    assert list(handler.jobs) == ['job1']
+    assert handler.jobs['job1'] is job1
+    assert set(handler.service2job) == {'job1'}
 
 
 def test_service_list(handler):
@@ -136,6 +242,59 @@ def test_service_list(handler):
     assert ev.services == {}
 
 
+def test_service_list_generation(handler):
+    client = ClientInfo(CONTROL)
+    job = handler.jobs['mytest']
+    ev = handler.request_service_list(client)
+    generation = ev.generation
+    assert generation.startswith(handler.uid)
+
+    # nothing changed: empty reply with the same generation
+    ev = handler.request_service_list(client, generation)
+    assert ev.services is None
+    assert ev.generation == generation
+    # the same polled status doesn't change anything either
+    job.poller.update({('svc3', 'inst2'): (RUNNING, 'ext:inst2')})
+    assert handler.request_service_list(client, generation).services is None
+
+    # polled status changes are applied to a new snapshot
+    old = handler.request_service_list(client).services
+    job.poller.update({('svc3', 'inst2'): (DEAD, 'crashed')})
+    ev = handler.request_service_list(client, generation)
+    assert ev.generation != generation
+    assert ev.services['svc3']['instances']['inst2'] == {
+        'desc': 'desc:inst2', 'state': DEAD, 'ext_status': 'crashed'}
+    assert old['svc3']['instances']['inst2']['state'] == RUNNING
+
+    # snapshots are rebuilt after a while, but get a new generation only
+    # if something changed
+    generation = ev.generation
+    handler._snapshot_time = 0
+    job.poller.invalidate('svc3', 'inst2')
+    ev = handler.request_service_list(client, generation)
+    assert ev.generation != generation
+    assert ev.services['svc3']['instances']['inst2']['state'] == RUNNING
+    handler._snapshot_time = 0
+    assert handler.request_service_list(client, ev.generation).services is None
+
+
+def test_service_list_unpolled(tmp_path):
+    conffile = tmp_path / 'job.conf'
+    conffile.write_text('[job.first]\ntype = "testdelayed"\n'
+                        'pollinterval = 0\n')
+    handler = JobHandler(Config(tmp_path), logger)
+    job = handler.jobs['first']
+    client = ClientInfo(ADMIN)
+    ev = handler.request_service_list(client)
+    assert ev.services['first']['instances']['']['state'] == DEAD
+
+    # without a poller, the state is not taken from the snapshot
+    job.state = RUNNING
+    new_ev = handler.request_service_list(client, ev.generation)
+    assert new_ev.generation != ev.generation
+    assert new_ev.services['first']['instances']['']['state'] == RUNNING
+
+
 def test_requests(handler):
     client = ClientInfo(CONTROL)
 
@@ -157,6 +316,12 @@ def test_requests(handler):
     assert isinstance(ev, LogfileResponse)
     assert ev.files == {'log:inst1': 'svc2'}
 
+    ev = handler.request_logfiles_since(client, 'svc2', 'inst1',
+                                        {'log:inst1': '41'})
+    assert isinstance(ev, LogUpdateResponse)
+    assert ev.files == {'log:inst1': 'svc2'}
+    assert ev.cursors == {'log:inst1': '42'}
+
     client = ClientInfo(ADMIN)
     ev = handler.request_conffiles(client, 'svc2', 'inst1')
     assert isinstance(ev, ConffileResponse)
@@ -177,17 +342,134 @@ def test_commands(handler):
     assert ('svc3', '') in job.test_restarted
 
     numerrors = len(testhandler.errors)
+    numbusy = COMMAND_ERRORS.get(command='start_service', error='busy') or 0
     pytest.raises(Busy, handler.start_service, client, 'svc1', '')
     pytest.raises(Denied, handler.start_service, ClientInfo(DISPLAY),
                   'svc2', 'inst1')
     pytest.raises(Fault, handler.start_service, client, 'svc2', 'inst1')
     pytest.raises(ValueError, handler.restart_service, client, 'svc1', '')
     assert len(testhandler.errors) == numerrors + 4
+    assert COMMAND_ERRORS.get(command='start_service', error='busy') == \
+        numbusy + 1
+    assert COMMAND_SECONDS.get(command='start_service')[0] >= 4
 
     handler.send_conffile(ClientInfo(ADMIN), 'svc1', '', 'file', 'contents')
     assert job.test_configs['file'] == 'contents'
 
 
+def test_bulk_control(handler):
+    job = handler.jobs['mytest']
+    client = ClientInfo(CONTROL)
+
+    results = handler.control_services(client, 'start',
+                                       ['svc*', 'nope']).results
+    assert [result[:3] for result in results] == [
+        ('svc1', '', Errors.BUSY),
+        ('svc2', 'inst1', Errors.FAULT),
+        ('svc3', '', 0),
+        ('svc3', 'inst2', 0),
+        ('nope', '', Errors.FAULT),
+    ]
+    assert job.test_started == [('svc3', ''), ('svc3', 'inst2')]
+
+    # a service name without instance matches all instances
+    results = handler.control_services(client, 'stop', ['svc3']).results
+    assert [result[:2] for result in results] == [('svc3', ''),
+                                                  ('svc3', 'inst2')]
+    results = handler.control_services(client, 'restart',
+                                       ['svc3.*', 'svc1']).results
+    assert [result[:3] for result in results] == [
+        ('svc1', '', Errors.EXCEPTION), ('svc3', 'inst2', 0)]
+
+    # services the client cannot see are not matched
+    results = handler.control_services(ClientInfo(DISPLAY), 'start',
+                                       ['svc3']).results
+    assert results == [('svc3', '', Errors.FAULT, 'no such service: svc3')]
+
+    pytest.raises(Fault, handler.control_services, client, 'kill', ['svc3'])
+
+
+def test_start_order():
+    config = Config()
+    config.job_config = {
+        'db': {'type': 'testdelayed'},
+        'server1': {'type': 'testdelayed', 'after': ['db']},
+        'server2': {'type': 'testdelayed', 'after': ['db']},
+        'gui': {'type': 'testdelayed', 'after': ['server1', 'unknown']},
+        'other': {'type': 'testdelayed'},
+        'broken': {'type': 'testdelayed', 'dies': True},
+        'client': {'type': 'testdelayed', 'after': ['broken']},
+    }
+    handler = JobHandler(config, logger)
+    del DelayedStartJob.started[:]
+    started = time.monotonic()
+    results = handler.control_services(ClientInfo(ADMIN), 'start',
+                                       ['*']).results
+    # db, then server1 and server2, then gui start as soon as the jobs they
+    # depend on run; gui itself is not waited for
+    assert 0.4 <= time.monotonic() - started < 1.2
+    assert results[:5] == [(name, '', 0, '') for name in
+                           ('db', 'server1', 'server2', 'gui', 'other')]
+    assert results[5] == ('broken', '', 0, '')
+    assert results[6] == ('client', '', Errors.FAULT,
+                          'not started, job broken did not start')
+
+    times = dict(DelayedStartJob.started)
+    assert 'client' not in times
+    # independent jobs start together
+    assert abs(times['db'] - times['other']) < 0.1
+    assert abs(times['server1'] - times['server2']) < 0.1
+    assert times['server1'] - times['db'] >= 0.2
+    assert times['gui'] - times['server1'] >= 0.2
+
+    # only the jobs started by the same command are waited for
+    del DelayedStartJob.started[:]
+    results = handler.control_services(ClientInfo(ADMIN), 'start',
+                                       ['gui']).results
+    assert results == [('gui', '', 0, '')]
+    handler.shutdown()
+
+
+def test_start_order_chains():
+    config = Config()
+    config.job_config = {
+        'slow': {'type': 'testdelayed', 'delay': 1.0},
+        'fast': {'type': 'testdelayed'},
+        'after_slow': {'type': 'testdelayed', 'after': ['slow']},
+        'after_fast': {'type': 'testdelayed', 'after': ['fast']},
+        'last': {'type': 'testdelayed', 'after': ['after_fast']},
+    }
+    handler = JobHandler(config, logger)
+    del DelayedStartJob.started[:]
+    results = handler.control_services(ClientInfo(ADMIN), 'start',
+                                       ['*']).results
+    assert [result[2] for result in results] == [0] * 5
+
+    times = dict(DelayedStartJob.started)
+    # a job only waits for its own dependencies, not for unrelated slow jobs
+    assert 0.2 <= times['after_fast'] - times['fast'] < 0.5
+    assert 0.2 <= times['last'] - times['after_fast'] < 0.5
+    assert times['last'] < times['after_slow']
+    assert times['after_slow'] - times['slow'] >= 1.0
+    handler.shutdown()
+
+
+def test_start_order_circular():
+    config = Config()
+    config.job_config = {
+        'first': {'type': 'testdelayed', 'after': ['second']},
+        'second': {'type': 'testdelayed', 'after': ['first']},
+    }
+    handler = JobHandler(config, logger)
+    warnings = len(testhandler.warnings)
+    results = handler.control_services(ClientInfo(ADMIN), 'start',
+                                       ['*']).results
+    # circular dependencies are ignored
+    assert results == [('first', '', 0, ''), ('second', '', 0, '')]
+    assert len(testhandler.warnings) > warnings
+    handler.shutdown()
+
+
 def test_filtering(handler):
     event = handler.request_service_list(ClientInfo(ADMIN))
     new_event = handler.filter_services(ClientInfo(ADMIN), event)
@@ -217,6 +499,9 @@ class MockSocket:
     def sendto(self, msg, _addr):
         assert msg == b'PING'
 
+    def close(self):
+        pass
+
     def recvfrom(self, _bufsize):
         self.i += 1
         if self.i == 1:
@@ -0,0 +1,178 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for the web interface."""
+
+import asyncio
+import json
+import logging
+import socket
+import threading
+
+import pytest
+import requests
+
+from marche.config import Config
+from marche.handler import JobHandler
+from marche.iface.web import Interface
+from marche.jobs import RUNNING
+from marche.protocol import StatusResponse
+from test.utils import LogHandler, MockAuthHandler, MockJobHandler, wait
+
+jobhandler = MockJobHandler()
+authhandler = MockAuthHandler()
+logger = logging.getLogger('testweb')
+logger.addHandler(LogHandler())
+
+
+def start_web(jobhandler):
+    """Start a web interface, return it and its URL."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    config = Config()
+    config.iface_config['web'] = {'addr': f'127.0.0.1:{port}',
+                                 'workers': 2, 'timeout': 0.5}
+    # the interface runs its loop in its own thread
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    iface = Interface(config, jobhandler, authhandler, logger)
+    iface.run()
+    url = f'http://127.0.0.1:{port}'
+
+    def connectable():
+        try:
+            requests.get(url + '/get_hostname', timeout=1)
+        except requests.ConnectionError:
+            return False
+        return True
+    wait(100, connectable)
+    return iface, url
+
+
+def stop_web(iface):
+    iface._loop.call_soon_threadsafe(iface.shutdown)  # noqa: SLF001
+
+
+@pytest.fixture(scope='module')
+def web_iface():
+    """Create a Marche web interface."""
+    iface, url = start_web(jobhandler)
+    jobhandler.test_interface = iface
+    yield iface, url
+    jobhandler.test_interface = None
+    stop_web(iface)
+
+
+def read_event(lines):
+    event = {}
+    for line in lines:
+        if not line:
+            return event
+        if line.startswith(':'):
+            continue
+        key, _, value = line.partition(': ')
+        event[key] = value
+    return event
+
+
+def test_get_status(web_iface):
+    _, url = web_iface
+    resp = requests.get(url + '/get_status', timeout=5)
+    assert resp.json() == {'svc': 'DEAD', 'svc_inst': 'DEAD'}
+
+
+def test_events(web_iface):
+    _, url = web_iface
+    with requests.get(url + '/events', stream=True, timeout=5) as resp:
+        assert resp.headers['Content-Type'] == 'text/event-stream'
+        lines = resp.iter_lines(decode_unicode=True)
+        # the full status first
+        event = read_event(lines)
+        assert json.loads(event['data']) == {'svc': 'DEAD', 'svc_inst': 'DEAD'}
+        seq = int(event['id'])
+
+        # then only the changes
+        jobhandler.emit_event(StatusResponse('svc', 'inst', RUNNING, ''))
+        event = read_event(lines)
+        assert json.loads(event['data']) == {'svc_inst': 'RUNNING'}
+        assert int(event['id']) == seq + 1
+
+    # resuming from a known id only sends changes since then
+    jobhandler.emit_event(StatusResponse('svc', '', RUNNING, ''))
+    with requests.get(url + '/events', stream=True, timeout=5,
+                      headers={'Last-Event-ID': str(seq + 1)}) as resp:
+        event = read_event(resp.iter_lines(decode_unicode=True))
+        assert json.loads(event['data']) == {'svc': 'RUNNING'}
+        assert int(event['id']) == seq + 2
+
+
+def test_events_after_reload(tmp_path):
+    conffile = tmp_path / 'job.conf'
+    conffile.write_text('[job.first]\ntype = "testnamed"\n'
+                        '[job.second]\ntype = "testnamed"\n')
+    handler = JobHandler(Config(tmp_path), logger)
+    iface, url = start_web(handler)
+    handler.add_interface(iface)
+    try:
+        seq = iface.events.wait(-1, 0)[0]
+        handler.emit_event(StatusResponse('second', '', RUNNING, ''))
+        conffile.write_text('[job.first]\ntype = "testnamed"\n')
+        handler.trigger_reload()
+        handler.emit_event(StatusResponse('first', '', RUNNING, ''))
+
+        # the event of the removed service is skipped
+        with requests.get(url + '/events', stream=True, timeout=5,
+                          headers={'Last-Event-ID': str(seq)}) as resp:
+            event = read_event(resp.iter_lines(decode_unicode=True))
+            assert json.loads(event['data']) == {'first': 'RUNNING'}
+            assert int(event['id']) == seq + 2
+    finally:
+        stop_web(iface)
+        handler.shutdown()
+
+
+def test_saturation(web_iface, monkeypatch):
+    _, url = web_iface
+    release = threading.Event()
+    monkeypatch.setattr(jobhandler, 'start_service',
+                        lambda *_args: release.wait(5))
+    try:
+        # calls that take too long are answered with 503
+        resp = requests.post(url + '/control', data={'start': 'svc'},
+                             timeout=5)
+        assert resp.status_code == 503
+        # they still occupy a worker, so that this one is the last
+        resp = requests.post(url + '/control', data={'start': 'svc'},
+                             timeout=5)
+        assert resp.status_code == 503
+        resp = requests.get(url + '/get_status', timeout=5)
+        assert resp.status_code == 503
+        # while the loop stays responsive
+        resp = requests.get(url + '/get_hostname', timeout=5)
+        assert resp.status_code == 200
+    finally:
+        release.set()
+
+    def available():
+        return requests.get(url + '/get_status', timeout=5).status_code == 200
+    wait(100, available)
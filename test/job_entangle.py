@@ -124,3 +124,8 @@ def _test_job_cls(jobcls, tempconf, prefix=''):
     pytest.raises(Fault, job.send_config, 'entangle', 'mysrv', 'other.res', '')
     job.send_config('entangle', 'mysrv', 'mysrv.res', RES + 'foo\n')
     assert (tmpdir / 'mysrv.res').read_text() == RES + 'foo\n'
+
+    assert not job.needs_reinit()
+    (tmpdir / 'other.res').write_text(RES)
+    assert job.needs_reinit()
+    job.shutdown()
@@ -25,10 +25,13 @@
 
 import logging
 import sys
+import types
 
 import pytest
 
-from marche.jobs import DEAD, RUNNING, WARNING, Fault
+from marche.config import Config
+from marche.handler import JobHandler
+from marche.jobs import DEAD, RUNNING, WARNING, Fault, nicos
 from marche.jobs.nicos import Job
 from test.utils import job_call_check
 
@@ -38,6 +41,7 @@ logger = logging.getLogger('testnicos')
 
 SCRIPT = '''\
 import sys
+import types
 if len(sys.argv) == 1:
     sys.stderr.write('Usage: nicos-system [action] [service]\\n')
     sys.stderr.write('Possible services are cache\\n')
@@ -102,6 +106,12 @@ def test_job(tmp_path):
     assert job.service_logs('nicos', '') == {}
     logs = job.service_logs('nicos', 'cache')
     assert list(logs.values()) == ['log1\nlog2\n']
+    files, cursors = job.service_logs_since('nicos', 'cache', {})
+    assert list(files.values()) == ['log1\nlog2\n']
+    with (tmp_path / 'log' / 'cache' / 'current').open('a') as fp:
+        fp.write('log3\n')
+    files, cursors = job.service_logs_since('nicos', 'cache', cursors)
+    assert list(files.values()) == ['log3\n']
 
     assert job.receive_config('nicos', 'cache') == {}
     pytest.raises(Fault, job.send_config, 'nicos', 'cache', 'file', 'contents')
@@ -127,3 +137,53 @@ def test_job(tmp_path):
         ('nicos', ''): (RUNNING, ''),
         ('nicos', 'cache'): (RUNNING, ''),
     }
+
+
+def test_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(nicos, 'determine_init_system', lambda: 'sysv')
+    script = tmp_path / 'etc' / 'nicos-system'
+    script.parent.mkdir()
+    script.write_text(f'#!{sys.executable} -S\n' + SCRIPT)
+    script.chmod(0o755)
+    (tmp_path / 'conf').mkdir()
+    (tmp_path / 'conf' / 'job.conf').write_text(
+        f'[job.nicos]\ntype = "nicos"\nroot = "{tmp_path}"\n')
+    handler = JobHandler(Config(tmp_path / 'conf'), logger)
+    try:
+        job = handler.jobs['nicos']
+        assert job.get_services() == [('nicos', ''), ('nicos', 'cache')]
+        handler.trigger_reload()
+        assert handler.jobs['nicos'] is job
+
+        # a new service is picked up although the config is unchanged
+        script.write_text(f'#!{sys.executable} -S\n' +
+                          SCRIPT.replace('are cache', 'are cache,poller'))
+        handler.trigger_reload()
+        assert handler.jobs['nicos'] is not job
+        assert handler.jobs['nicos'].get_services() == [
+            ('nicos', ''), ('nicos', 'cache'), ('nicos', 'poller')]
+    finally:
+        handler.shutdown()
+
+
+def test_systemd_reinit(tmp_path):
+    units = ['nicos-cache.service loaded active running NICOS cache',
+             'nicos-late-generator.service loaded active exited NICOS']
+    job = nicos.SystemdJob('nicos', 'name', {'root': str(tmp_path)},
+                           logger, lambda _event: None)
+    calls = []
+
+    def sync_call(cmd):
+        calls.append(cmd)
+        return types.SimpleNamespace(stdout=list(units))
+    job._sync_call = sync_call
+    job.init()
+    assert job.get_services() == [('nicos', ''), ('nicos', 'cache')]
+    # the units to poll are known without asking systemctl again
+    ncalls = len(calls)
+    assert job.systemd_units() == [('systemctl', 'nicos-cache')]
+    assert len(calls) == ncalls
+    assert not job.needs_reinit()
+    units.append('● nicos-poller.service not-found inactive dead nicos-poller')
+    assert job.needs_reinit()
+    job.shutdown()
@@ -0,0 +1,107 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for the remote daemon job."""
+
+import logging
+import socket
+
+import pytest
+
+from marche.config import Config
+from marche.iface.rpc import Interface
+from marche.jobs import DEAD, NOT_AVAILABLE, RUNNING, Busy, Denied, Fault
+from marche.jobs.remote import Job
+from marche.protocol import StatusResponse
+from test.utils import LogHandler, MockAuthHandler, MockJobHandler, wait
+
+logger = logging.getLogger('testremote')
+logger.addHandler(LogHandler())
+
+
+@pytest.fixture
+def upstream():
+    config = Config()
+    config.iface_config['rpc'] = {'addr': '127.0.0.1:0'}
+    iface = Interface(config, MockJobHandler(), MockAuthHandler(), logger)
+    iface.run()
+    yield iface
+    iface.shutdown()
+
+
+def make_job(port, events, **config):
+    config = dict({'host': f'127.0.0.1:{port}', 'user': 'test',
+                   'passwd': 'test', 'pollinterval': 0.2}, **config)
+    job = Job('remote', 'instr', config, logger, events.append)
+    job.WAIT_TIMEOUT = 0.2
+    assert job.check()
+    job.init()
+    return job
+
+
+def test_job(upstream):
+    events = []
+    job = make_job(upstream.server.server_address[1], events)
+    try:
+        assert job.get_services() == [('instr:svc', ''), ('instr:svc', 'inst')]
+        assert not job.needs_reinit()
+        assert job.service_status('instr:svc', 'inst') == (DEAD, '')
+        assert job.service_description('instr:svc', 'inst') == ''
+
+        # status changes are passed on as they happen
+        upstream.emit_event(StatusResponse('svc', 'inst', RUNNING, ''))
+        wait(100, lambda: any(event.state == RUNNING for event in events))
+        assert events[-1].service == 'instr:svc'
+        assert job.service_status('instr:svc', 'inst') == (RUNNING, '')
+
+        # commands are forwarded, and errors translated
+        job.start_service('instr:svc', 'inst')
+        pytest.raises(Busy, job.stop_service, 'instr:svc', 'inst')
+        pytest.raises(Denied, job.stop_service, 'instr:svc', '')
+        pytest.raises(Fault, job.restart_service, 'instr:svc', 'inst')
+        assert job.service_output('instr:svc', 'inst') == ['line1', 'line2']
+        # file names can contain colons
+        assert job.service_logs('instr:svc', 'inst') == {
+            'file1': 'line1\nline2\n', 'file2': 'line3\nline4\n',
+            'dir:1/file3': 'line:5\n'}
+        assert job.service_logs_since('instr:svc', 'inst', {}) == (
+            {'file1': 'line1\nline2\n'}, {'file1': '1:12'})
+        assert job.receive_config('instr:svc', 'inst') == {
+            'file1': 'line1\nline2\n', 'file2': 'line3\nline4\n'}
+    finally:
+        job.shutdown()
+
+
+def test_unreachable():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    job = make_job(port, [])
+    try:
+        assert job.get_services() == []
+        assert not job.needs_reinit()
+        assert job.service_status('instr:svc', '') == \
+            (NOT_AVAILABLE, 'remote daemon unreachable')
+        pytest.raises(Fault, job.start_service, 'instr:svc', '')
+    finally:
+        job.shutdown()
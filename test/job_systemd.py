@@ -28,9 +28,10 @@ import sys
 
 import pytest
 
-from marche.jobs import RUNNING, Fault
+from marche.jobs import DEAD, RUNNING, Fault
 from marche.jobs.systemd import Job
-from test.utils import job_call_check
+from marche.polling import systemd_collector
+from test.utils import job_call_check, wait
 
 # ruff: noqa: SLF001
 
@@ -44,20 +45,33 @@ elif sys.argv[1] == 'systemctl' and sys.argv[2] == 'is-enabled':
     if sys.argv[3] != 'foo':
         sys.stderr.write('Not found\\n')
 elif sys.argv[1] == 'systemctl' and sys.argv[2] == 'show':
-    print('SubState=running')
+    args = iter(sys.argv[3:])
+    props = []
+    for arg in args:
+        if arg == '-p':
+            props.append(next(args))
+            continue
+        if 'Id' in props:
+            print(f'Id={arg}.service')
+        print('SubState=running' if arg == 'foo' else 'SubState=dead')
+        print()
 else:
     print(sys.argv[3])
     print(sys.argv[2])
 '''
 
 
-def test_job(tmp_path):
+def setup_script(tmp_path):
     scriptfile = tmp_path / 'script.py'
     scriptfile.write_text(SCRIPT)
 
     Job.SYSTEMCTL = f'{sys.executable} -S {scriptfile} systemctl'
     Job._JOURNALCTL = f'{sys.executable} -S {scriptfile} journalctl'
 
+
+def test_job(tmp_path):
+    setup_script(tmp_path)
+
     job = Job('systemd', 'name', {'unit': 'nope'}, logger, lambda _event: None)
     assert not job.check()
 
@@ -71,6 +85,8 @@ def test_job(tmp_path):
     job_call_check(job, 'foo', '', 'action foo', ['foo', 'action'])
 
     assert job.service_logs('foo', '') == {'journal': 'logline1\nlogline2\n'}
+    assert job.service_logs_since('foo', '', {}) == \
+        ({'journal': 'logline1\nlogline2\n'}, {'journal': ''})
 
     (tmp_path / '1.log').write_text('log1_line1\nlog1_line2\n')
     (tmp_path / '1.cfg').write_text('conf1\n')
@@ -107,3 +123,31 @@ def test_job(tmp_path):
 
     pytest.raises(RuntimeError, Job,
                   'systemd', 'name', config, logger, lambda _event: None)
+
+
+def test_collector(tmp_path):
+    setup_script(tmp_path)
+
+    assert systemd_collector._query(Job('systemd', 'name', {'unit': 'foo'},
+                                        logger, lambda _event: None),
+                                    Job.SYSTEMCTL, ['bar', 'foo']) == \
+        {'bar': 'dead', 'foo': 'running'}
+
+    events = []
+    jobs = [Job('systemd', name, {'unit': name}, logger, events.append)
+            for name in ('foo', 'bar')]
+    for job in jobs:
+        job.init()
+        # no separate poller thread is started
+        assert job.poller.collector is systemd_collector
+        assert job.poller._thread is None
+
+    wait(500, lambda: len(events) == 2)
+    assert {(ev.service, ev.state, ev.ext_status) for ev in events} == \
+        {('foo', RUNNING, ''), ('bar', DEAD, 'dead')}
+    assert jobs[0].polled_service_status('foo', '') == (RUNNING, '')
+    assert jobs[1].polled_service_status('bar', '') == (DEAD, 'dead')
+
+    for job in jobs:
+        job.shutdown()
+        assert job.poller not in systemd_collector._pollers
@@ -0,0 +1,159 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for the journal reader."""
+
+import json
+import logging
+import sys
+
+import pytest
+
+from marche.journal import JournalReader
+from test.utils import wait
+
+# ruff: noqa: SLF001
+
+logger = logging.getLogger('testjournal')
+
+# A journalctl stand-in that serves the entries from a file; with -f it
+# follows the file like the real one follows the journal.
+SCRIPT = '''\
+import sys, time
+entries = sys.argv[1]
+args = sys.argv[2:]
+units = [args[i + 1] for (i, arg) in enumerate(args) if arg == '-u']
+units = [unit if '.' in unit else unit + '.service' for unit in units]
+with open(entries) as fp:
+    if '-f' in args:
+        after = [arg.split('=', 1)[1] for arg in args
+                 if arg.startswith('--after-cursor=')]
+        if after:
+            for line in fp:
+                if f'"{after[0]}"' in line:
+                    break
+        else:
+            fp.seek(0, 2)
+        with open(entries + '.following', 'w') as marker:
+            marker.write(' '.join(args))
+        while True:
+            line = fp.readline()
+            if not line:
+                time.sleep(0.02)
+            elif any(unit in line for unit in units):
+                print(line, end='', flush=True)
+    lines = [line for line in fp if units[0] in line]
+    n = int(args[args.index('-n') + 1])
+    print(''.join(lines[-n:]), end='')
+'''
+
+
+def entry(num, unit, msg):
+    return json.dumps({'__CURSOR': f'c{num}', '__REALTIME_TIMESTAMP': '0',
+                       '_PID': '1', 'PRIORITY': '6', '_SYSTEMD_UNIT': unit,
+                       'MESSAGE': msg}) + '\n'
+
+
+@pytest.fixture
+def journal(tmp_path):
+    script = tmp_path / 'journalctl.py'
+    script.write_text(SCRIPT)
+    entries = tmp_path / 'entries'
+    entries.write_text(entry(1, 'foo.service', 'foo1') +
+                       entry(2, 'bar.service', 'bar1'))
+    reader = JournalReader(f'{sys.executable} -S {script} {entries}', logger)
+
+    def add(*lines):
+        with entries.open('a') as fp:
+            fp.write(''.join(lines))
+
+    def following():
+        marker = tmp_path / 'entries.following'
+        wait(100, marker.is_file)
+        wait(100, marker.read_text)
+        args = marker.read_text()
+        marker.unlink()
+        return args
+    reader.following = following
+    yield reader, add
+    reader.stop()
+
+
+def messages(text):
+    return [line.split(': ', 1)[1] for line in text.splitlines()]
+
+
+def test_reader(journal):
+    reader, add = journal
+    text, cursor = reader.logs('foo')
+    assert messages(text) == ['foo1']
+    assert cursor == 'c1'
+    assert 'foo.service' in reader._buffers
+    # only the requested units are followed
+    assert reader.following().endswith(' -u foo')
+
+    add(entry(3, 'foo.service', 'foo2'), entry(4, 'bar.service', 'bar2'))
+    wait(100, lambda: len(reader._buffers['foo.service']) == 2)
+    text, cursor = reader.logs('foo')
+    assert messages(text) == ['foo1', 'foo2']
+    assert cursor == 'c3'
+
+    # incremental read
+    assert reader.logs('foo', 'c3') == ('', 'c3')
+    add(entry(5, 'foo.service', 'foo3'))
+    wait(100, lambda: len(reader._buffers['foo.service']) == 3)
+    text, cursor = reader.logs('foo', 'c3')
+    assert messages(text) == ['foo3']
+    assert cursor == 'c5'
+    # unknown cursor: everything
+    assert messages(reader.logs('foo', 'c0')[0]) == ['foo1', 'foo2', 'foo3']
+
+    # a unit requested later is read and followed as well, by a new
+    # follower that continues after the last seen entry
+    text, cursor = reader.logs('bar.service')
+    assert messages(text) == ['bar1', 'bar2']
+    args = reader.following()
+    assert '--after-cursor=c5' in args
+    assert args.endswith(' -u foo -u bar.service')
+    add(entry(6, 'bar.service', 'bar3'), entry(7, 'foo.service', 'foo4'))
+    wait(100, lambda: len(reader._buffers['bar.service']) == 3)
+    wait(100, lambda: len(reader._buffers['foo.service']) == 4)
+    assert messages(reader.logs('foo', 'c5')[0]) == ['foo4']
+
+    # if the follower exits, entries are read directly again
+    reader._proc.kill()
+    wait(100, lambda: not reader._buffers)
+    reader.RESTART_INTERVAL = 60
+    text, cursor = reader.logs('foo')
+    assert messages(text) == ['foo1', 'foo2', 'foo3', 'foo4']
+    assert not reader._buffers
+
+
+def test_ring_buffer(journal):
+    reader, add = journal
+    reader.ENTRIES = 3
+    assert messages(reader.logs('foo')[0]) == ['foo1']
+    reader.following()
+    add(*(entry(10 + i, 'foo.service', f'new{i}') for i in range(5)))
+    wait(100, lambda: reader._buffers['foo.service'][-1][0] == 'c14')
+    assert messages(reader.logs('foo')[0]) == ['new2', 'new3', 'new4']
@@ -26,10 +26,13 @@
 import logging
 import socket
 import sys
+import threading
+import time
+import types
 
-from marche import utils
+from marche import metrics, scan, utils
 from marche.protocol import Response
-from test.utils import LogHandler
+from test.utils import LogHandler, wait
 
 logger = logging.getLogger('testother')
 testhandler = LogHandler()
@@ -65,11 +68,200 @@ def test_utils(tmp_path):
         else:
             raise AssertionError('unexpected key')
 
+    # complete chain, but limited number of rotated logs
+    (tmp_path / 'logfile.2').write_text('c\n')
+    assert len(utils.extract_loglines(tmp_path / 'logfile', 2)) == 4
+    assert len(utils.extract_loglines(tmp_path / 'logfile', 2, 2)) == 3
+    assert len(utils.extract_loglines(tmp_path / 'logfile', 2, 1)) == 2
+    assert len(utils.extract_loglines(tmp_path / 'logfile', 2, 0)) == 1
+
     fqdn = socket.getfqdn('localhost')
     assert utils.normalize_addr('localhost', 147) == (fqdn, '147')
     assert utils.normalize_addr('localhost:32', 147) == (fqdn, '32')
 
 
+def test_tail_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'TAIL_BLOCKSIZE', 7)
+    fpath = tmp_path / 'file'
+    fpath.write_bytes(b'')
+    assert utils.tail_file(fpath, 5, 1000) == b''
+    fpath.write_bytes(b'\n\n')
+    assert utils.tail_file(fpath, 1, 1000) == b'\n'
+    assert utils.tail_file(fpath, 5, 1000) == b'\n\n'
+    fpath.write_bytes(b''.join(b'line %d\n' % i for i in range(100)))
+    assert utils.tail_file(fpath, 1, 1000) == b'line 99\n'
+    assert utils.tail_file(fpath, 3, 1000) == b'line 97\nline 98\nline 99\n'
+    assert utils.tail_file(fpath, 200, 10000) == fpath.read_bytes()
+    # unterminated last line
+    fpath.write_bytes(b'a\nb\nc')
+    assert utils.tail_file(fpath, 2, 1000) == b'b\nc'
+    # very long lines are limited to the given size
+    fpath.write_bytes(b'x' * 100000 + b'\n' + b'y' * 100000)
+    assert utils.tail_file(fpath, 2, 1000) == b'y' * 1000
+
+
+def test_follow_logfile(tmp_path):
+    fpath = tmp_path / 'logfile'
+    assert utils.follow_logfile(fpath) is None
+    fpath.write_text(''.join(f'a{i}\n' for i in range(10)))
+    content, cursor = utils.follow_logfile(fpath, None, 2)
+    assert content == 'a8\na9\n'
+    assert cursor == f'{fpath.stat().st_ino}:30'
+    assert utils.follow_logfile(fpath, cursor, 2) == ('', cursor)
+
+    # only complete lines are returned
+    with fpath.open('a') as fp:
+        fp.write('b1\nb2')
+    content, cursor = utils.follow_logfile(fpath, cursor, 2)
+    assert content == 'b1\n'
+    with fpath.open('a') as fp:
+        fp.write('\nb3\n')
+    content, cursor = utils.follow_logfile(fpath, cursor, 2)
+    assert content == 'b2\nb3\n'
+
+    # truncated or rotated files, and invalid cursors start anew
+    fpath.write_text('c1\n')
+    content, cursor = utils.follow_logfile(fpath, cursor, 2)
+    assert content == 'c1\n'
+    fpath.rename(tmp_path / 'logfile.1')
+    fpath.write_text('d1\nd2\n')
+    assert utils.follow_logfile(fpath, cursor, 2)[0] == 'd1\nd2\n'
+    assert utils.follow_logfile(fpath, 'garbage', 2)[0] == 'd1\nd2\n'
+
+
+def test_init_system(monkeypatch):
+    probes = []
+
+    def probe():
+        probes.append(1)
+        return 'sysvinit'
+    monkeypatch.setattr(utils, '_probe_init_system', probe)
+    monkeypatch.setattr(utils, '_init_system', None)
+    assert utils.determine_init_system() == 'sysvinit'
+    assert utils.determine_init_system() == 'sysvinit'
+    assert len(probes) == 1
+
+    utils.set_init_system('systemd')
+    try:
+        assert utils.determine_init_system() == 'systemd'
+    finally:
+        utils.set_init_system(None)
+    assert utils.determine_init_system() == 'sysvinit'
+    assert len(probes) == 1
+
+
+def test_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, '_metrics', [])
+    counter = metrics.Counter('test_total', 'A counter.', ['name'])
+    histogram = metrics.Histogram('test_seconds', 'A histogram.',
+                                  buckets=(0.1, 1.0))
+    counter.inc(name='a')
+    counter.inc(2, name='a"b')
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert histogram.get() == (3, 5.55)
+    assert metrics.render().splitlines() == [
+        '# HELP test_total A counter.',
+        '# TYPE test_total counter',
+        'test_total{name="a"} 1',
+        'test_total{name="a\\"b"} 2',
+        '# HELP test_seconds A histogram.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1.0"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        'test_seconds_sum 5.55',
+        'test_seconds_count 3',
+    ]
+
+
+def test_probe_hosts():
+    with socket.socket() as server:
+        server.bind(('127.0.0.1', 0))
+        server.listen(10)
+        port = server.getsockname()[1]
+        hosts = [f'127.0.0.{i}' for i in range(1, 255)]
+        progress = []
+        found = list(scan.probe_hosts(hosts, port, max_pending=16,
+                                      progress=progress.append))
+        assert found == ['127.0.0.1']
+        assert progress[-1] == len(hosts)
+
+
+class MockScanSocket:
+    replies = []
+
+    def __init__(self, *_args):
+        self.replies = list(self.replies)
+
+    def setsockopt(self, *_args):
+        pass
+
+    def sendto(self, *_args):
+        pass
+
+    def recvfrom(self, _bufsize):
+        return self.replies.pop(0)
+
+    def close(self):
+        pass
+
+
+def test_scan_slow_names(monkeypatch):
+    release = threading.Event()
+
+    def gethostbyaddr(addr):
+        looked_up.append(addr)
+        if addr == '127.0.1.1':
+            time.sleep(0.2)
+            return ('slow', [], [addr])
+        if addr == '127.0.1.2':
+            release.wait(5)
+        if addr == '127.0.1.3':
+            raise OSError
+        return (f'host{addr[-1]}', [], [addr])
+
+    def select(rlist, _wlist, _xlist, timeout):
+        if rlist[0].replies:
+            return rlist, [], []
+        time.sleep(timeout)
+        return [], [], []
+
+    MockScanSocket.replies = [(f'PONG 3 uid{i}'.encode(), (f'127.0.1.{i}', 1))
+                              for i in range(1, 6)]
+    # only replace the modules as seen by the scan module
+    monkeypatch.setattr(scan, 'socket', types.SimpleNamespace(
+        socket=MockScanSocket, gethostbyaddr=gethostbyaddr,
+        AF_INET=socket.AF_INET, SOCK_DGRAM=socket.SOCK_DGRAM,
+        SOL_SOCKET=socket.SOL_SOCKET, SO_BROADCAST=socket.SO_BROADCAST))
+    monkeypatch.setattr(scan, 'select', types.SimpleNamespace(select=select))
+    monkeypatch.setattr(scan, 'netifaces', None)
+    monkeypatch.setattr(scan, 'RESOLVE_TIMEOUT', 0.5)
+    monkeypatch.setattr(scan, '_names', {})
+    lookups = {}
+    monkeypatch.setattr(scan, '_lookups', lookups)
+    looked_up = []
+
+    try:
+        started = time.monotonic()
+        found = list(scan.scan('', 0.3))
+        # the hanging lookup does not delay the other ones
+        assert time.monotonic() - started < 1.0
+        assert sorted(found) == [('127.0.1.2', 3), ('127.0.1.3', 3),
+                                 ('host4', 3), ('host5', 3), ('slow', 3)]
+
+        # names are cached, and lookups in progress are not repeated
+        del looked_up[:]
+        found = list(scan.scan('', 0.3))
+        assert len(found) == 5
+        assert looked_up == []
+    finally:
+        # let the hanging lookup finish before the module is restored
+        release.set()
+        wait(100, lambda: not lookups)
+
+
 def test_lazy_property():
     class Test:
         @utils.lazy_property
@@ -102,6 +294,51 @@ def test_async_process():
     assert proc.done
 
 
+def test_async_process_concurrent(monkeypatch):
+    # use a fresh runner; other tests' jobs may still be polling though
+    monkeypatch.setattr(utils, 'process_runner', utils.ProcessRunner())
+    threads = threading.active_count()
+    procs = [utils.AsyncProcess(0, logger, f'sleep 0.5; echo {i}')
+             for i in range(50)]
+    for proc in procs:
+        proc.start()
+    # processes don't need a thread each
+    wait(100, lambda: utils.process_runner.stats()['in_flight'] >= 50)
+    assert threading.active_count() <= threads + 1
+    for proc in procs:
+        proc.join()
+    assert [proc.stdout for proc in procs] == [[f'{i}\n'] for i in range(50)]
+    assert all(proc.retcode == 0 for proc in procs)
+    stats = utils.process_runner.stats()
+    assert stats['peak'] >= 50
+    assert stats['started'] >= 50
+
+
+def test_async_process_timeout(monkeypatch):
+    monkeypatch.setattr(utils, 'process_runner', utils.ProcessRunner())
+    proc = utils.AsyncProcess(0, logger, 'echo before; sleep 10', timeout=0.5)
+    proc.start()
+    proc.join()
+    assert proc.done
+    assert proc.retcode == -1
+    assert proc.stdout == ['before\n']
+    assert utils.process_runner.stats()['timeouts'] >= 1
+    # the killed process has been waited for
+    assert proc._proc.returncode is not None  # noqa: SLF001
+
+
+def test_async_process_long_line(monkeypatch):
+    runner = utils.ProcessRunner()
+    runner.LINE_LIMIT = 100
+    monkeypatch.setattr(utils, 'process_runner', runner)
+    proc = utils.AsyncProcess(0, logger, 'printf "%0500d\\n"; echo after')
+    proc.start()
+    proc.join()
+    # the long line is truncated, and the output after it is still read
+    assert proc.stdout == ['0' * 100 + '\n', 'after\n']
+    assert proc.retcode == 0
+
+
 class Unrepr:
     """An object whose repr() raises."""
 
@@ -0,0 +1,199 @@
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-present by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for the D-Bus systemd unit watcher."""
+
+import logging
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+from marche import polling, systemdbus
+from marche.jobs import DEAD, RUNNING
+from marche.polling import Poller, SystemdCollector
+from test.utils import wait
+
+jeepney = systemdbus.jeepney
+
+pytestmark = pytest.mark.skipif(jeepney is None,
+                                reason='jeepney not available')
+
+logger = logging.getLogger('testsystemdbus')
+
+
+class FakeSystemd:
+    """Owns the systemd bus name and answers the calls the watcher makes."""
+
+    def __init__(self, address):
+        self.conn = jeepney.io.blocking.open_dbus_connection(address)
+        self.conn.send_and_get_reply(jeepney.message_bus.RequestName(
+            systemdbus.SYSTEMD_BUS_NAME))
+        self.substates = {'foo.service': 'running', 'bar.service': 'dead'}
+        self.subscribed = threading.Event()
+        self._stop = False
+        self._thread = threading.Thread(target=self._entry, daemon=True)
+        self._thread.start()
+
+    def path(self, unit):
+        return systemdbus.UNIT_PATH_PREFIX + '/' + unit.replace('.', '_2e')
+
+    def set_substate(self, unit, substate):
+        self.substates[unit] = substate
+        addr = jeepney.DBusAddress(self.path(unit),
+                                   interface='org.freedesktop.DBus.Properties')
+        self.conn.send(jeepney.new_signal(
+            addr, 'PropertiesChanged', 'sa{sv}as',
+            (systemdbus.UNIT_INTERFACE, {'SubState': ('s', substate)}, [])))
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        self.conn.close()
+
+    def _entry(self):
+        while not self._stop:
+            try:
+                msg = self.conn.receive(timeout=0.1)
+            except TimeoutError:
+                continue
+            if msg.header.message_type != jeepney.MessageType.method_call:
+                continue
+            member = msg.header.fields[jeepney.HeaderFields.member]
+            if member == 'Subscribe':
+                self.subscribed.set()
+                reply = jeepney.new_method_return(msg)
+            elif member == 'LoadUnit':
+                unit = msg.body[0]
+                if unit in self.substates:
+                    reply = jeepney.new_method_return(msg, 'o',
+                                                      (self.path(unit),))
+                else:
+                    reply = jeepney.new_error(
+                        msg, 'org.freedesktop.systemd1.NoSuchUnit')
+            elif member == 'Get':
+                path = msg.header.fields[jeepney.HeaderFields.path]
+                unit = next(u for u in self.substates if self.path(u) == path)
+                reply = jeepney.new_method_return(
+                    msg, 'v', (('s', self.substates[unit]),))
+            else:
+                reply = jeepney.new_error(
+                    msg, 'org.freedesktop.DBus.Error.UnknownMethod')
+            self.conn.send(reply)
+
+
+@pytest.fixture
+def bus():
+    daemon = shutil.which('dbus-daemon')
+    if not daemon:
+        pytest.skip('dbus-daemon not available')
+    proc = subprocess.Popen([daemon, '--session', '--nofork', '--print-address'],
+                            stdout=subprocess.PIPE, text=True)
+    try:
+        address = proc.stdout.readline().strip()
+        fake = FakeSystemd(address)
+        yield address, fake
+        fake.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def test_mangle():
+    assert systemdbus.mangle_unit_name('foo') == 'foo.service'
+    assert systemdbus.mangle_unit_name('foo@bar') == 'foo@bar.service'
+    assert systemdbus.mangle_unit_name('foo.target') == 'foo.target'
+
+
+def test_watcher(bus):
+    address, fake = bus
+    changes = []
+    watcher = systemdbus.SystemdWatcher(changes.append, logger, bus=address)
+    watcher.watch(['foo', 'bar', 'missing'])
+    watcher.start()
+    try:
+        wait(100, lambda: watcher.connected and len(changes) == 1)
+        assert fake.subscribed.is_set()
+        assert changes == [{'foo', 'bar'}]
+        assert watcher.substates == {'foo': 'running', 'bar': 'dead'}
+
+        fake.set_substate('bar.service', 'running')
+        wait(100, lambda: len(changes) == 2)
+        assert changes[1] == {'bar'}
+        assert watcher.substates['bar'] == 'running'
+
+        # units added later are loaded by the thread
+        watcher.watch(['foo', 'baz.service'])
+        fake.substates['baz.service'] = 'failed'
+        wait(100, lambda: len(changes) == 3)
+        assert changes[2] == {'baz.service'}
+        assert watcher.substates['baz.service'] == 'failed'
+    finally:
+        watcher.stop()
+
+
+class MockJob:
+    """A job whose only service is the state of a systemd unit."""
+
+    name = 'mock'
+    log = logger
+
+    def __init__(self, unit):
+        self.lock = threading.Lock()
+        self.unit = unit
+        self.systemd_substates = {}
+
+    def systemd_units(self):
+        return [('systemctl', self.unit)]
+
+    def all_service_status(self):
+        substate = self.systemd_substates.get(self.unit)
+        return {('systemd', self.unit):
+                (RUNNING if substate == 'running' else DEAD, '')}
+
+
+def test_collector(bus, monkeypatch):
+    address, fake = bus
+    collector = SystemdCollector()
+    monkeypatch.setattr(polling, 'systemd_collector', collector)
+    events = []
+    poller = Poller(MockJob('bar'), 3.0, events.append)
+    try:
+        collector.enable_dbus(logger, bus=address)
+        wait(100, lambda: collector.watcher.connected)
+        # the D-Bus state is used as soon as the unit is subscribed
+        collector.watcher.watch(['bar'])
+        wait(100, lambda: 'bar' in collector.watcher.substates)
+        poller.start()
+        assert poller.collector is collector
+        wait(100, lambda: len(events) == 1)
+        assert (events[0].instance, events[0].state) == ('bar', DEAD)
+
+        # and changes of the unit are reported right away
+        fake.set_substate('bar.service', 'running')
+        wait(100, lambda: len(events) == 2)
+        assert (events[1].instance, events[1].state) == ('bar', RUNNING)
+    finally:
+        poller.stop()
+        collector.stop()
@@ -24,17 +24,22 @@
 """Utilities for the tests."""
 
 import logging
+import sys
 import time
+import types
 
 from marche.auth import AuthFailed
 from marche.jobs import DEAD, RUNNING, Busy, Denied, Fault
 from marche.jobs.base import Job as BaseJob
 from marche.permission import ADMIN, DISPLAY, NONE, ClientInfo
 from marche.protocol import (
+    BulkControlResponse,
     ConffileResponse,
     ControlOutputResponse,
+    Errors,
     FoundHostResponse,
     LogfileResponse,
+    LogUpdateResponse,
     ServiceListResponse,
     StatusResponse,
 )
@@ -128,7 +133,7 @@ class MockJobHandler:
     def scan_network(self):
         self.emit_event(FoundHostResponse('testhost', 2))
 
-    def request_service_list(self, _client):
+    def request_service_list(self, _client, known_generation=None):
         if self.test_svc_list_error:
             raise Fault('uh oh')
         svcs = {'svc': {
@@ -137,7 +142,9 @@ class MockJobHandler:
             'instances': {
                 '': {'desc': '', 'state': DEAD, 'ext_status': ''},
                 'inst': {'desc': '', 'state': DEAD, 'ext_status': ''}}}}
-        return ServiceListResponse(services=svcs)
+        if known_generation == 'gen1':
+            return ServiceListResponse(services=None, generation='gen1')
+        return ServiceListResponse(services=svcs, generation='gen1')
 
     def filter_services(self, _client, _event):
         return ServiceListResponse(services={})
@@ -159,7 +166,17 @@ class MockJobHandler:
     def request_logfiles(self, _client, service, instance):
         return LogfileResponse(service=service, instance=instance,
                                files={'file1': 'line1\nline2\n',
-                                      'file2': 'line3\nline4\n'})
+                                      'file2': 'line3\nline4\n',
+                                      'dir:1/file3': 'line:5\n'})
+
+    def request_logfiles_since(self, _client, service, instance, cursors):
+        if cursors.get('file1') == '1:12':
+            return LogUpdateResponse(service=service, instance=instance,
+                                     files={'file1': 'line5\n'},
+                                     cursors={'file1': '1:18'})
+        return LogUpdateResponse(service=service, instance=instance,
+                                 files={'file1': 'line1\nline2\n'},
+                                 cursors={'file1': '1:12'})
 
     def request_conffiles(self, _client, service, instance):
         return ConffileResponse(service=service, instance=instance,
@@ -183,6 +200,12 @@ class MockJobHandler:
     def restart_service(self, _client, _service, _instance):
         raise Fault('cannot do this')
 
+    def control_services(self, _client, action, _patterns):
+        if action == 'kill':
+            raise Fault('unknown action')
+        return BulkControlResponse([('svc', 'inst', 0, ''),
+                                    ('svc', '', Errors.BUSY, 'busy')])
+
     def send_conffile(self, _client, _service, _instance, _filename, _contents):
         raise ValueError('no conf files')
 
@@ -203,6 +226,8 @@ class MockAuthHandler:
 class MockIface:
     """Standin for an interface from the handler side."""
 
+    iface_name = 'mock'
+
     def __init__(self, events):
         self.test_events = events
 
@@ -246,6 +271,11 @@ class MockJob(BaseJob):
     def service_logs(self, service, instance):
         return {'log:' + instance: service}
 
+    def service_logs_since(self, service, instance, cursors):
+        cursor = cursors.get('log:' + instance, '0')
+        return ({'log:' + instance: service},
+                {'log:' + instance: str(int(cursor) + 1)})
+
     def start_service(self, service, instance):
         if service == 'svc1':
             raise Busy
@@ -266,3 +296,15 @@ class MockJob(BaseJob):
 
     def send_config(self, _service, _instance, filename, contents):
         self.test_configs[filename] = contents
+
+
+class NamedJob(MockJob):
+    """Job with a single service named like the job."""
+
+    def get_services(self):
+        return [(self.name, '')]
+
+
+sys.modules['marche.jobs.testnamed'] = \
+    types.ModuleType('marche.jobs.testnamed')
+sys.modules['marche.jobs.testnamed'].Job = NamedJob